@@ -10,109 +10,136 @@ Show the names of employees hired after January 1st, 2020.
 """
 import streamlit as st
 import pandas as pd
-import sqlite3
-import re
-import sqlparse
-from sqlalchemy import create_engine, text
-from sqlalchemy import inspect
-from sqlalchemy.exc import SQLAlchemyError
+import altair as alt
+import os
+import time
 from agno.agent import Agent
-from groq import Groq
+import engine_registry
+import schema_catalog
+import schema_retrieval
+import generation_cache
+import index_advisor
+import llm_client
+import query_templates
+import result_export
+import result_pager
+import cost_guard
+import fanout
+import query_jobs
+import result_cache
+import sql_loader
+import sqlite_sessions
+import file_ingest
+import speculation
+import sql_validation
+import sqlgenius_core as core
+import telemetry
  
 # ----------- DB Helper -----------
-def get_engine(db_type, config):
-    if db_type == "SQLite":
-        return create_engine("sqlite:///sample.db")
-    elif db_type == "PostgreSQL":
-        return create_engine(
-            f"postgresql+psycopg2://{config['user']}:{config['password']}@{config['host']}:{config['port']}/{config['dbname']}"
-        )
-    elif db_type == "MySQL":
-        return create_engine(
-            f"mysql+pymysql://{config['user']}:{config['password']}@{config['host']}:{config['port']}/{config['dbname']}"
-        )
+def get_engine(db_type, config, pool_options=None, replica_url=None):
+    return core.get_engine(db_type, config, pool_options, replica_url)
  
 # ----------- Schema Extraction -----------
 def extract_schema(engine):
-    try:
-        inspector = inspect(engine)
-        schema_lines = []
-        for table_name in inspector.get_table_names():
-            columns = inspector.get_columns(table_name)
-            col_defs = [f"{col['name']} {col['type']}" for col in columns]
-            schema_lines.append(f"{table_name}({', '.join([col['name'] for col in columns])})")
-        return "\n".join(schema_lines)
-    except Exception as e:
-        return "-- Failed to extract schema: " + str(e)
+    return core.extract_schema(engine)
  
+def sql_dialect():
+    if "engine" in st.session_state:
+        return st.session_state.engine.dialect.name
+    return st.session_state.get("db_type", "SQLite").lower()
+
 # ----------- Agents -----------
+# The pipeline itself lives in sqlgenius_core; the agents map session state onto it.
 class SQLConnectorAgent(Agent):
     def connect(self, engine):
         try:
-            with engine.connect() as conn:
-                conn.execute(text("SELECT 1"))
+            core.check_connection(engine)
             return "✅ Connection successful!"
         except Exception as e:
             return f"❌ Connection failed: {str(e)}"
  
 class SQLCreatorAgent(Agent):
-    def generate_sql(self, user_input):
-        client = Groq(api_key=st.session_state.groq_api_key)
-        model = st.session_state.selected_model
- 
+    def match_template(self, user_input):
+        """Rendered SQL from a promoted template matching the question, or None."""
+        st.session_state.template_match = None
+        if not st.session_state.get("templates_enabled", True) or "engine" not in st.session_state:
+            return None
+        catalog = core.load_catalog(st.session_state.engine)
+        if catalog is None:
+            return None
+        with telemetry.span("template_match"):
+            template_match = query_templates.get_store().match(user_input, catalog.fingerprint, sql_dialect())
+        if template_match is None:
+            return None
+        st.session_state.template_match = template_match
+        for name in ("speculation", "generation_stats", "schema_stats", "validation"):
+            st.session_state[name] = None
+        st.session_state.generation_cache_hit = False
+        return template_match["rendered"]
+
+    def generate_sql(self, user_input, on_text=None):
+        catalog = None
+        schema = None
         if "engine" in st.session_state:
-            schema = extract_schema(st.session_state.engine)
-        else:
-            schema = "-- No database connected."
+            catalog = core.load_catalog(st.session_state.engine)
+            if catalog is None:
+                schema = extract_schema(st.session_state.engine)
+ 
+        cache = None
+        if st.session_state.get("gen_cache_enabled", True):
+            cache = generation_cache.get_cache(
+                max_entries=st.session_state.get("gen_cache_max_entries", generation_cache.DEFAULT_MAX_ENTRIES),
+                ttl_seconds=st.session_state.get("gen_cache_ttl_hours", generation_cache.DEFAULT_TTL_SECONDS // 3600) * 3600,
+                near_duplicates=st.session_state.get("gen_cache_near_duplicates", False),
+                similarity_threshold=st.session_state.get("gen_cache_threshold", generation_cache.DEFAULT_SIMILARITY_THRESHOLD),
+            )
  
-        prompt = (
-            f"You are an expert SQL assistant. Based on the following schema and request, write a SQL query.\n"
-            f"Schema:\n{schema}\n\n"
-            f"Request: {user_input}\n\n"
-            f"Respond ONLY with a valid SQL query. No explanation, markdown, or comments."
+        result = core.generate_sql(
+            core.groq_client(st.session_state.groq_api_key),
+            st.session_state.selected_model,
+            user_input,
+            catalog=catalog,
+            schema=schema,
+            dialect=sql_dialect(),
+            cache=cache,
+            top_k=st.session_state.get("schema_top_k", schema_retrieval.DEFAULT_TOP_K),
+            token_budget=st.session_state.get("schema_token_budget", schema_retrieval.DEFAULT_TOKEN_BUDGET),
+            stream=st.session_state.get("stream_generation", True),
+            on_text=on_text,
+            validate=st.session_state.get("validate_sql", True),
+            max_repairs=st.session_state.get("max_repairs", sql_validation.DEFAULT_MAX_REPAIRS),
+            speculate=st.session_state.get("speculative_candidates", 1),
+            engine=st.session_state.get("engine"),
         )
+        st.session_state.speculation = result["speculation"]
+        st.session_state.generation_cache_hit = result["cache_hit"]
+        st.session_state.generation_stats = result["generation_stats"]
+        st.session_state.schema_stats = result["schema_stats"]
+        st.session_state.validation = result["validation"]
+        return result["sql"]
  
-        response = client.chat.completions.create(
-            model=model,
-            messages=[{"role": "user", "content": prompt}]
+class SQLRunnerAgent(Agent):
+    def cached_result(self, query, engine, page_size, params=None):
+        return core.cached_result(engine, query, page_size, params)
+ 
+    def submit_query(self, query, engine, timeout_s, page_size, max_rows, max_bytes, params=None):
+        return core.submit_query(
+            engine, query, timeout_s, page_size=page_size, max_rows=max_rows, max_bytes=max_bytes, params=params
         )
-        full_response = response.choices[0].message.content
  
-        clean_text = full_response.replace("```sql", "").replace("```", "").strip()
-        parsed = sqlparse.parse(clean_text)
-        if parsed and len(parsed) > 0:
-            return str(parsed[0]).strip()
-        else:
-            return "-- Error: No valid SQL statement found."
+    def cache_result(self, job):
+        return core.cache_result(job)
  
-class SQLRunnerAgent(Agent):
-    def run_query(self, query, engine):
+    def run_query(self, query, engine, params=None):
         try:
-            with engine.connect() as conn:
-                df = pd.read_sql_query(text(query), conn)
-            return df
-        except SQLAlchemyError as e:
-            st.markdown("Database error occurred",e)
-            
+            return core.run_query(engine, query, params)
         except Exception as e:
-            st.markdown("Unexpected error occurred",e)
-            
-
-        # except Exception as e:
-        #     return f"Error running query: {str(e)}"
-        
-
-        
-# except SQLAlchemyError as e:
-#         logging.error("Database error occurred", exc_info=True)
-#         raise RuntimeError("A database error occurred while running the query.") from e
-#     except Exception as e:
-#         logging.error("Unexpected error occurred", exc_info=True)
-#         raise RuntimeError("An unexpected error occurred while running the query.") from e
+            st.markdown(f"Database error occurred: {e}")
 
  
 # ----------- Streamlit UI -----------
 st.set_page_config(page_title="Agentic SQL App", layout="centered")
+metrics_port = telemetry.start_metrics_server()
  
 # Add the title with reference URLs inline and embedded
 st.markdown("🧠 SQLGenius powered by @ <a href='https://www.groq.com/' target='_blank'>Groq</a> + <a href='https://www.agno.com/' target='_blank'>Agno</a>", unsafe_allow_html=True)
@@ -123,6 +150,14 @@ st.session_state.setdefault("groq_api_key", "")
 st.sidebar.text_input("Enter your GROQ API Key", type="password", key="groq_api_key")
 st.session_state["selected_model"] = "llama3-8b-8192"
 st.sidebar.info("Using preselected model: llama3-8b-8192")
+st.sidebar.checkbox("Stream SQL generation", value=True, key="stream_generation", help="Show SQL as it is generated and stop at the end of the first statement.")
+with st.sidebar.expander("🔁 LLM Client"):
+    llm_client.configure(
+        max_retries=st.number_input("Retries on 429 / 5xx", min_value=0, value=llm_client.DEFAULT_POLICY["max_retries"]),
+        hedge=st.checkbox("Hedge slow requests", value=llm_client.DEFAULT_POLICY["hedge"], help="Send a second request when the first is slower than the recent p95."),
+        breaker_failures=st.number_input("Open the circuit after failures", min_value=1, value=llm_client.DEFAULT_POLICY["breaker_failures"]),
+    )
+    st.json(llm_client.summary())
  
 st.sidebar.subheader("🗄️ Database Configuration")
 db_type = st.sidebar.selectbox("Select Database Type", ["SQLite", "PostgreSQL", "MySQL"])
@@ -130,39 +165,243 @@ st.session_state.db_type = db_type
  
 db_config = {}
 if db_type == "SQLite":
-    st.info("SQLite uses a local file `sample.db`.")
-    uploaded_file = st.sidebar.file_uploader("📤 Upload SQL file to setup database", type=["sql"])
-    if uploaded_file and st.sidebar.button("⚙️ Run SQL File to Setup DB"):
-        try:
-            sql_script = uploaded_file.read().decode("utf-8")
-            with sqlite3.connect("sample.db") as conn:
-                conn.executescript(sql_script)
-            st.success("✅ Database setup completed from SQL file.")
-        except Exception as e:
-            st.error(f"❌ Error executing SQL script: {str(e)}")
+    st.session_state.setdefault("sqlite_session_id", sqlite_sessions.new_session_id())
+    session_store = sqlite_sessions.get_store()
+    with st.sidebar.expander("🗂️ Session Database"):
+        if st.button("Reset to a fresh copy of sample.db"):
+            session_store.release(st.session_state.sqlite_session_id)
+            st.session_state.pop("engine", None)
+            st.session_state.pop("sqlite_session_started", None)
+        # Limits are set for the whole server (see sqlite_sessions), not per session
+        st.json(session_store.summary())
+    session_expired = st.session_state.get("sqlite_session_started") and not session_store.exists(st.session_state.sqlite_session_id)
+    try:
+        db_config = session_store.config(st.session_state.sqlite_session_id)
+    except sqlite_sessions.QuotaExceededError as e:
+        st.error(str(e))
+        st.stop()
+    st.session_state.sqlite_session_started = True
+    if session_expired:
+        st.warning(
+            f"⌛ Your session database was idle for over {session_store.idle_s // 60} minutes and has been reset "
+            "to a fresh copy of `sample.db`; tables you created or uploaded are gone."
+        )
+    st.info("SQLite uses a private copy of `sample.db` for this browser session.")
 else:
     db_config["host"] = st.text_input("Host", value="localhost")
     db_config["port"] = st.text_input("Port", value="5432" if db_type == "PostgreSQL" else "3306")
     db_config["user"] = st.text_input("Username", value="postgres" if db_type == "PostgreSQL" else "root")
     db_config["password"] = st.text_input("Password", type="password")
     db_config["dbname"] = st.text_input("Database Name")
+
+with st.sidebar.expander("⚙️ Connection Pool"):
+    pool_options = {
+        "pool_size": st.number_input("Pool size", min_value=1, value=engine_registry.DEFAULT_POOL_OPTIONS["pool_size"]),
+        "max_overflow": st.number_input("Max overflow", min_value=0, value=engine_registry.DEFAULT_POOL_OPTIONS["max_overflow"]),
+        "pool_recycle": st.number_input("Recycle after (seconds)", min_value=-1, value=engine_registry.DEFAULT_POOL_OPTIONS["pool_recycle"]),
+        "pool_pre_ping": st.checkbox("Pre-ping connections", value=engine_registry.DEFAULT_POOL_OPTIONS["pool_pre_ping"]),
+    }
+    replica_url = ""
+    if db_type != "SQLite":
+        replica_url = st.text_input("Read replica URL (optional)", help="Read-only SELECTs are sent here when set.")
+    if "engine" in st.session_state:
+        st.json(engine_registry.pool_status(st.session_state.engine))
  
+with st.sidebar.expander("🔎 Schema Retrieval"):
+    st.number_input("Max relevant tables (top-K)", min_value=1, value=schema_retrieval.DEFAULT_TOP_K, key="schema_top_k")
+    st.number_input("Schema token budget", min_value=100, value=schema_retrieval.DEFAULT_TOKEN_BUDGET, step=100, key="schema_token_budget")
+
+with st.sidebar.expander("🗃️ Generation Cache"):
+    st.checkbox("Cache generated SQL", value=True, key="gen_cache_enabled")
+    st.number_input("Max cached entries", min_value=1, value=generation_cache.DEFAULT_MAX_ENTRIES, key="gen_cache_max_entries")
+    st.number_input("Entry TTL (hours)", min_value=1, value=generation_cache.DEFAULT_TTL_SECONDS // 3600, key="gen_cache_ttl_hours")
+    st.checkbox("Match rephrased questions", value=False, key="gen_cache_near_duplicates")
+    st.slider("Similarity threshold", min_value=0.5, max_value=1.0, value=generation_cache.DEFAULT_SIMILARITY_THRESHOLD, step=0.01, key="gen_cache_threshold")
+    if st.session_state.gen_cache_enabled:
+        st.json(generation_cache.get_cache().summary())
+        if st.button("Clear generation cache"):
+            generation_cache.get_cache().clear()
+
+with st.sidebar.expander("✅ SQL Validation"):
+    st.checkbox("Validate generated SQL against the schema", value=True, key="validate_sql")
+    st.number_input("Max automatic repair attempts", min_value=0, value=sql_validation.DEFAULT_MAX_REPAIRS, key="max_repairs")
+    st.checkbox("Block invalid SQL from running", value=True, key="block_invalid_sql")
+    st.json(sql_validation.summary())
+    st.number_input(
+        "Speculative candidates (1 = off)", min_value=1, max_value=len(speculation.TEMPERATURES), value=1,
+        key="speculative_candidates",
+        help="Request several candidates at once and keep the first that passes validation and EXPLAIN. Costs extra tokens.",
+    )
+    if st.session_state.speculative_candidates > 1:
+        st.json(speculation.summary())
+
+with st.sidebar.expander("📄 Query Execution"):
+    st.checkbox("Fetch results in pages", value=True, key="paged_results", help="Runs the query in the background with a timeout and a Cancel button.")
+    st.number_input("Statement timeout (seconds)", min_value=1, value=query_jobs.DEFAULT_TIMEOUT_S, key="statement_timeout_s")
+    st.number_input("Rows per page", min_value=10, value=result_pager.DEFAULT_PAGE_SIZE, step=100, key="result_page_size")
+    st.number_input("Row cap", min_value=100, value=result_pager.DEFAULT_MAX_ROWS, step=1000, key="result_max_rows")
+    st.number_input("Byte cap (MB)", min_value=1, value=result_pager.DEFAULT_MAX_BYTES // (1024 * 1024), key="result_max_mb")
+
+with st.sidebar.expander("🛡️ Cost Guard"):
+    st.selectbox("When a query looks expensive", cost_guard.MODES, index=cost_guard.MODES.index(cost_guard.DEFAULT_POLICY["mode"]), key="cost_guard_mode")
+    st.number_input("Max estimated rows", min_value=1, value=cost_guard.DEFAULT_POLICY["max_rows"], step=10000, key="cost_guard_max_rows")
+    st.number_input("Max estimated cost", min_value=1.0, value=cost_guard.DEFAULT_POLICY["max_cost"], step=10000.0, key="cost_guard_max_cost")
+    st.number_input("Injected LIMIT", min_value=1, value=cost_guard.DEFAULT_POLICY["limit_rows"], step=100, key="cost_guard_limit_rows")
+
+with st.sidebar.expander("🧩 Query Templates"):
+    st.checkbox("Answer matching questions from templates", value=True, key="templates_enabled")
+    st.json(query_templates.get_store().summary())
+    template_entries = query_templates.get_store().entries()
+    if template_entries:
+        st.dataframe(pd.DataFrame(template_entries), hide_index=True)
+    if st.button("Clear templates"):
+        query_templates.get_store().clear()
+
+with st.sidebar.expander("📈 Index Advisor"):
+    if "engine" not in st.session_state:
+        st.caption("Connect to a database to collect a workload.")
+    else:
+        st.caption(f"{len(index_advisor.workload(st.session_state.engine))} approved queries recorded.")
+        if st.button("Analyze workload"):
+            try:
+                st.session_state.index_advice = index_advisor.advise(st.session_state.engine)
+            except Exception as e:
+                st.error(f"Index analysis failed: {e}")
+        index_advice = st.session_state.get("index_advice")
+        if index_advice:
+            st.caption(f"{len(index_advice['proposals'])} proposals from {index_advice['queries']} queries, {index_advice['method']}, {index_advice['elapsed_ms']:,.0f} ms")
+            if index_advice["proposals"]:
+                st.dataframe(pd.DataFrame(index_advice["proposals"]).drop(columns=["table", "columns"]), hide_index=True)
+                if st.session_state.engine.dialect.name == "sqlite" and st.button(f"Build {len(index_advice['proposals'])} index(es)"):
+                    try:
+                        index_advisor.create_indexes(st.session_state.engine, index_advice["proposals"])
+                        st.success("Indexes built.")
+                        st.session_state.pop("index_advice")
+                        st.session_state.pop("cost_estimate", None)
+                    except Exception as e:
+                        st.error(f"Index build failed: {e}")
+
+with st.sidebar.expander("♻️ Result Cache"):
+    st.checkbox("Reuse results while the data is unchanged", value=True, key="result_cache_enabled")
+    st.number_input("Memory budget (MB)", min_value=1, value=result_cache.DEFAULT_MAX_BYTES // (1024 * 1024), key="result_cache_mb")
+    st.json(result_cache.get_cache().summary())
+    if st.button("Clear result cache"):
+        result_cache.get_cache().clear()
+
+with st.sidebar.expander("🌐 Fan-out Targets"):
+    st.session_state.setdefault("fanout_targets", {})
+    fanout_name = st.text_input("Target name", placeholder="eu-west")
+    fanout_type = st.selectbox("Target type", ["PostgreSQL", "MySQL", "SQLite"], key="fanout_db_type")
+    if fanout_type == "SQLite":
+        # The session's own copy by default; only existing files are accepted, never created
+        fanout_options = {"sqlite_path": st.text_input(
+            "SQLite file", value=db_config.get("path", sqlite_sessions.DEFAULT_BASE_PATH),
+            key="fanout_path",
+        )}
+    else:
+        fanout_options = {
+            "host": st.text_input("Host", value="localhost", key="fanout_host"),
+            "port": st.text_input("Port", value="5432" if fanout_type == "PostgreSQL" else "3306", key="fanout_port"),
+            "user": st.text_input("Username", key="fanout_user"),
+            "password": st.text_input("Password", type="password", key="fanout_password"),
+            "dbname": st.text_input("Database Name", key="fanout_dbname"),
+        }
+    if st.button("➕ Add target"):
+        if not fanout_name.strip():
+            st.warning("Give the target a name.")
+        else:
+            try:
+                fanout_engine = get_engine(fanout_type, core.engine_config(fanout_type, **fanout_options), pool_options)
+                core.check_connection(fanout_engine)
+                st.session_state.fanout_targets[fanout_name.strip()] = fanout_engine
+            except FileNotFoundError as e:
+                st.error(f"❌ {e}")
+            except Exception as e:
+                st.error(f"❌ Connection failed: {str(e)}")
+    if st.session_state.fanout_targets:
+        st.multiselect("Run on", list(st.session_state.fanout_targets), default=list(st.session_state.fanout_targets), key="fanout_selected")
+        st.checkbox("Include the connected database", value=True, key="fanout_include_connected")
+        st.number_input("Per-target timeout (seconds)", min_value=1, value=fanout.DEFAULT_TIMEOUT_S, key="fanout_timeout_s")
+        if st.button("Remove unselected targets"):
+            st.session_state.fanout_targets = {
+                name: engine for name, engine in st.session_state.fanout_targets.items()
+                if name in st.session_state.get("fanout_selected", [])
+            }
+
+uploaded_file = st.sidebar.file_uploader("📤 Upload SQL file to setup database", type=["sql"])
+if uploaded_file and st.sidebar.button("⚙️ Run SQL File to Setup DB"):
+    if db_type == "SQLite":
+        target_engine = get_engine(db_type, db_config, pool_options)
+    else:
+        target_engine = st.session_state.get("engine")
+    if target_engine is None:
+        st.sidebar.warning("Connect to the database before running a setup script.")
+    else:
+        try:
+            load_progress = st.sidebar.progress(0.0)
+
+            def show_load_progress(p):
+                load_progress.progress(
+                    min(p["bytes"] / max(p["total_bytes"] or 1, 1), 1.0),
+                    text=f"{p['statements']:,} statements, {p['rows']:,} rows ({p['rows_per_s']:,.0f} rows/s)",
+                )
+
+            load_stats = sql_loader.load_script(target_engine, uploaded_file, total_bytes=uploaded_file.size, on_progress=show_load_progress)
+            load_progress.empty()
+            st.success(
+                f"✅ Database setup completed from SQL file: {load_stats['statements']:,} statements, "
+                f"{load_stats['rows']:,} rows in {load_stats['elapsed_s']:.2f}s ({load_stats['rows_per_s']:,.0f} rows/s)."
+            )
+            if st.session_state.get("engine") is target_engine:
+                st.session_state.schema_text = schema_catalog.get_catalog(target_engine).to_prompt(with_types=True)
+        except Exception as e:
+            st.error(f"❌ Error executing SQL script: {str(e)}")
+
+data_file = st.sidebar.file_uploader("📥 Upload CSV or Parquet as a table", type=["csv", "parquet"])
+if data_file:
+    st.sidebar.text_input("Table name", value=file_ingest.table_name_for(data_file.name), key="ingest_table")
+    st.sidebar.selectbox("If the table exists", file_ingest.IF_EXISTS, key="ingest_if_exists")
+    if st.sidebar.button("📥 Load File into Table"):
+        if db_type == "SQLite":
+            target_engine = get_engine(db_type, db_config, pool_options)
+        else:
+            target_engine = st.session_state.get("engine")
+        if target_engine is None:
+            st.sidebar.warning("Connect to the database before loading a file.")
+        else:
+            try:
+                ingest_progress = st.sidebar.progress(0.0)
+
+                def show_ingest_progress(p):
+                    ingest_progress.progress(
+                        min((p["bytes"] or 0) / max(p["total_bytes"] or 1, 1), 1.0),
+                        text=f"{p['rows']:,} rows ({p['rows_per_s']:,.0f} rows/s)",
+                    )
+
+                ingest_stats = file_ingest.ingest(
+                    target_engine, data_file, file_ingest.detect_format(data_file.name), st.session_state.ingest_table,
+                    if_exists=st.session_state.ingest_if_exists, total_bytes=data_file.size, on_progress=show_ingest_progress,
+                )
+                ingest_progress.empty()
+                st.success(
+                    f"✅ Loaded {ingest_stats['rows']:,} rows into `{ingest_stats['table']}` in "
+                    f"{ingest_stats['elapsed_s']:.2f}s ({ingest_stats['rows_per_s']:,.0f} rows/s)."
+                )
+                if st.session_state.get("engine") is target_engine:
+                    st.session_state.schema_text = schema_catalog.get_catalog(target_engine).to_prompt(with_types=True)
+            except Exception as e:
+                st.error(f"❌ Error loading file: {str(e)}")
+
 if st.button("🔌 Connect to Database"):
     try:
-        engine = get_engine(db_type, db_config)
+        engine = get_engine(db_type, db_config, pool_options, replica_url)
         st.session_state.engine = engine
         connector = SQLConnectorAgent(name="SQLConnector")
         result = connector.connect(engine)
         st.info(result)
  
         # --- Auto Schema Extraction ---
-        inspector = inspect(engine)
-        schema_lines = []
-        for table_name in inspector.get_table_names():
-            columns = inspector.get_columns(table_name)
-            col_defs = ", ".join([f"{col['name']} {col['type']}" for col in columns])
-            schema_lines.append(f"{table_name}({col_defs})")
-        st.session_state.schema_text = "\n".join(schema_lines)
+        st.session_state.schema_text = schema_catalog.get_catalog(engine).to_prompt(with_types=True)
         st.success("✅ Schema extracted successfully.")
         st.code(st.session_state.schema_text, language="sql")
  
@@ -179,21 +418,371 @@ if st.button("🧠 Generate SQL from Prompt"):
         st.warning("Please enter a business requirement.")
     else:
         creator = SQLCreatorAgent(name="SQLCreator")
-        generated_sql = creator.generate_sql(user_input)
+        preview = st.empty()
+        with telemetry.trace("generate") as generate_trace:
+            generated_sql = creator.match_template(user_input)
+            if generated_sql is None:
+                generated_sql = creator.generate_sql(user_input, on_text=lambda partial: preview.code(partial, language="sql"))
+        if st.session_state.template_match is None and not st.session_state.get("generation_cache_hit"):
+            # Latency saved by a template hit is credited against the average real generation
+            query_templates.get_store().observe_generation(generate_trace.total_ms)
+        st.session_state.last_trace = generate_trace
+        preview.empty()
         st.session_state.generated_sql = generated_sql
+        st.session_state.generated_question = user_input
+        schema_stats = st.session_state.get("schema_stats")
+        generation_stats = st.session_state.get("generation_stats")
+        if st.session_state.get("generation_cache_hit"):
+            st.caption("⚡ Served from the generation cache.")
+        template_match = st.session_state.get("template_match")
+        if template_match:
+            st.caption(
+                f"🧩 Matched template #{template_match['id']} in {template_match['match_ms']} ms, skipped the LLM "
+                f"(bound {', '.join(f'{k}={v!r}' for k, v in template_match['params'].items())})"
+            )
+        if schema_stats:
+            st.caption(
+                f"Schema context: {schema_stats['tables_selected']}/{schema_stats['tables_total']} tables, "
+                f"prompt ~{schema_stats['full_prompt_tokens']} → ~{schema_stats['prompt_tokens']} tokens "
+                f"({schema_stats['reduction_pct']}% smaller schema)"
+            )
+        if generation_stats:
+            st.caption(
+                f"Streamed: first token {generation_stats['time_to_first_token_ms']} ms, "
+                f"done in {generation_stats['total_ms']} ms"
+                + (" (stopped at end of first statement)" if generation_stats["cut_off"] else "")
+            )
+        speculation_report = st.session_state.get("speculation")
+        if speculation_report:
+            st.caption(
+                f"🏁 {speculation_report['candidates']} candidates in {speculation_report['elapsed_ms']:,.0f} ms: "
+                + (f"#{speculation_report['winner'] + 1} passed first" if speculation_report["winner"] is not None else "none passed")
+                + (", saving a retry" if speculation_report["retry_saved"] else "")
+                + f" ({speculation_report['cancelled']} cancelled, ~{speculation_report['extra_tokens']:,} extra tokens)"
+            )
+        validation = st.session_state.get("validation")
+        if validation and validation["repaired"]:
+            st.caption(f"🔧 Fixed locally detected errors in {validation['attempts']} repair attempt(s).")
+        elif validation and not validation["ok"]:
+            st.warning("⚠️ Generated SQL failed validation: " + "; ".join(validation["errors"]))
  
 if "generated_sql" in st.session_state:
     st.subheader("📝 Review and Approve SQL")
     edited_sql = st.text_area("Edit SQL if needed:", value=st.session_state.generated_sql, height=150, key="edited_sql")
+ 
+    # --- Pre-execution cost estimate ---
+    cost_policy = {
+        "mode": st.session_state.get("cost_guard_mode", cost_guard.DEFAULT_POLICY["mode"]),
+        "max_rows": st.session_state.get("cost_guard_max_rows", cost_guard.DEFAULT_POLICY["max_rows"]),
+        "max_cost": st.session_state.get("cost_guard_max_cost", cost_guard.DEFAULT_POLICY["max_cost"]),
+        "limit_rows": st.session_state.get("cost_guard_limit_rows", cost_guard.DEFAULT_POLICY["limit_rows"]),
+    }
+    cost_estimate = None
+    if cost_policy["mode"] != "Off" and "engine" in st.session_state and edited_sql.strip():
+        cached = st.session_state.get("cost_estimate")
+        if cached and cached[0] == edited_sql:
+            cost_estimate = cached[1]
+        else:
+            try:
+                cost_estimate = cost_guard.estimate(
+                    engine_registry.route_engine(st.session_state.engine, edited_sql), edited_sql
+                )
+            except Exception as e:
+                cost_estimate = {"error": str(e)}
+            st.session_state.cost_estimate = (edited_sql, cost_estimate)
+        if "error" in cost_estimate:
+            st.caption(f"🛡️ Could not estimate cost: {cost_estimate['error']}")
+        else:
+            st.caption(f"🛡️ Estimated: {cost_guard.describe(cost_estimate)}")
+ 
+    review_validation = None
+    if st.session_state.get("validate_sql", True) and edited_sql.strip():
+        catalog = None
+        if "engine" in st.session_state:
+            try:
+                catalog = schema_catalog.get_catalog(st.session_state.engine)
+            except Exception:
+                catalog = None
+        cached = st.session_state.get("review_validation")
+        if cached and cached[0] == edited_sql:
+            review_validation = cached[1]
+        else:
+            review_validation = sql_validation.validate(edited_sql, catalog, sql_dialect())
+            st.session_state.review_validation = (edited_sql, review_validation)
+        if review_validation["ok"]:
+            st.caption(f"✅ Validated against the schema in {review_validation['elapsed_ms']} ms")
+        else:
+            st.caption("❌ " + "; ".join(review_validation["errors"]))
+
     if st.button("✅ Approve and Run SQL"):
+        decision = {"action": "allow", "reasons": [], "query": edited_sql}
+        if cost_estimate and "error" not in cost_estimate:
+            decision = cost_guard.evaluate(cost_estimate, cost_policy, edited_sql)
         if "engine" not in st.session_state:
             st.error("Please connect to a database first.")
+        elif review_validation and not review_validation["ok"] and st.session_state.get("block_invalid_sql", True):
+            st.error("⛔ Query failed validation: " + "; ".join(review_validation["errors"]))
+        elif decision["action"] == "block":
+            st.error("⛔ Query blocked by the cost guard: " + "; ".join(decision["reasons"]))
         else:
+            if decision["action"] == "warn":
+                st.warning("⚠️ Expensive query: " + "; ".join(decision["reasons"]))
+            elif decision["action"] == "limit":
+                st.warning(f"⚠️ {'; '.join(decision['reasons'])}. Running with LIMIT {cost_policy['limit_rows']}.")
+            index_advisor.record(st.session_state.engine, edited_sql, cost_estimate)
+            edited_sql = decision["query"]
+            # Unedited template SQL runs as the parameterized statement (bound values, one statement text)
+            query, query_params = edited_sql, None
+            template_match = st.session_state.get("template_match")
+            if template_match and edited_sql.strip() == template_match["rendered"].strip():
+                query, query_params = template_match["sql"], template_match["params"]
+            # Kept so an export can re-run the query past the pager's row and byte caps
+            st.session_state.result_query = {"sql": query, "params": query_params}
             runner = SQLRunnerAgent(name="SQLRunner")
-            result = runner.run_query(edited_sql, st.session_state.engine)
-            if isinstance(result, pd.DataFrame):
-                st.success("✅ Query executed successfully.")
-                st.subheader("📊 SQL Query Result")
-                st.dataframe(result,hide_index=True)
+            # Closed (moved to last_trace) once the result has been rendered
+            run_trace = st.session_state.run_trace = telemetry.Trace("run")
+            if st.session_state.get("paged_results", True):
+                previous = st.session_state.pop("result_pager", None)
+                if previous is not None:
+                    previous.close()
+                page_size = st.session_state.get("result_page_size", result_pager.DEFAULT_PAGE_SIZE)
+                cached = None
+                if st.session_state.get("result_cache_enabled", True):
+                    result_cache.get_cache(max_bytes=st.session_state.get("result_cache_mb", result_cache.DEFAULT_MAX_BYTES // (1024 * 1024)) * 1024 * 1024)
+                    with telemetry.use(run_trace), telemetry.span("result_cache_lookup"):
+                        cached = runner.cached_result(query, st.session_state.engine, page_size, query_params)
+                if cached is not None:
+                    st.session_state.result_pager, saved_s = cached
+                    st.session_state.result_page = 0
+                    st.success(f"⚡ Served from the result cache (saved ~{saved_s:.2f}s).")
+                else:
+                    with telemetry.use(run_trace), telemetry.span("submit"):
+                        job = runner.submit_query(
+                            query,
+                            st.session_state.engine,
+                            timeout_s=st.session_state.get("statement_timeout_s", query_jobs.DEFAULT_TIMEOUT_S),
+                            page_size=page_size,
+                            max_rows=st.session_state.get("result_max_rows", result_pager.DEFAULT_MAX_ROWS),
+                            max_bytes=st.session_state.get("result_max_mb", result_pager.DEFAULT_MAX_BYTES // (1024 * 1024)) * 1024 * 1024,
+                            params=query_params,
+                        )
+                    st.session_state.query_job_id = job.id
             else:
-                st.error(result)
+                with telemetry.use(run_trace):
+                    with telemetry.span("query_execute") as span:
+                        result = runner.run_query(query, st.session_state.engine, query_params)
+                        if isinstance(result, pd.DataFrame):
+                            span["rows"] = len(result)
+                    if isinstance(result, pd.DataFrame):
+                        st.success("✅ Query executed successfully.")
+                        st.subheader("📊 SQL Query Result")
+                        with telemetry.span("render", rows=len(result)):
+                            st.dataframe(result,hide_index=True)
+                    else:
+                        st.error(result)
+                st.session_state.last_trace = st.session_state.pop("run_trace")
+ 
+    if st.button("🧩 Save as template", help="Reuse this SQL for the same question with other values, without the LLM."):
+        catalog = core.load_catalog(st.session_state.engine) if "engine" in st.session_state else None
+        if catalog is None:
+            st.error("Please connect to a database first.")
+        elif review_validation and not review_validation["ok"]:
+            st.error("⛔ Only SQL that passes validation can become a template.")
+        else:
+            try:
+                template = query_templates.get_store().promote(
+                    st.session_state.get("generated_question", ""), edited_sql, catalog.fingerprint, sql_dialect()
+                )
+                st.success(
+                    "🧩 Template saved with parameters "
+                    + ", ".join(f"{slot['name']} (e.g. {slot['example']!r})" for slot in template["slots"])
+                )
+            except ValueError as e:
+                st.warning(f"Could not make a template: {e}")
+
+    if st.session_state.get("fanout_targets") and st.button("🌐 Run on all targets"):
+        fanout_targets = {
+            name: engine for name, engine in st.session_state.fanout_targets.items()
+            if name in st.session_state.get("fanout_selected", list(st.session_state.fanout_targets))
+        }
+        if st.session_state.get("fanout_include_connected", True) and "engine" in st.session_state:
+            fanout_targets = {"connected": st.session_state.engine, **fanout_targets}
+        if not fanout_targets:
+            st.error("Select at least one target.")
+        elif review_validation and not review_validation["ok"] and st.session_state.get("block_invalid_sql", True):
+            st.error("⛔ Query failed validation: " + "; ".join(review_validation["errors"]))
+        else:
+            with telemetry.trace("fanout") as fanout_trace:
+                # One generation per extra dialect; targets sharing a dialect share the SQL
+                queries = core.sql_by_dialect(
+                    core.groq_client(st.session_state.groq_api_key) if st.session_state.get("groq_api_key") else None,
+                    st.session_state.selected_model,
+                    st.session_state.get("generated_question", ""),
+                    edited_sql,
+                    sql_dialect(),
+                    fanout_targets.values(),
+                    validate=st.session_state.get("validate_sql", True),
+                )
+                st.session_state.fanout_result = fanout.fan_out(
+                    fanout_targets,
+                    edited_sql,
+                    sql_by_dialect=queries,
+                    timeout_s=st.session_state.get("fanout_timeout_s", fanout.DEFAULT_TIMEOUT_S),
+                    max_rows=st.session_state.get("result_max_rows", result_pager.DEFAULT_MAX_ROWS),
+                )
+            st.session_state.last_trace = fanout_trace
+ 
+# --- Background query job ---
+@st.fragment(run_every=1.0)
+def show_query_job_progress(job):
+    status = job.poll()
+    if job.finished:
+        st.rerun()
+    st.info(f"⏳ Query {status['status']} for {status['elapsed_s']}s…")
+    if st.button("🛑 Cancel query"):
+        job.cancel()
+ 
+if "query_job_id" in st.session_state:
+    manager = query_jobs.get_manager()
+    job = manager.get(st.session_state.query_job_id)
+    if job is None:
+        del st.session_state["query_job_id"]
+    elif not job.finished:
+        show_query_job_progress(job)
+    else:
+        del st.session_state["query_job_id"]
+        manager.collect(job.id)
+        run_trace = st.session_state.get("run_trace")
+        if run_trace is not None and job.started_at is not None:
+            # The job ran on a worker thread, so its span is recorded from the job's own timing
+            run_trace.record(
+                "query_execute",
+                job.elapsed,
+                started_at=time.perf_counter() - (time.monotonic() - job.started_at),
+                rows=job.pager.rows_fetched if job.pager else 0,
+                bytes=job.pager.bytes_fetched if job.pager else 0,
+                status=job.status,
+            )
+        if job.status != query_jobs.DONE and run_trace is not None:
+            st.session_state.last_trace = st.session_state.pop("run_trace")
+        if job.status == query_jobs.DONE:
+            st.success(f"✅ Query executed successfully in {job.elapsed:.2f}s.")
+            if st.session_state.get("result_cache_enabled", True):
+                SQLRunnerAgent(name="SQLRunner").cache_result(job)
+            st.session_state.result_pager = job.pager
+            st.session_state.result_page = 0
+        elif job.status == query_jobs.CANCELLED:
+            st.warning("🛑 Query cancelled.")
+        elif job.status == query_jobs.TIMED_OUT:
+            st.error(f"⏱️ Query timed out after {job.timeout_s}s.")
+        else:
+            st.error(f"❌ Database error: {job.error}")
+ 
+if "result_pager" in st.session_state:
+    pager = st.session_state.result_pager
+    st.subheader("📊 SQL Query Result")
+    if not pager.returns_rows:
+        st.info(f"Statement executed, {pager.rowcount} row(s) affected.")
+    else:
+        page_index = st.session_state.get("result_page", 0)
+        prev_col, info_col, next_col = st.columns([1, 4, 1])
+        if prev_col.button("◀ Previous", disabled=page_index == 0):
+            page_index -= 1
+        if next_col.button("Next ▶", disabled=not pager.has_page(page_index + 1)):
+            if pager.page(page_index + 1) is not None:
+                page_index += 1
+        st.session_state.result_page = page_index
+        table = pager.page_table(page_index)
+        first_row = page_index * pager.page_size
+        info_col.caption(
+            f"Rows {first_row + 1 if table.num_rows else 0}–{first_row + table.num_rows} "
+            f"of {pager.rows_fetched}{'' if pager.exhausted else '+'} fetched"
+            + (" · cursor released after sitting idle, run the query again for the rest" if pager.released
+               else " · stopped at the row/byte cap" if pager.truncated else "")
+        )
+        render_trace = st.session_state.pop("run_trace", None)
+        with telemetry.use(render_trace), telemetry.span("render", rows=table.num_rows, bytes=table.nbytes):
+            st.dataframe(table, hide_index=True)
+        if render_trace is not None:
+            st.session_state.last_trace = render_trace
+
+        with st.expander("⬇️ Export all rows"):
+            export_format = st.selectbox("Format", list(result_export.FORMATS), key="export_format")
+            if st.button("Export"):
+                previous_export = st.session_state.pop("export", None)
+                if previous_export is not None and os.path.exists(previous_export["path"]):
+                    os.remove(previous_export["path"])
+                os.makedirs(result_export.DEFAULT_EXPORT_DIR, exist_ok=True)
+                export_path = os.path.join(
+                    result_export.DEFAULT_EXPORT_DIR, f"result_{time.strftime('%Y%m%d_%H%M%S')}.{export_format}"
+                )
+                export_status = st.empty()
+
+                def show_export_progress(p):
+                    export_status.caption(f"{p['rows']:,} rows written ({p['rows_per_s']:,.0f} rows/s, {p['mb_per_s']} MB/s)")
+
+                try:
+                    with telemetry.trace("export") as export_trace:
+                        if pager.exhausted and not pager.truncated:
+                            # Everything is already in memory; no need to ask the database again
+                            export_stats = result_export.export_pager(pager, export_format, export_path, on_progress=show_export_progress)
+                        else:
+                            result_query = st.session_state.result_query
+                            export_stats = result_export.export_query(
+                                st.session_state.engine, result_query["sql"], export_format, export_path,
+                                params=result_query["params"], on_progress=show_export_progress,
+                            )
+                    st.session_state.last_trace = export_trace
+                    st.session_state.export = dict(export_stats, path=export_path)
+                except Exception as e:
+                    if os.path.exists(export_path):
+                        os.remove(export_path)
+                    st.error(f"❌ Export failed: {e}")
+                export_status.empty()
+            export = st.session_state.get("export")
+            if export:
+                st.caption(
+                    f"{export['rows']:,} rows, {export['bytes'] / (1024 * 1024):,.1f} MB of {export['format']} in "
+                    f"{export['elapsed_s']:.2f}s ({export['rows_per_s']:,.0f} rows/s, {export['mb_per_s']} MB/s)"
+                )
+                if export["bytes"] <= result_export.DOWNLOAD_MAX_BYTES and os.path.exists(export["path"]):
+                    with open(export["path"], "rb") as export_file:
+                        st.download_button(
+                            "Download", export_file, file_name=os.path.basename(export["path"]),
+                            mime=result_export.FORMATS[export["format"]],
+                        )
+                else:
+                    st.caption(f"Too large to download through the browser; saved on the server at `{export['path']}`.")
+
+if "fanout_result" in st.session_state:
+    fanout_result = st.session_state.fanout_result
+    st.subheader("🌐 Fan-out Result")
+    failed = [t for t in fanout_result["targets"] if t["status"] != query_jobs.DONE]
+    st.caption(
+        f"{fanout_result['table'].num_rows:,} rows from {len(fanout_result['targets']) - len(failed)}/"
+        f"{len(fanout_result['targets'])} targets in {fanout_result['elapsed_ms']:,.0f} ms "
+        + ("(aggregates merged across targets)" if fanout_result["merge"] == "aggregate" else "(rows combined)")
+    )
+    if fanout_result.get("note"):
+        st.info("ℹ️ " + fanout_result["note"])
+    if failed:
+        st.warning("⚠️ Partial result, no rows from: " + ", ".join(f"{t['target']} ({t['status']})" for t in failed))
+    st.dataframe(fanout_result["table"], hide_index=True)
+    st.dataframe(pd.DataFrame(fanout_result["targets"]), hide_index=True)
+
+with st.sidebar.expander("⏱️ Timing"):
+    last_trace = st.session_state.get("last_trace")
+    if last_trace is not None and last_trace.spans:
+        st.caption(f"Last {last_trace.name}: {last_trace.total_ms:,.0f} ms")
+        spans = pd.DataFrame(last_trace.spans)
+        spans["end_ms"] = spans["offset_ms"] + spans["duration_ms"]
+        waterfall = alt.Chart(spans).mark_bar().encode(
+            x=alt.X("offset_ms:Q", title="ms"),
+            x2="end_ms:Q",
+            y=alt.Y("stage:N", sort=None, title=None),
+            tooltip=[c for c in spans.columns if c not in ("trace_id", "trace")],
+        )
+        st.altair_chart(waterfall, use_container_width=True)
+    st.json(telemetry.metrics.summary())
+    if metrics_port:
+        st.caption(f"Prometheus metrics: http://localhost:{metrics_port}/metrics")
@@ -0,0 +1,381 @@
+"""
+Headless HTTP API for SQLGenius.
+
+    python api_server.py --listen-port 8000 --db-type SQLite --sqlite-path sample.db
+
+Endpoints (JSON in, JSON out unless noted):
+
+- ``GET  /schema``    catalog of the configured database (``?format=prompt`` for prompt text)
+- ``POST /generate``  ``{"question", "model"?, "validate"?, "max_repairs"?, "candidates"?}`` -> SQL
+- ``POST /validate``  ``{"sql", "explain"?}`` -> validation result and optional cost estimate
+- ``POST /execute``   ``{"sql", "format"?: "ndjson" | "arrow", "max_rows"?, "timeout_s"?}``
+  streams rows as NDJSON or an Arrow IPC stream, one page at a time
+- ``GET  /metrics``   Prometheus text from the telemetry spans
+- ``GET  /health``
+
+Engines, the schema catalog, the generation cache and the result cache are the
+same process-wide singletons the Streamlit app uses. Blocking work (database
+calls, the generation cache, schema pruning and validation) runs on a bounded
+thread pool, so the event loop only waits on sockets. LLM calls go through the
+pooled async client in llm_client (retries, hedging, circuit breaker), and
+requests beyond ``--max-in-flight`` are turned away with 503 + Retry-After
+instead of queueing.
+"""
+import argparse
+import contextvars
+import functools
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pyarrow as pa
+import tornado.ioloop
+import tornado.web
+
+import cost_guard
+import engine_registry
+import generation_cache
+import query_jobs
+import result_pager
+import schema_catalog
+import schema_retrieval
+import speculation
+import sql_validation
+import sqlgenius_core as core
+import telemetry
+
+DEFAULT_MODEL = core.DEFAULT_MODEL
+DEFAULT_MAX_IN_FLIGHT = 64
+DEFAULT_DB_WORKERS = 8
+
+
+class _ChunkSink:
+    """File-like target for the Arrow IPC writer; the handler drains it after every batch."""
+
+    def __init__(self):
+        self.chunks = []
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _json_default(value):
+    return value.isoformat() if hasattr(value, "isoformat") else str(value)
+
+
+# ----------- Handlers -----------
+class BaseHandler(tornado.web.RequestHandler):
+    limited = True
+
+    def initialize(self, app_state):
+        self.state = app_state
+        self._counted = False
+
+    def prepare(self):
+        if self.limited:
+            if self.state["in_flight"] >= self.state["max_in_flight"]:
+                self.set_header("Retry-After", "1")
+                self.send_json({"error": "Server busy, retry shortly"}, status=503)
+                return
+            self.state["in_flight"] += 1
+            self._counted = True
+
+    def on_finish(self):
+        self._release()
+
+    def on_connection_close(self):
+        self._release()
+
+    def _release(self):
+        if self._counted:
+            self._counted = False
+            self.state["in_flight"] -= 1
+
+    def body(self):
+        try:
+            return json.loads(self.request.body or b"{}")
+        except json.JSONDecodeError as e:
+            raise tornado.web.HTTPError(400, reason=f"Invalid JSON: {e}")
+
+    def number(self, body, name, default, kind=int):
+        """``body[name]`` as ``kind``, turning a malformed value into a 400 instead of a 500."""
+        value = body.get(name)
+        if value is None:
+            return default
+        try:
+            return kind(value)
+        except (TypeError, ValueError):
+            raise tornado.web.HTTPError(400, reason=f"'{name}' must be a number")
+
+    def send_json(self, payload, status=200):
+        self.set_status(status)
+        self.set_header("Content-Type", "application/json")
+        self.finish(json.dumps(payload, default=_json_default))
+
+    def write_error(self, status_code, **kwargs):
+        message = self._reason
+        if "exc_info" in kwargs and not isinstance(kwargs["exc_info"][1], tornado.web.HTTPError):
+            message = f"{type(kwargs['exc_info'][1]).__name__}: {kwargs['exc_info'][1]}"
+        self.set_header("Content-Type", "application/json")
+        self.finish(json.dumps({"error": message}))
+
+    def run_blocking(self, fn, *args):
+        # The copied context carries the current telemetry trace into the worker thread
+        context = contextvars.copy_context()
+        return tornado.ioloop.IOLoop.current().run_in_executor(self.state["executor"], context.run, fn, *args)
+
+    async def catalog(self):
+        return await self.run_blocking(schema_catalog.get_catalog, self.state["engine"])
+
+
+class HealthHandler(BaseHandler):
+    limited = False
+
+    def get(self):
+        self.send_json({"status": "ok", "in_flight": self.state["in_flight"], "dialect": self.state["engine"].dialect.name})
+
+
+class MetricsHandler(BaseHandler):
+    limited = False
+
+    def get(self):
+        self.set_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.finish(telemetry.metrics.prometheus())
+
+
+class SchemaHandler(BaseHandler):
+    async def get(self):
+        catalog = await self.catalog()
+        if self.get_argument("format", "json") == "prompt":
+            self.set_header("Content-Type", "text/plain; charset=utf-8")
+            self.finish(catalog.to_prompt(with_types=True))
+            return
+        self.send_json({"dialect": catalog.dialect, "fingerprint": catalog.fingerprint, "tables": catalog.tables})
+
+
+class GenerateHandler(BaseHandler):
+    async def post(self):
+        body = self.body()
+        question = (body.get("question") or "").strip()
+        if not question:
+            raise tornado.web.HTTPError(400, reason="'question' is required")
+        client = self.state["llm_client"](self.request.headers.get("X-Groq-Api-Key"))
+        if client is None:
+            raise tornado.web.HTTPError(401, reason="No Groq API key configured; send X-Groq-Api-Key")
+        model = body.get("model") or self.state["model"]
+        with telemetry.trace("api-generate") as trace:
+            catalog = await self.catalog()
+            response = await core.agenerate_sql(
+                client, model, question, catalog=catalog, dialect=catalog.dialect,
+                cache=generation_cache.get_cache() if body.get("cache", True) else None,
+                top_k=self.number(body, "top_k", schema_retrieval.DEFAULT_TOP_K),
+                token_budget=self.number(body, "token_budget", schema_retrieval.DEFAULT_TOKEN_BUDGET),
+                validate=body.get("validate", True),
+                max_repairs=self.number(body, "max_repairs", None),
+                # Every candidate is a concurrent LLM request, so one request cannot ask for hundreds
+                speculate=min(max(self.number(body, "candidates", 1), 1), len(speculation.TEMPERATURES)),
+                engine=self.state["engine"],
+                run_blocking=self.run_blocking,
+            )
+        sql = response["sql"]
+        response["timings"] = trace.spans
+        self.send_json(response, status=422 if sql.startswith("-- Error") else 200)
+
+
+class ValidateHandler(BaseHandler):
+    async def post(self):
+        body = self.body()
+        sql = body.get("sql") or ""
+        catalog = await self.catalog()
+        response = await self.run_blocking(sql_validation.validate, sql, catalog, catalog.dialect)
+        if body.get("explain") and response["ok"]:
+            engine = engine_registry.route_engine(self.state["engine"], sql)
+            try:
+                response["estimate"] = await self.run_blocking(_estimate, engine, sql)
+            except Exception as e:
+                response["estimate"] = {"error": str(e)}
+        self.send_json(response)
+
+
+def _estimate(engine, sql):
+    estimate = cost_guard.estimate(engine, sql)
+    estimate["summary"] = cost_guard.describe(estimate)
+    estimate.pop("plan", None)
+    return estimate
+
+
+class ExecuteHandler(BaseHandler):
+    async def post(self):
+        body = self.body()
+        sql = (body.get("sql") or "").strip()
+        fmt = body.get("format", "ndjson")
+        if fmt not in ("ndjson", "arrow"):
+            raise tornado.web.HTTPError(400, reason="'format' must be ndjson or arrow")
+        catalog = await self.catalog()
+        if not self.state["allow_writes"]:
+            validation = await self.run_blocking(sql_validation.validate, sql, catalog, catalog.dialect)
+            if not validation["ok"]:
+                self.send_json({"error": "SQL failed validation", "errors": validation["errors"]}, status=422)
+                return
+        max_rows = min(max(self.number(body, "max_rows", self.state["max_rows"]), 1), self.state["max_rows"])
+        page_size = max(self.number(body, "page_size", result_pager.DEFAULT_PAGE_SIZE), 1)
+        timeout_s = self.number(body, "timeout_s", query_jobs.DEFAULT_TIMEOUT_S, float)
+        with telemetry.trace("api-execute") as trace:
+            hit = await self.run_blocking(core.cached_result, self.state["engine"], sql, page_size)
+            if hit is not None:
+                pager = hit[0]
+            else:
+                job = await self.run_blocking(
+                    functools.partial(
+                        core.prepare_query, self.state["engine"], sql,
+                        timeout_s,
+                        page_size=page_size, max_rows=max_rows, max_bytes=result_pager.DEFAULT_MAX_BYTES,
+                    )
+                )
+                self._job = job
+                start = time.perf_counter()
+                await self.run_blocking(job.run)
+                trace.record("query_execute", time.perf_counter() - start, start, status=job.status)
+                if job.status != query_jobs.DONE:
+                    status = 504 if job.status == query_jobs.TIMED_OUT else 499 if job.status == query_jobs.CANCELLED else 400
+                    self.send_json({"error": job.error, "status": job.status}, status=status)
+                    return
+                pager = job.pager
+            try:
+                await self._stream(pager, fmt)
+            finally:
+                pager.close()
+        if hit is None:
+            await self.run_blocking(core.cache_result, job)
+
+    async def _stream(self, pager, fmt):
+        self.set_header("X-Result-Columns", json.dumps(pager.columns))
+        if not pager.returns_rows:
+            self.send_json({"rowcount": pager.rowcount})
+            return
+        self.set_header("Content-Type", "application/vnd.apache.arrow.stream" if fmt == "arrow" else "application/x-ndjson")
+        sink = writer = None
+        index = 0
+        with telemetry.span("stream_result") as span:
+            while True:
+                batch = await self.run_blocking(pager.page, index)
+                if batch is None:
+                    break
+                if fmt == "arrow":
+                    if writer is None:
+                        sink = _ChunkSink()
+                        writer = pa.ipc.new_stream(sink, batch.schema)
+                    elif batch.schema != writer.schema:
+                        # Later pages can widen a type (e.g. a column that was all NULL at first)
+                        batch = batch.cast(writer.schema)
+                    writer.write_batch(batch)
+                    self.write(sink.drain())
+                else:
+                    names = batch.schema.names
+                    lines = [json.dumps(dict(zip(names, row)), default=_json_default) for row in zip(*batch.to_pydict().values())]
+                    self.write("\n".join(lines) + "\n")
+                # Waits for the client to take the page before fetching the next one
+                await self.flush()
+                index += 1
+            if writer is not None:
+                writer.close()
+                self.write(sink.drain())
+            span["rows"] = pager.rows_fetched
+            span["bytes"] = pager.bytes_fetched
+        self.finish()
+
+    def on_connection_close(self):
+        job = getattr(self, "_job", None)
+        if job is not None and not job.finished:
+            job.cancel()
+        super().on_connection_close()
+
+
+# ----------- App -----------
+def make_app(engine, api_key=None, model=DEFAULT_MODEL, max_in_flight=DEFAULT_MAX_IN_FLIGHT,
+             db_workers=DEFAULT_DB_WORKERS, max_rows=result_pager.DEFAULT_MAX_ROWS, allow_writes=False):
+    def llm_client(header_key):
+        key = header_key or api_key
+        # Pooled per key on the server's event loop, so connections are kept alive across requests
+        return core.async_groq_client(key) if key else None
+
+    state = {
+        "engine": engine,
+        "model": model,
+        "llm_client": llm_client,
+        "executor": ThreadPoolExecutor(max_workers=db_workers, thread_name_prefix="sqlgenius-api"),
+        "in_flight": 0,
+        "max_in_flight": max_in_flight,
+        "max_rows": max_rows,
+        "allow_writes": allow_writes,
+    }
+    routes = [
+        (r"/health", HealthHandler),
+        (r"/metrics", MetricsHandler),
+        (r"/schema", SchemaHandler),
+        (r"/generate", GenerateHandler),
+        (r"/validate", ValidateHandler),
+        (r"/execute", ExecuteHandler),
+    ]
+    return tornado.web.Application([(path, handler, {"app_state": state}) for path, handler in routes])
+
+
+def build_engine(args):
+    config = core.engine_config(
+        args.db_type, args.sqlite_path, args.host, args.db_port, args.user,
+        args.password or os.environ.get("DB_PASSWORD", ""), args.dbname,
+    )
+    pool_options = {"pool_size": args.db_workers, "max_overflow": 0}
+    return core.get_engine(args.db_type, config, pool_options, args.replica_url)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Serve SQLGenius over HTTP")
+    parser.add_argument("--listen-host", default="127.0.0.1")
+    parser.add_argument("--listen-port", type=int, default=8000)
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--api-key", default=os.environ.get("GROQ_API_KEY"), help="Defaults to $GROQ_API_KEY; clients may send X-Groq-Api-Key")
+    parser.add_argument("--max-in-flight", type=int, default=DEFAULT_MAX_IN_FLIGHT, help="Requests handled at once before answering 503")
+    parser.add_argument("--db-workers", type=int, default=DEFAULT_DB_WORKERS, help="Threads (and pooled connections) for database work")
+    parser.add_argument("--max-rows", type=int, default=result_pager.DEFAULT_MAX_ROWS, help="Upper bound on rows streamed per request")
+    parser.add_argument("--allow-writes", action="store_true", help="Let /execute run SQL that fails read-only validation")
+    parser.add_argument("--db-type", choices=["SQLite", "PostgreSQL", "MySQL"], default="SQLite")
+    parser.add_argument("--sqlite-path", default="sample.db")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--db-port")
+    parser.add_argument("--user")
+    parser.add_argument("--password", help="Defaults to $DB_PASSWORD")
+    parser.add_argument("--dbname")
+    parser.add_argument("--replica-url")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        engine = build_engine(args)
+    except FileNotFoundError as e:
+        sys.exit(str(e))
+    app = make_app(engine, args.api_key, args.model, args.max_in_flight, args.db_workers, args.max_rows, args.allow_writes)
+    app.listen(args.listen_port, address=args.listen_host)
+    print(f"SQLGenius API on http://{args.listen_host}:{args.listen_port} ({args.db_type})", file=sys.stderr)
+    tornado.ioloop.IOLoop.current().start()
+
+
+if __name__ == "__main__":
+    main()
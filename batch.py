@@ -0,0 +1,215 @@
+"""
+Headless batch mode: answer a file of business questions concurrently.
+
+    python batch.py questions.txt --out results.jsonl --concurrency 8 --rate 5
+    python batch.py questions.jsonl --out results.jsonl --execute --db-type SQLite --sqlite-path sample.db
+
+Questions come from a text file (one per line) or a JSONL file with a
+``question`` field and an optional ``id``. SQL is generated through AsyncGroq
+with a concurrency limit and a token-bucket rate limit, optionally executed on a
+pooled engine (read-only queries that pass validation only; nothing is ever
+committed), and each result is appended to the output JSONL as soon as it
+finishes. Re-running with the same output file skips questions that already
+succeeded, so a crashed run can simply be started again.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import sys
+import time
+
+import generation_cache
+import sqlgenius_core as core
+
+DEFAULT_MODEL = core.DEFAULT_MODEL
+
+
+# ----------- Input / Output -----------
+def load_questions(path):
+    questions = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if path.endswith(".jsonl"):
+                record = json.loads(line)
+                question = record["question"]
+                question_id = str(record.get("id") or _question_id(question))
+            else:
+                question = line
+                question_id = _question_id(question)
+            questions.append({"id": question_id, "question": question})
+    return questions
+
+
+def _question_id(question):
+    return hashlib.sha1(question.strip().encode("utf-8")).hexdigest()[:12]
+
+
+def completed_ids(out_path):
+    """Ids that already have a successful result in the output file."""
+    done = set()
+    if not os.path.exists(out_path):
+        return done
+    with open(out_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A crash can leave a half-written last line
+                continue
+            if not record.get("error"):
+                done.add(record["id"])
+    return done
+
+
+# ----------- Rate Limiting -----------
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+# ----------- Execution -----------
+async def answer(item, ctx):
+    record = {"id": item["id"], "question": item["question"], "sql": None, "error": None}
+    try:
+        generated = await core.agenerate_sql(
+            ctx["client"], ctx["model"], item["question"], catalog=ctx["catalog"],
+            cache=ctx["cache"], validate=False, before_call=ctx["bucket"].acquire,
+        )
+        sql = generated["sql"]
+        if ctx["cache"] is not None:
+            record["cache_hit"] = generated["cache_hit"]
+        if generated["generation_stats"]:
+            record["generate_ms"] = generated["generation_stats"]["total_ms"]
+        record["sql"] = sql
+        if sql.startswith("-- Error"):
+            record["error"] = sql
+        elif ctx["execute"]:
+            import sql_validation
+
+            # Nobody reviews this SQL before it runs, so only a validated read-only query is executed
+            catalog = ctx["catalog"]
+            dialect = catalog.dialect if catalog is not None else ctx["engine"].dialect.name
+            validation = await asyncio.to_thread(sql_validation.validate, sql, catalog, dialect)
+            if not validation["ok"]:
+                record["error"] = "SQL failed validation, not executed: " + "; ".join(validation["errors"])
+                return record
+            start = time.perf_counter()
+            result = await asyncio.to_thread(core.run_sql, ctx["engine"], sql, ctx["max_rows"])
+            record["execute_ms"] = round((time.perf_counter() - start) * 1000, 1)
+            record.update(result)
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+    return record
+
+
+async def run_batch(questions, ctx, out_path):
+    semaphore = asyncio.Semaphore(ctx["concurrency"])
+    summary = {"total": len(questions), "ok": 0, "failed": 0}
+
+    async def bounded(item):
+        async with semaphore:
+            return await answer(item, ctx)
+
+    with open(out_path, "a", encoding="utf-8") as out:
+        for finished in asyncio.as_completed([bounded(item) for item in questions]):
+            record = await finished
+            out.write(json.dumps(record, default=str) + "\n")
+            out.flush()
+            summary["failed" if record["error"] else "ok"] += 1
+            status = "ERR" if record["error"] else "ok "
+            print(f"[{summary['ok'] + summary['failed']}/{summary['total']}] {status} {record['question']}", file=sys.stderr)
+    return summary
+
+
+# ----------- CLI -----------
+def build_engine(args):
+    if not args.db_type:
+        return None
+    config = core.engine_config(
+        args.db_type, args.sqlite_path, args.host, args.port, args.user,
+        args.password or os.environ.get("DB_PASSWORD", ""), args.dbname,
+    )
+    pool_options = {"pool_size": args.concurrency, "max_overflow": 0}
+    return core.get_engine(args.db_type, config, pool_options, args.replica_url)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Answer a file of questions with SQLGenius, concurrently.")
+    parser.add_argument("questions", help="Text file (one question per line) or JSONL with a 'question' field")
+    parser.add_argument("--out", default="results.jsonl", help="JSONL file results are appended to")
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--api-key", default=os.environ.get("GROQ_API_KEY"), help="Defaults to $GROQ_API_KEY")
+    parser.add_argument("--concurrency", type=int, default=4, help="Questions in flight at once")
+    parser.add_argument("--rate", type=float, default=2.0, help="LLM requests per second")
+    parser.add_argument("--burst", type=float, default=None, help="Token bucket size (defaults to --rate)")
+    parser.add_argument("--no-cache", action="store_true", help="Do not read or write the generation cache")
+    parser.add_argument("--execute", action="store_true", help="Run the generated SQL on the database")
+    parser.add_argument("--max-rows", type=int, default=20, help="Rows kept per result in the output")
+    parser.add_argument("--db-type", choices=["SQLite", "PostgreSQL", "MySQL"])
+    parser.add_argument("--sqlite-path", default="sample.db")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port")
+    parser.add_argument("--user")
+    parser.add_argument("--password", help="Defaults to $DB_PASSWORD")
+    parser.add_argument("--dbname")
+    parser.add_argument("--replica-url")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not args.api_key:
+        sys.exit("A Groq API key is required (--api-key or $GROQ_API_KEY).")
+    if args.execute and not args.db_type:
+        sys.exit("--execute needs a database (--db-type).")
+
+    try:
+        engine = build_engine(args)
+    except FileNotFoundError as e:
+        sys.exit(str(e))
+    catalog = core.load_catalog(engine) if engine is not None else None
+    done = completed_ids(args.out)
+    questions = [q for q in load_questions(args.questions) if q["id"] not in done]
+    if done:
+        print(f"Resuming: {len(done)} questions already answered in {args.out}", file=sys.stderr)
+
+    ctx = {
+        "client": core.async_groq_client(args.api_key),
+        "model": args.model,
+        "catalog": catalog,
+        "cache": None if args.no_cache else generation_cache.get_cache(),
+        "bucket": TokenBucket(args.rate, args.burst),
+        "concurrency": args.concurrency,
+        "engine": engine,
+        "execute": args.execute,
+        "max_rows": args.max_rows,
+    }
+    start = time.perf_counter()
+    summary = asyncio.run(run_batch(questions, ctx, args.out))
+    summary["elapsed_s"] = round(time.perf_counter() - start, 2)
+    print(json.dumps(summary), file=sys.stderr)
+    return 0 if summary["failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,422 @@
+"""
+Offline end-to-end benchmark: no Groq key and no live database needed.
+
+    python benchmark.py --rows 1000 --rows 100000 --llm-latency-ms 300
+    python benchmark.py --rows 1000000 --compare .sqlgenius_bench/abc1234-1000000.json
+
+For every scale it
+1. generates the employees / departments / projects / employee_projects schema
+   (the DDL of ``setup_sqlite_db.sql`` and ``employee.sql``) filled with
+   synthetic rows into a fresh ``sample.db`` in a scratch directory,
+2. starts a local OpenAI/Groq-compatible stub that streams canned SQL for the
+   questions in the SQLGenius.py docstring with configurable latency,
+3. replays those questions through the real app (Streamlit's AppTest drives
+   SQLCreatorAgent / SQLRunnerAgent: generate, review, approve, fetch), and
+4. reports throughput, per-stage p50/p95/p99 latency (from the telemetry spans)
+   and per-stage peak memory (tracemalloc).
+
+Results are saved as JSON baselines named after the current commit and scale,
+and ``--compare`` prints the change against an earlier baseline.
+"""
+import argparse
+import ast
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from sqlalchemy import create_engine
+
+import sql_loader
+import sqlgenius_core
+import telemetry
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "SQLGenius.py")
+SCHEMA_SCRIPTS = ("setup_sqlite_db.sql", "employee.sql")
+DEFAULT_BASELINE_DIR = ".sqlgenius_bench"
+REGRESSION_THRESHOLD = 0.2
+
+CANNED_SQL = {
+    "list all employees and their departments.":
+        "SELECT e.name AS employee, d.name AS department FROM employees e JOIN departments d ON e.department_id = d.id;",
+    "show who is working on the website redesign project.":
+        "SELECT e.name FROM employees e JOIN employee_projects ep ON ep.employee_id = e.id "
+        "JOIN projects p ON p.id = ep.project_id WHERE p.name = 'Website Redesign';",
+    "what is the total salary in the engineering department?":
+        "SELECT SUM(e.salary) AS total_salary FROM employees e JOIN departments d ON e.department_id = d.id "
+        "WHERE d.name = 'Engineering';",
+    "list all projects with budget over 40000 and people working on them.":
+        "SELECT p.name AS project, e.name AS employee FROM projects p JOIN employee_projects ep ON ep.project_id = p.id "
+        "JOIN employees e ON e.id = ep.employee_id WHERE p.budget > 40000;",
+    "list all clients and their contact information.":
+        "SELECT name, contact_info FROM clients;",
+    "show the total hours worked by each employee on all projects.":
+        "SELECT e.name, SUM(ep.hours_worked) AS total_hours FROM employees e "
+        "JOIN employee_projects ep ON ep.employee_id = e.id GROUP BY e.id, e.name;",
+    "list all projects along with their start and end dates.":
+        "SELECT name, start_date, end_date FROM projects;",
+    "show the names of employees hired after january 1st, 2020.":
+        "SELECT name FROM employees WHERE hire_date > '2020-01-01';",
+}
+FALLBACK_SQL = "SELECT COUNT(*) AS employees FROM employees;"
+
+
+def docstring_questions(path=APP_PATH):
+    """The sample questions in the app's module docstring, read without importing it."""
+    with open(path, encoding="utf-8") as f:
+        docstring = ast.get_docstring(ast.parse(f.read())) or ""
+    return [line.strip() for line in docstring.splitlines() if line.strip()]
+
+
+# ----------- Stub LLM -----------
+class StubLLM:
+    """OpenAI/Groq-compatible chat completions endpoint answering with canned SQL."""
+
+    def __init__(self, latency_ms=300.0, chunk_ms=5.0, chunk_chars=8, canned=None, port=0):
+        self.latency_ms = latency_ms
+        self.chunk_ms = chunk_ms
+        self.chunk_chars = chunk_chars
+        self.canned = canned or CANNED_SQL
+        self.requests = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                stub.requests += 1
+                prompt = body["messages"][-1]["content"]
+                sql = stub.answer(prompt)
+                time.sleep(stub.latency_ms / 1000)
+                if body.get("stream"):
+                    self._stream(body["model"], sql)
+                else:
+                    self._complete(body["model"], sql, prompt)
+
+            def _complete(self, model, sql, prompt):
+                payload = json.dumps({
+                    "id": "stub", "object": "chat.completion", "created": int(time.time()), "model": model,
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": sql}, "finish_reason": "stop"}],
+                    "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(sql) // 4,
+                              "total_tokens": (len(prompt) + len(sql)) // 4},
+                }).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _stream(self, model, sql):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.end_headers()
+                try:
+                    for i in range(0, len(sql), stub.chunk_chars):
+                        chunk = {"id": "stub", "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                                 "choices": [{"index": 0, "delta": {"content": sql[i:i + stub.chunk_chars]}, "finish_reason": None}]}
+                        self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                        self.wfile.flush()
+                        time.sleep(stub.chunk_ms / 1000)
+                    self.wfile.write(b"data: [DONE]\n\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client closes the stream once it has a full statement
+                    pass
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+
+    def answer(self, prompt):
+        request = prompt.split("Request:", 1)[-1].split("\n\n", 1)[0].strip().lower()
+        if "failed validation" in prompt:
+            return FALLBACK_SQL
+        return self.canned.get(request, FALLBACK_SQL)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, name="sqlgenius-stub-llm", daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+# ----------- Synthetic Data -----------
+def _schema_statements(root):
+    """DROP / CREATE statements of the sample scripts, in order, so employee.sql's superset wins."""
+    statements = []
+    for name in SCHEMA_SCRIPTS:
+        splitter = sql_loader.StatementSplitter()
+        with open(os.path.join(root, name), encoding="utf-8") as f:
+            for statement in list(splitter.feed(f.read())) + list(splitter.finish()):
+                if statement.split(None, 1)[0].upper() in ("CREATE", "DROP"):
+                    statements.append(statement)
+    return statements
+
+
+def generate_database(path, rows, seed=42, root=None):
+    """
+    Build a SQLite database with ``rows`` employees and proportional other tables:
+    1 department per 1,000 employees, 1 project per 100, 1 client per 200 and two
+    project assignments per employee (never fewer than 5 of anything).
+    """
+    root = root or os.path.dirname(os.path.abspath(__file__))
+    rng = random.Random(seed)
+    counts = {
+        "departments": max(5, rows // 1000),
+        "employees": rows,
+        "projects": max(5, rows // 100),
+        "clients": max(5, rows // 200),
+        "employee_projects": 2 * rows,
+    }
+    counts["project_clients"] = counts["projects"]
+    base_names = ["Engineering", "Marketing", "HR", "Sales", "Finance"]
+    project_names = ["Website Redesign", "Mobile App", "Data Migration", "CRM Upgrade", "Cloud Move"]
+    roles = ["Developer", "Designer", "Manager", "Analyst", "Tester"]
+    first_day = date(2015, 1, 1)
+
+    def department_rows():
+        for i in range(counts["departments"]):
+            yield (base_names[i] if i < len(base_names) else f"Department {i + 1}",)
+
+    def employee_rows():
+        for i in range(rows):
+            hired = first_day + timedelta(days=rng.randrange(3650))
+            yield (f"Employee {i + 1}", rng.randint(1, counts["departments"]), rng.randrange(40_000, 200_000, 500), hired.isoformat())
+
+    def project_rows():
+        for i in range(counts["projects"]):
+            start = first_day + timedelta(days=rng.randrange(3650))
+            name = project_names[i] if i < len(project_names) else f"Project {i + 1}"
+            yield (name, rng.randrange(10_000, 500_000, 1000), start.isoformat(), (start + timedelta(days=rng.randrange(30, 720))).isoformat())
+
+    def client_rows():
+        for i in range(counts["clients"]):
+            yield (f"Client {i + 1}", f"client{i + 1}@example.com")
+
+    def assignment_rows():
+        for i in range(counts["employee_projects"]):
+            yield (i // 2 + 1, rng.randint(1, counts["projects"]), rng.choice(roles), rng.randint(1, 400))
+
+    def project_client_rows():
+        for i in range(counts["project_clients"]):
+            yield (i + 1, rng.randint(1, counts["clients"]))
+
+    inserts = [
+        ("INSERT INTO departments (name) VALUES (?)", department_rows),
+        ("INSERT INTO employees (name, department_id, salary, hire_date) VALUES (?, ?, ?, ?)", employee_rows),
+        ("INSERT INTO projects (name, budget, start_date, end_date) VALUES (?, ?, ?, ?)", project_rows),
+        ("INSERT INTO clients (name, contact_info) VALUES (?, ?)", client_rows),
+        ("INSERT INTO employee_projects (employee_id, project_id, role, hours_worked) VALUES (?, ?, ?, ?)", assignment_rows),
+        ("INSERT INTO project_clients (project_id, client_id) VALUES (?, ?)", project_client_rows),
+    ]
+    if os.path.exists(path):
+        os.remove(path)
+    engine = create_engine(f"sqlite:///{path}")
+    start = time.perf_counter()
+    with engine.connect() as conn:
+        restore = sql_loader.apply_fast_load(conn)
+        sql_loader.begin_load(conn)
+        for statement in _schema_statements(root):
+            conn.exec_driver_sql(statement)
+        cursor = conn.connection.dbapi_connection.cursor()
+        for sql, make_rows in inserts:
+            cursor.executemany(sql, make_rows())
+        cursor.close()
+        conn.commit()
+        for statement in restore:
+            conn.exec_driver_sql(statement)
+        conn.exec_driver_sql("ANALYZE")
+        conn.commit()
+    engine.dispose()
+    total = sum(counts.values())
+    elapsed = time.perf_counter() - start
+    return {"rows": counts, "total_rows": total, "elapsed_s": round(elapsed, 2), "rows_per_s": round(total / elapsed, 1),
+            "size_mb": round(os.path.getsize(path) / 1e6, 1)}
+
+
+# ----------- Replay -----------
+def _percentiles(values):
+    values = sorted(values)
+    if not values:
+        return {}
+    pick = lambda q: values[min(len(values) - 1, int(q * len(values)))]
+    return {"p50_ms": round(pick(0.5), 1), "p95_ms": round(pick(0.95), 1), "p99_ms": round(pick(0.99), 1)}
+
+
+def replay(questions, repeat=1, use_caches=False, timeout_s=600):
+    """Drive the Streamlit app through generate -> approve -> result for every question."""
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(APP_PATH, default_timeout=timeout_s)
+    at.session_state["gen_cache_enabled"] = use_caches
+    at.session_state["result_cache_enabled"] = use_caches
+    at.session_state["statement_timeout_s"] = timeout_s
+    at.session_state["groq_api_key"] = "benchmark"
+    at.run()
+    [b for b in at.button if "Connect" in b.label][0].click().run()
+    results = []
+    for _ in range(repeat):
+        for question in questions:
+            record = {"question": question}
+            start = time.perf_counter()
+            at.text_area[0].input(question)
+            [b for b in at.button if "Generate" in b.label][0].click().run()
+            record["generate_ms"] = (time.perf_counter() - start) * 1000
+            record["sql"] = at.session_state["generated_sql"] if "generated_sql" in at.session_state else None
+            start = time.perf_counter()
+            [b for b in at.button if "Approve" in b.label][0].click().run()
+            while "query_job_id" in at.session_state:
+                time.sleep(0.05)
+                at.run()
+            record["run_ms"] = (time.perf_counter() - start) * 1000
+            pager = at.session_state["result_pager"] if "result_pager" in at.session_state else None
+            record["rows"] = pager.rows_fetched if pager is not None else None
+            record["error"] = "; ".join(e.value for e in at.error) or None
+            results.append(record)
+            print(f"  {record['generate_ms']:8.1f} ms gen {record['run_ms']:8.1f} ms run  {question}", file=sys.stderr)
+    return results
+
+
+def run_scale(rows, args):
+    workdir = tempfile.mkdtemp(prefix=f"sqlgenius-bench-{rows}-")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        print(f"[{rows:,} rows] generating data in {workdir}", file=sys.stderr)
+        data = generate_database(os.path.join(workdir, "sample.db"), rows, root=os.path.dirname(APP_PATH))
+        telemetry.metrics.reset()
+        if not args.no_memory:
+            tracemalloc.start()
+        with StubLLM(args.llm_latency_ms, args.chunk_ms) as stub:
+            os.environ["GROQ_BASE_URL"] = stub.url
+            start = time.perf_counter()
+            results = replay(docstring_questions(), repeat=args.repeat, use_caches=args.with_caches)
+            elapsed = time.perf_counter() - start
+        peak_traced_mb = None
+        if tracemalloc.is_tracing():
+            peak_traced_mb = round(tracemalloc.get_traced_memory()[1] / 1e6, 1)
+            tracemalloc.stop()
+        return {
+            "rows": rows,
+            "data": data,
+            "questions": len(results),
+            "errors": sum(1 for r in results if r["error"]),
+            "elapsed_s": round(elapsed, 2),
+            "questions_per_s": round(len(results) / elapsed, 3),
+            "generate": _percentiles([r["generate_ms"] for r in results]),
+            "run": _percentiles([r["run_ms"] for r in results]),
+            "stages": telemetry.metrics.summary(),
+            "llm_requests": stub.requests,
+            "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            "peak_traced_mb": peak_traced_mb,
+            "results": results,
+        }
+    finally:
+        os.chdir(cwd)
+
+
+# ----------- Baselines -----------
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(APP_PATH)).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def save_baseline(report, directory):
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{report['revision']}-{report['rows']}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, default=str)
+    return path
+
+
+def compare(report, baseline, threshold=REGRESSION_THRESHOLD):
+    """Lines describing p50/p95 changes per stage; regressions beyond ``threshold`` are flagged."""
+    lines = []
+    regressions = 0
+    if report.get("core_import_ms", 0) > sqlgenius_core.IMPORT_BUDGET_MS:
+        lines.append(f"{'core import':22} {report['core_import_ms']:.1f} ms is over the {sqlgenius_core.IMPORT_BUDGET_MS} ms budget  REGRESSION")
+        regressions += 1
+    rows = [("generate", report["generate"], baseline.get("generate", {})), ("run", report["run"], baseline.get("run", {}))]
+    rows += [(name, stats, baseline.get("stages", {}).get(name, {})) for name, stats in sorted(report["stages"].items())]
+    for name, now, before in rows:
+        for key in ("p50_ms", "p95_ms"):
+            if not before.get(key) or key not in now:
+                continue
+            change = (now[key] - before[key]) / before[key]
+            flag = ""
+            if change > threshold:
+                flag = "  REGRESSION"
+                regressions += 1
+            lines.append(f"{name:22} {key:7} {before[key]:10.2f} -> {now[key]:10.2f} ({change:+.0%}){flag}")
+    return lines, regressions
+
+
+def print_report(report):
+    print(f"\n== {report['rows']:,} employees ({report['data']['total_rows']:,} rows, {report['data']['size_mb']} MB, "
+          f"generated at {report['data']['rows_per_s']:,.0f} rows/s) ==")
+    print(f"{report['questions']} questions in {report['elapsed_s']}s ({report['questions_per_s']} q/s), "
+          f"{report['errors']} errors, peak RSS {report['peak_rss_mb']} MB")
+    print(f"{'core import':22} {report['core_import_ms']} ms (budget {sqlgenius_core.IMPORT_BUDGET_MS} ms)")
+    print(f"{'end to end':22} generate {report['generate']}  run {report['run']}")
+    print(f"{'stage':22} {'count':>6} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} {'peak KB':>10}")
+    for name, stats in report["stages"].items():
+        print(f"{name:22} {stats['count']:6} {stats['p50_ms']:10.2f} {stats['p95_ms']:10.2f} {stats['p99_ms']:10.2f} "
+              f"{stats.get('peak_kb', 0):10.1f}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline end-to-end SQLGenius benchmark")
+    parser.add_argument("--rows", type=int, action="append", help="Employees to generate (repeatable, 1000 to 10000000)")
+    parser.add_argument("--repeat", type=int, default=1, help="Replays of the question set per scale")
+    parser.add_argument("--llm-latency-ms", type=float, default=300.0, help="Stub delay before the first token")
+    parser.add_argument("--chunk-ms", type=float, default=5.0, help="Stub delay between streamed chunks")
+    parser.add_argument("--with-caches", action="store_true", help="Leave the generation and result caches on")
+    parser.add_argument("--no-memory", action="store_true", help="Skip tracemalloc (less overhead, no peak memory per stage)")
+    parser.add_argument("--baseline-dir", default=DEFAULT_BASELINE_DIR)
+    parser.add_argument("--compare", help="Baseline JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD, help="Relative slowdown counted as a regression")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    telemetry.logging_enabled = False
+    revision = git_revision()
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    regressions = 0
+    core_import_ms = sqlgenius_core.measure_import_ms()
+    for rows in args.rows or [1000]:
+        report = run_scale(rows, args)
+        report["revision"] = revision
+        report["core_import_ms"] = core_import_ms
+        print_report(report)
+        print(f"saved {save_baseline(report, args.baseline_dir)}")
+        if baseline is not None:
+            lines, found = compare(report, baseline, args.threshold)
+            print(f"\nvs {args.compare} ({baseline.get('revision')}, {baseline.get('rows'):,} employees):")
+            print("\n".join(lines))
+            regressions += found
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,221 @@
+"""
+Pre-execution cost guard.
+
+Before approved SQL is run we ask the database for its plan (EXPLAIN (FORMAT
+JSON) on PostgreSQL, EXPLAIN FORMAT=JSON on MySQL, EXPLAIN QUERY PLAN on
+SQLite), pull out estimated rows, cost and full-scan markers, and apply a
+policy: warn, inject a LIMIT, or block queries above the configured thresholds.
+
+SQLite's query plan has no row or cost estimates, so there the estimate is the
+product of the sizes of the scanned tables (from sqlite_stat1 when ANALYZE has
+been run, otherwise MAX(rowid)), which is what a nested scan actually touches.
+"""
+import json
+import re
+
+import sqlparse
+from sqlalchemy import text
+from sqlparse import sql as S
+from sqlparse import tokens as T
+
+import engine_registry
+import telemetry
+
+MODES = ["Off", "Warn", "Auto LIMIT", "Block"]
+DEFAULT_POLICY = {
+    "mode": "Warn",
+    "max_rows": 1_000_000,
+    "max_cost": 1_000_000.0,
+    "limit_rows": 1000,
+}
+
+
+# ----------- Plan Estimation -----------
+def _walk(node):
+    if isinstance(node, dict):
+        yield node
+        for value in node.values():
+            yield from _walk(value)
+    elif isinstance(node, list):
+        for item in node:
+            yield from _walk(item)
+
+
+def _explain_postgres(conn, query):
+    # no_parameters: otherwise psycopg2 reads the % of a LIKE '%x%' as a format directive
+    raw = conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {query}", execution_options={"no_parameters": True}).scalar()
+    plan = json.loads(raw) if isinstance(raw, str) else raw
+    root = plan[0]["Plan"]
+    full_scans = [
+        node["Relation Name"] for node in _walk(root)
+        if node.get("Node Type") == "Seq Scan" and "Relation Name" in node
+    ]
+    return {"rows": root.get("Plan Rows"), "cost": root.get("Total Cost"), "full_scans": full_scans, "plan": plan}
+
+
+def _explain_mysql(conn, query):
+    raw = conn.exec_driver_sql(f"EXPLAIN FORMAT=JSON {query}", execution_options={"no_parameters": True}).scalar()
+    plan = json.loads(raw)
+    query_block = plan.get("query_block", {})
+    cost = float(query_block.get("cost_info", {}).get("query_cost", 0) or 0)
+    rows = None
+    full_scans = []
+    for node in _walk(query_block):
+        table = node.get("table")
+        if isinstance(table, dict) and "table_name" in table:
+            if table.get("access_type") == "ALL":
+                full_scans.append(table["table_name"])
+            # The last table of the nested loop carries the estimate for the whole join
+            produced = table.get("rows_produced_per_join", table.get("rows_examined_per_scan"))
+            if produced is not None:
+                rows = float(produced)
+    return {"rows": rows, "cost": cost, "full_scans": full_scans, "plan": plan}
+
+
+_SQLITE_SCAN = re.compile(r"^(SCAN|SEARCH)\s+(?:TABLE\s+)?([^\s(]+)", re.IGNORECASE)
+
+
+def sqlite_table_rows(conn, table):
+    try:
+        stat = conn.execute(
+            text("SELECT stat FROM sqlite_stat1 WHERE tbl = :t AND idx IS NULL"), {"t": table}
+        ).scalar()
+        if stat:
+            return int(stat.split()[0])
+    except Exception:
+        pass
+    try:
+        return int(conn.exec_driver_sql(f'SELECT MAX(rowid) FROM "{table}"').scalar() or 0)
+    except Exception:
+        # WITHOUT ROWID tables and views have no cheap size estimate
+        return None
+
+
+def table_aliases(query):
+    """Map every table alias (and bare table name) in FROM / JOIN clauses to the real table name."""
+    aliases = {}
+
+    def visit(token_list):
+        expecting_table = False
+        for token in token_list.tokens:
+            if token.is_whitespace or token.ttype in T.Comment:
+                continue
+            if token.ttype in T.Keyword:
+                expecting_table = token.normalized == "FROM" or token.normalized.endswith("JOIN")
+                continue
+            if expecting_table:
+                identifiers = token.get_identifiers() if isinstance(token, S.IdentifierList) else [token]
+                for identifier in identifiers:
+                    if isinstance(identifier, S.Identifier):
+                        if isinstance(identifier.token_first(), S.Parenthesis):
+                            visit(identifier.token_first())
+                            continue
+                        real_name = identifier.get_real_name()
+                        if real_name:
+                            aliases[real_name] = real_name
+                            aliases[identifier.get_alias() or real_name] = real_name
+                expecting_table = False
+            if token.is_group:
+                visit(token)
+
+    for statement in sqlparse.parse(query):
+        visit(statement)
+    return aliases
+
+
+def _explain_sqlite(conn, query):
+    plan = [tuple(row) for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {query}")]
+    # The plan names tables by their alias when the query uses one
+    aliases = table_aliases(query)
+    full_scans = []
+    estimate = None
+    for row in plan:
+        match = _SQLITE_SCAN.match(row[-1])
+        if not match or row[-1].upper().startswith("SCAN CONSTANT ROW"):
+            continue
+        kind, name = match.group(1).upper(), match.group(2)
+        table = aliases.get(name, name)
+        if kind == "SCAN" and "USING COVERING INDEX" not in row[-1].upper():
+            full_scans.append(table)
+        if kind == "SCAN":
+            size = sqlite_table_rows(conn, table)
+            if size is not None:
+                estimate = (estimate or 1) * max(size, 1)
+    return {"rows": estimate, "cost": None, "full_scans": full_scans, "plan": plan}
+
+
+_EXPLAINERS = {"postgresql": _explain_postgres, "mysql": _explain_mysql, "sqlite": _explain_sqlite}
+
+
+def explain(conn, query):
+    """Like estimate(), on an open connection (e.g. one holding hypothetical indexes)."""
+    explainer = _EXPLAINERS.get(conn.dialect.name)
+    if explainer is None:
+        raise ValueError(f"No plan estimator for dialect {conn.dialect.name}")
+    query = query.strip().rstrip(";")
+    # The text is spliced into EXPLAIN as is, so "SELECT 1; DROP TABLE x" would run its second statement
+    if not engine_registry.is_read_only(query):
+        return {"rows": None, "cost": None, "full_scans": [], "plan": None,
+                "skipped": "only a single read-only SELECT is explained"}
+    return explainer(conn, query)
+
+
+def estimate(engine, query):
+    """Return {"rows", "cost", "full_scans", "plan"} for the query without running it."""
+    with telemetry.span("cost_estimate"), engine.connect() as conn:
+        return explain(conn, query)
+
+
+# ----------- Policy -----------
+def has_top_level_limit(query):
+    statement = sqlparse.parse(query)[0]
+    for token in statement.tokens:
+        if token.ttype in T.Keyword and token.normalized in ("LIMIT", "FETCH", "TOP"):
+            return True
+    return False
+
+
+def inject_limit(query, limit_rows):
+    """Append a LIMIT to a single SELECT that does not already have one."""
+    query = query.strip().rstrip(";").rstrip()
+    statement = sqlparse.parse(query)[0]
+    if statement.get_type() != "SELECT" or has_top_level_limit(query):
+        return query
+    return f"{query}\nLIMIT {int(limit_rows)}"
+
+
+def evaluate(estimate_result, policy, query):
+    """
+    Apply the policy to an estimate. Returns {"action", "reasons", "query"} where
+    action is one of allow / warn / limit / block and query is what should run.
+    """
+    mode = policy.get("mode", "Off")
+    reasons = []
+    rows = estimate_result.get("rows")
+    cost = estimate_result.get("cost")
+    if rows is not None and rows > policy["max_rows"]:
+        reasons.append(f"estimated {int(rows):,} rows exceeds {int(policy['max_rows']):,}")
+    if cost is not None and cost > policy["max_cost"]:
+        reasons.append(f"estimated cost {cost:,.0f} exceeds {policy['max_cost']:,.0f}")
+    if mode == "Off" or not reasons:
+        return {"action": "allow", "reasons": reasons, "query": query}
+    if mode == "Block":
+        return {"action": "block", "reasons": reasons, "query": query}
+    if mode == "Auto LIMIT":
+        limited = inject_limit(query, policy["limit_rows"])
+        if limited != query.strip().rstrip(";").rstrip():
+            return {"action": "limit", "reasons": reasons, "query": limited}
+    return {"action": "warn", "reasons": reasons, "query": query}
+
+
+def describe(estimate_result):
+    if estimate_result.get("skipped"):
+        return "no estimate, " + estimate_result["skipped"]
+    parts = []
+    if estimate_result.get("rows") is not None:
+        parts.append(f"~{int(estimate_result['rows']):,} rows")
+    if estimate_result.get("cost") is not None:
+        parts.append(f"cost {estimate_result['cost']:,.1f}")
+    if estimate_result.get("full_scans"):
+        parts.append("full scan of " + ", ".join(sorted(set(estimate_result["full_scans"]))))
+    return ", ".join(parts) or "no scans or estimates reported"
@@ -0,0 +1,236 @@
+"""
+Process-wide SQLAlchemy engine registry.
+
+Streamlit re-runs SQLGenius.py on every interaction but keeps imported modules
+alive, so engines held here are shared by every browser session instead of each
+session opening its own pool. Engines are keyed by a hash of the dialect, the
+connection config and the pool options.
+
+SQLite engines open every connection in WAL mode with a busy timeout, so
+readers never wait on a writer and a second writer waits instead of failing
+with "database is locked". A "max_bytes" entry in a SQLite config caps the
+file size through max_page_count.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import deque
+
+import sqlparse
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import QueuePool
+from sqlparse import tokens as T
+
+DEFAULT_POOL_OPTIONS = {
+    "pool_size": 5,
+    "max_overflow": 10,
+    "pool_timeout": 30,
+    "pool_recycle": 1800,
+    "pool_pre_ping": True,
+}
+DEFAULT_SQLITE_BUSY_TIMEOUT_MS = 5000
+
+_lock = threading.Lock()
+_engines = {}
+_replicas = {}
+
+
+# ----------- Pool Instrumentation -----------
+class PoolStats:
+    """Rolling window of pool checkout wait times, in seconds."""
+
+    def __init__(self, window=1000):
+        self._waits = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.checkouts = 0
+
+    def record(self, seconds):
+        with self._lock:
+            self._waits.append(seconds)
+            self.checkouts += 1
+
+    def summary(self):
+        with self._lock:
+            waits = sorted(self._waits)
+            checkouts = self.checkouts
+        if not waits:
+            return {"checkouts": checkouts, "wait_p50_ms": 0.0, "wait_p95_ms": 0.0, "wait_max_ms": 0.0}
+
+        def pct(p):
+            return round(waits[min(len(waits) - 1, int(p * len(waits)))] * 1000, 2)
+
+        return {
+            "checkouts": checkouts,
+            "wait_p50_ms": pct(0.50),
+            "wait_p95_ms": pct(0.95),
+            "wait_max_ms": round(waits[-1] * 1000, 2),
+        }
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited for a connection."""
+
+    stats = None
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            if self.stats is not None:
+                self.stats.record(time.perf_counter() - start)
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+
+# ----------- Engine Registry -----------
+def build_url(db_type, config):
+    if db_type == "SQLite":
+        return f"sqlite:///{config.get('path', 'sample.db')}"
+    elif db_type == "PostgreSQL":
+        return f"postgresql+psycopg2://{config['user']}:{config['password']}@{config['host']}:{config['port']}/{config['dbname']}"
+    elif db_type == "MySQL":
+        return f"mysql+pymysql://{config['user']}:{config['password']}@{config['host']}:{config['port']}/{config['dbname']}"
+    raise ValueError(f"Unsupported database type: {db_type}")
+
+
+def registry_key(db_type, config, pool_options=None, replica_url=None):
+    payload = json.dumps(
+        {
+            "db_type": db_type,
+            "config": config,
+            "pool": {**DEFAULT_POOL_OPTIONS, **(pool_options or {})},
+            "replica": replica_url or "",
+        },
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _create_pooled_engine(url, pool_options):
+    options = {**DEFAULT_POOL_OPTIONS, **(pool_options or {})}
+    engine = create_engine(url, poolclass=TimedQueuePool, **options)
+    engine.pool.stats = PoolStats()
+    return engine
+
+
+def _tune_sqlite(engine, max_bytes=None):
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_conn, _record):
+        cursor = dbapi_conn.cursor()
+        try:
+            try:
+                cursor.execute("PRAGMA journal_mode=WAL")
+            except Exception:
+                # Read-only files keep their journal mode
+                pass
+            cursor.execute(f"PRAGMA busy_timeout={DEFAULT_SQLITE_BUSY_TIMEOUT_MS}")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+            if max_bytes:
+                page_size = cursor.execute("PRAGMA page_size").fetchone()[0]
+                cursor.execute(f"PRAGMA max_page_count={max(int(max_bytes) // page_size, 1)}")
+        finally:
+            cursor.close()
+
+
+def fresh_mysql_stats(conn):
+    """
+    Make information_schema.TABLES report current UPDATE_TIME / TABLE_ROWS on
+    this connection; MySQL 8 otherwise caches them for
+    information_schema_stats_expiry seconds (a day by default).
+    """
+    try:
+        conn.exec_driver_sql("SET SESSION information_schema_stats_expiry = 0")
+    except Exception:
+        # MySQL 5.7 and MariaDB have no such cache (or variable)
+        pass
+
+
+def get_engine(db_type, config, pool_options=None, replica_url=None):
+    """Return the shared engine for this config, creating it on first use."""
+    key = registry_key(db_type, config, pool_options, replica_url)
+    with _lock:
+        engine = _engines.get(key)
+        if engine is None:
+            engine = _create_pooled_engine(build_url(db_type, config), pool_options)
+            if db_type == "SQLite":
+                _tune_sqlite(engine, config.get("max_bytes"))
+            _engines[key] = engine
+            if replica_url:
+                _replicas[engine] = _create_pooled_engine(replica_url, pool_options)
+        return engine
+
+
+def replica_for(engine):
+    return _replicas.get(engine)
+
+
+def dispose_sqlite(path):
+    """Close and forget every engine on this SQLite file. Returns the engines removed."""
+    path = os.path.abspath(path)
+    with _lock:
+        removed = [
+            (key, engine) for key, engine in _engines.items()
+            if engine.dialect.name == "sqlite" and engine.url.database and os.path.abspath(engine.url.database) == path
+        ]
+        for key, engine in removed:
+            del _engines[key]
+            replica = _replicas.pop(engine, None)
+            if replica is not None:
+                replica.dispose()
+            engine.dispose()
+    return [engine for _, engine in removed]
+
+
+def dispose_all():
+    with _lock:
+        for engine in list(_engines.values()) + list(_replicas.values()):
+            engine.dispose()
+        _engines.clear()
+        _replicas.clear()
+
+
+# ----------- Read Replica Routing -----------
+_LOCKING_CLAUSES = ("FOR UPDATE", "FOR NO KEY UPDATE", "FOR SHARE", "FOR KEY SHARE", "LOCK IN SHARE MODE")
+
+
+def is_read_only(query):
+    """True for a single SELECT that neither writes nor takes row locks."""
+    statements = [s for s in sqlparse.parse(query) if s.token_first(skip_cm=True) is not None]
+    if len(statements) != 1 or statements[0].get_type() != "SELECT":
+        return False
+    keywords = []
+    for token in statements[0].flatten():
+        if token.ttype in T.Keyword:
+            keywords.append(token.normalized)
+    # Lock clauses are split into several keyword tokens, so match on the sequence
+    keyword_text = " " + " ".join(keywords) + " "
+    if "INTO" in keywords or any(f" {clause} " in keyword_text for clause in _LOCKING_CLAUSES):
+        return False
+    return not any(k in ("INSERT", "UPDATE", "DELETE", "MERGE", "UPSERT", "REPLACE") for k in keywords)
+
+
+def route_engine(engine, query):
+    """Send read-only SELECTs to the replica when one is configured."""
+    replica = replica_for(engine)
+    if replica is not None and is_read_only(query):
+        return replica
+    return engine
+
+
+def pool_status(engine):
+    pool = engine.pool
+    status = {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+    }
+    if getattr(pool, "stats", None) is not None:
+        status.update(pool.stats.summary())
+    return status
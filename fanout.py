@@ -0,0 +1,421 @@
+"""
+Run one query on several databases at once and merge the results.
+
+Each target runs as a QueryJob on a shared thread pool, so it gets the same
+server-side statement timeout and cancellation as a single query. Targets
+that fail or time out are reported next to the merged result instead of
+failing the whole run.
+
+Merging:
+
+- plain SELECTs are concatenated with a ``source`` column naming the target
+- grouped / aggregated SELECTs whose select list is group keys plus
+  SUM / COUNT / MIN / MAX / AVG are re-aggregated across targets. AVG is sent
+  to each target as SUM and COUNT so the merged average is weighted correctly
+- a trailing ORDER BY / LIMIT is applied again to the merged rows when it
+  refers to output columns. A concatenated LIMIT without such an ORDER BY is
+  left per target (the plan's ``note`` says so): which rows would be "first"
+  overall would otherwise depend on which target answered first
+
+Anything else (HAVING, COUNT(DISTINCT ...), window functions, OFFSET, ...)
+falls back to concatenation, which is always correct per target.
+"""
+import re
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import sqlparse
+from sqlparse import tokens as T
+
+import query_jobs
+import result_pager
+import telemetry
+
+DEFAULT_TIMEOUT_S = 30
+DEFAULT_WORKERS = 8
+SOURCE_COLUMN = "source"
+# Extra wait on top of the statement timeout before a target is given up on
+TIMEOUT_GRACE_S = 2.0
+
+_UNMERGEABLE = re.compile(r"\b(?:HAVING|OVER|OFFSET|UNION|INTERSECT|EXCEPT|ROLLUP|CUBE|GROUPING)\b", re.IGNORECASE)
+_AGGREGATE_CALL = re.compile(r"^(SUM|COUNT|MIN|MAX|AVG)\s*\((.*)\)$", re.IGNORECASE | re.DOTALL)
+_ALIAS = re.compile(r"^(.*?\S)\s+(?:AS\s+)?(\"[^\"]+\"|`[^`]+`|[A-Za-z_][A-Za-z0-9_]*)$", re.IGNORECASE | re.DOTALL)
+_NOT_ALIASES = {"END", "ASC", "DESC", "NULL", "TRUE", "FALSE"}
+
+
+# ----------- Query Analysis -----------
+def split_top_level(text):
+    """Split on commas that are not inside parentheses or quotes."""
+    parts, depth, quote, start = [], 0, None, 0
+    for i, c in enumerate(text):
+        if quote:
+            if c == quote:
+                quote = None
+        elif c in "'\"`":
+            quote = c
+        elif c == "(":
+            depth += 1
+        elif c == ")":
+            depth -= 1
+        elif c == "," and depth == 0:
+            parts.append(text[start:i].strip())
+            start = i + 1
+    parts.append(text[start:].strip())
+    return [p for p in parts if p]
+
+
+def _unquote(name):
+    return name[1:-1] if name[:1] in ('"', "`") else name
+
+
+def _output_name(expression):
+    """The column name most databases give an unaliased expression."""
+    return _unquote(expression.rsplit(".", 1)[-1]) if re.fullmatch(r"[\w\".`]+", expression) else expression
+
+
+def _parse_item(item):
+    """(expression, alias or None) for one select-list item."""
+    match = _ALIAS.match(item)
+    if match and match.group(2).upper() not in _NOT_ALIASES:
+        expression = match.group(1).strip()
+        # `a.b c` is an alias, `a + b` is not
+        if re.search(r"[\w)\"`\]]$", expression) and not re.search(r"\b(?:AS)$", expression, re.IGNORECASE):
+            return expression, _unquote(match.group(2))
+    return item.strip(), None
+
+
+def _aggregate(expression):
+    """(function, argument) if the whole expression is one aggregate call, else None."""
+    match = _AGGREGATE_CALL.match(expression)
+    if not match:
+        return None
+    # The closing parenthesis must belong to this call: SUM(a) / SUM(b) is not one call
+    depth = 0
+    for c in expression[expression.index("("):-1]:
+        depth += c == "("
+        depth -= c == ")"
+        if depth == 0:
+            return None
+    return match.group(1).upper(), match.group(2).strip()
+
+
+def _offsets(statement):
+    """Start offset of every top-level token."""
+    offsets, position = [], 0
+    for token in statement.tokens:
+        offsets.append(position)
+        position += len(str(token))
+    return offsets
+
+
+def _clauses(sql):
+    """Split a SELECT into (head, select list, body, order by, limit) text pieces, or None."""
+    statements = [s for s in sqlparse.parse(sql.strip().rstrip(";")) if s.token_first(skip_cm=True) is not None]
+    if len(statements) != 1 or statements[0].get_type() != "SELECT":
+        return None
+    statement = statements[0]
+    text = str(statement)
+    offsets = _offsets(statement)
+    list_start = list_end = order_at = limit_at = None
+    for i, token in enumerate(statement.tokens):
+        if token.ttype is T.Keyword.DML and list_start is None:
+            list_start = offsets[i] + len(str(token))
+        elif token.ttype is T.Keyword and token.normalized == "DISTINCT" and list_end is None:
+            return None
+        elif token.ttype is T.Keyword and token.normalized == "FROM" and list_end is None:
+            list_end = offsets[i]
+        elif token.ttype is T.Keyword and token.normalized == "ORDER BY":
+            order_at = offsets[i]
+        elif token.ttype is T.Keyword and token.normalized == "LIMIT":
+            limit_at = offsets[i]
+    if list_start is None or list_end is None:
+        return None
+    tail_at = min(at for at in (order_at, limit_at, len(text)) if at is not None)
+    order_by = text[order_at + len("ORDER BY"):limit_at or len(text)].strip() if order_at is not None else ""
+    limit = text[limit_at + len("LIMIT"):].strip() if limit_at is not None else ""
+    return text[:list_start], text[list_start:list_end].strip(), text[list_end:tail_at].rstrip(), order_by, limit
+
+
+class MergePlan:
+    """
+    How to query each target and fold the results back into the shape the
+    original query asked for.
+    """
+
+    def __init__(self, sql):
+        self.sql = sql
+        self.kind = "concat"
+        self.target_sql = sql
+        self.columns = []  # (output name, expression, aggregate function or None)
+        self.order_by = []
+        self.limit = None
+        clauses = _clauses(sql)
+        if clauses is None:
+            return
+        head, select_list, body, order_by, limit = clauses
+        self.limit = int(limit) if limit.isdigit() else None
+        items = [_parse_item(item) for item in split_top_level(select_list)]
+        self.columns = [(alias or _output_name(expression), expression, (_aggregate(expression) or (None,))[0])
+                        for expression, alias in items]
+        self.order_by = self._resolve_order(order_by)
+        grouped = re.search(r"\bGROUP\s+BY\b", body, re.IGNORECASE)
+        aggregated = any(function for _, _, function in self.columns)
+        if not (grouped or aggregated):
+            return
+        # Partial aggregates are only combinable for plain group keys + SUM/COUNT/MIN/MAX/AVG
+        if _UNMERGEABLE.search(sql) or (limit and self.limit is None) or (order_by and self.order_by is None):
+            return self._keep_per_target()
+        if re.search(r"\bGROUP\s+BY\s+\d", body, re.IGNORECASE) and any(f == "AVG" for _, _, f in self.columns):
+            # AVG becomes two columns, which would shift positional GROUP BY references
+            return self._keep_per_target()
+        for _, expression, function in self.columns:
+            if function and re.match(r"\s*DISTINCT\b", _aggregate(expression)[1], re.IGNORECASE):
+                return self._keep_per_target()
+            if not function and re.search(r"\b(?:SUM|COUNT|MIN|MAX|AVG)\s*\(", expression, re.IGNORECASE):
+                # An expression over aggregates (e.g. SUM(a) / COUNT(*)) cannot be re-aggregated
+                return self._keep_per_target()
+        self.kind = "aggregate"
+        self.target_sql = head + " " + ", ".join(self._target_items()) + " " + body.lstrip()
+
+    @property
+    def note(self):
+        """Why the merged rows are not what the query alone would return, or None."""
+        if self.kind == "concat" and self.limit is not None and not self.order_by:
+            return (f"LIMIT {self.limit} applies to each target, not to the combined rows: "
+                    f"without an ORDER BY on output columns there is no overall first {self.limit}.")
+        return None
+
+    def _keep_per_target(self):
+        # Per-target aggregates are returned side by side, each in its own order
+        self.columns = []
+        self.order_by = None
+        self.limit = None
+
+    def _resolve_order(self, order_by):
+        """[(column index, descending)] for ORDER BY items naming output columns, or None if any does not."""
+        if not order_by:
+            return []
+        if any(expression.endswith("*") for _, expression, _ in self.columns):
+            return None
+        resolved = []
+        names = [name.lower() for name, _, _ in self.columns]
+        expressions = [re.sub(r"\s+", "", expression).lower() for _, expression, _ in self.columns]
+        for item in split_top_level(order_by):
+            match = re.match(r"^(.*?)(?:\s+(ASC|DESC))?(?:\s+NULLS\s+(?:FIRST|LAST))?$", item, re.IGNORECASE | re.DOTALL)
+            expression, direction = match.group(1).strip(), (match.group(2) or "ASC").upper()
+            key = _unquote(expression).lower()
+            if expression.isdigit() and 1 <= int(expression) <= len(names):
+                index = int(expression) - 1
+            elif key in names:
+                index = names.index(key)
+            elif re.sub(r"\s+", "", expression).lower() in expressions:
+                index = expressions.index(re.sub(r"\s+", "", expression).lower())
+            elif key.rsplit(".", 1)[-1] in names:
+                index = names.index(key.rsplit(".", 1)[-1])
+            else:
+                return None
+            resolved.append((index, direction == "DESC"))
+        return resolved
+
+    def _target_items(self):
+        items = []
+        for i, (_, expression, function) in enumerate(self.columns):
+            if function == "AVG":
+                argument = _aggregate(expression)[1]
+                items.append(f"SUM({argument}) AS fanout_c{i}_sum")
+                items.append(f"COUNT({argument}) AS fanout_c{i}_count")
+            else:
+                items.append(f"{expression} AS fanout_c{i}")
+        return items
+
+    def merge(self, tables):
+        """Merge per-target tables (each with a source column) into one table."""
+        if not tables:
+            return pa.table({})
+        combined = _concat(tables)
+        if self.kind == "aggregate":
+            combined = self._reaggregate(combined)
+        if self.order_by:
+            columns = combined.column_names
+            combined = combined.sort_by([(columns[i], "descending" if desc else "ascending") for i, desc in self.order_by])
+        if self.limit is not None and (self.order_by or (self.kind == "aggregate" and self.order_by is not None)):
+            combined = combined.slice(0, self.limit)
+        return combined
+
+    def _reaggregate(self, table):
+        keys = [f"fanout_c{i}" for i, (_, _, function) in enumerate(self.columns) if not function]
+        if not keys:
+            # Whole-table aggregates: one group, so the hash aggregations still apply
+            table = table.append_column("fanout_all", pa.array([0] * table.num_rows, pa.int8()))
+            keys = ["fanout_all"]
+        aggregations = [(SOURCE_COLUMN, "distinct")]
+        for i, (_, _, function) in enumerate(self.columns):
+            if function == "AVG":
+                aggregations += [(f"fanout_c{i}_sum", "sum"), (f"fanout_c{i}_count", "sum")]
+            elif function == "COUNT":
+                aggregations.append((f"fanout_c{i}", "sum"))
+            elif function:
+                aggregations.append((f"fanout_c{i}", function.lower()))
+        grouped = table.group_by(keys, use_threads=False).aggregate(aggregations)
+        arrays, names = [], []
+        for i, (name, _, function) in enumerate(self.columns):
+            if function == "AVG":
+                total = pc.cast(grouped[f"fanout_c{i}_sum_sum"], pa.float64())
+                count = pc.cast(grouped[f"fanout_c{i}_count_sum"], pa.float64())
+                arrays.append(pc.if_else(pc.equal(count, 0), pa.scalar(None, pa.float64()), pc.divide(total, count)))
+            elif function == "COUNT":
+                arrays.append(grouped[f"fanout_c{i}_sum"])
+            elif function:
+                arrays.append(grouped[f"fanout_c{i}_{function.lower()}"])
+            else:
+                arrays.append(grouped[f"fanout_c{i}"])
+            names.append(name)
+        sources = [", ".join(sorted(s for s in row if s is not None)) for row in grouped[f"{SOURCE_COLUMN}_distinct"].to_pylist()]
+        arrays.append(pa.array(sources, pa.string()))
+        names.append(SOURCE_COLUMN)
+        return pa.table(arrays, names=names)
+
+
+def _concat(tables):
+    try:
+        return pa.concat_tables(tables, promote_options="permissive")
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # Targets disagree on a column type (e.g. integer vs decimal SUM): fall back to text for those
+        types = {}
+        for table in tables:
+            for field in table.schema:
+                types.setdefault(field.name, set()).add(field.type)
+        mixed = {name for name, seen in types.items() if len(seen - {pa.null()}) > 1}
+        cast = []
+        for table in tables:
+            for name in mixed & set(table.column_names):
+                index = table.column_names.index(name)
+                table = table.set_column(index, name, pc.cast(table[name], pa.string()))
+            cast.append(table)
+        return pa.concat_tables(cast, promote_options="permissive")
+
+
+# ----------- Execution -----------
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=DEFAULT_WORKERS, thread_name_prefix="sqlgenius-fanout")
+        return _executor
+
+
+def _pager_table(pager):
+    """All pages of a pager as one table; later pages may have widened a column type."""
+    index = 0
+    while pager.page(index) is not None:
+        index += 1
+    if not pager.pages:
+        return pager.to_table()
+    return pa.concat_tables([pa.Table.from_batches([page]) for page in pager.pages], promote_options="permissive")
+
+
+def _run_target(name, job):
+    with telemetry.span("fanout_target", target=name) as span:
+        job.run()
+        if job.status != query_jobs.DONE:
+            span["status"] = job.status
+            return None
+        try:
+            if not job.pager.returns_rows:
+                raise ValueError("Fan-out only runs queries that return rows")
+            table = _pager_table(job.pager)
+        finally:
+            job.close()
+        span["rows"] = table.num_rows
+        return table.append_column(SOURCE_COLUMN, pa.array([name] * table.num_rows, pa.string()))
+
+
+def fan_out(targets, sql, sql_by_dialect=None, timeout_s=DEFAULT_TIMEOUT_S, max_rows=result_pager.DEFAULT_MAX_ROWS):
+    """
+    Run ``sql`` on every engine in ``targets`` ({name: engine}) concurrently.
+    ``sql_by_dialect`` overrides the query for targets of a given dialect.
+
+    Returns {"table", "merge", "targets"} where "targets" has one status entry
+    per target (status, rows, elapsed_ms, error) and "table" holds the merged
+    rows of the targets that succeeded.
+    """
+    sql_by_dialect = sql_by_dialect or {}
+    plans = {dialect: MergePlan(text) for dialect, text in sql_by_dialect.items()}
+    default_plan = MergePlan(sql)
+    shapes = {(p.kind, len(p.columns)) for p in [default_plan, *plans.values()]}
+    if len(shapes) > 1:
+        # Per-dialect queries with different shapes can only be concatenated
+        default_plan = MergePlan("")
+        plans = {dialect: MergePlan("") for dialect in plans}
+
+    def target_sql(engine):
+        dialect = engine.dialect.name
+        plan = plans.get(dialect, default_plan)
+        if plan.kind == "aggregate":
+            return plan.target_sql
+        return sql_by_dialect.get(dialect, sql)
+
+    jobs, futures, statuses = {}, {}, {}
+    pager_options = {"max_rows": max_rows, "max_bytes": result_pager.DEFAULT_MAX_BYTES}
+    with telemetry.span("fanout", targets=len(targets)) as span:
+        started = time.perf_counter()
+        executor = _get_executor()
+        for name, engine in targets.items():
+            jobs[name] = query_jobs.QueryJob(engine, target_sql(engine), timeout_s, pager_options)
+            futures[executor.submit(_run_target, name, jobs[name])] = name
+        deadline = timeout_s + TIMEOUT_GRACE_S if timeout_s else None
+        # Targets beyond the pool size queue, so each deadline starts when its job starts running;
+        # the overall cap only stops a run whose workers never free up
+        give_up_at = time.monotonic() + deadline * -(-len(targets) // DEFAULT_WORKERS) if deadline else None
+        done, pending = set(), set(futures)
+        while pending:
+            finished, pending = wait(pending, timeout=0.1 if deadline else None, return_when=FIRST_COMPLETED)
+            done |= finished
+            if deadline is None:
+                continue
+            now = time.monotonic()
+            for future in list(pending):
+                job = jobs[futures[future]]
+                if job.started_at is not None and now - job.started_at > deadline:
+                    error = f"No result within {timeout_s}s"
+                elif now > give_up_at:
+                    error = f"No result within {timeout_s}s" if job.started_at is not None else "Never started: all fan-out workers stayed busy"
+                else:
+                    continue
+                pending.discard(future)
+                job.cancel()
+                statuses[futures[future]] = {"status": query_jobs.TIMED_OUT, "error": error}
+        tables = []
+        # Target order, not arrival order, so the combined rows do not depend on who answered first
+        for future in sorted(done, key=lambda f: list(targets).index(futures[f])):
+            name = futures[future]
+            job = jobs[name]
+            try:
+                table = future.result()
+            except Exception as e:
+                statuses[name] = {"status": query_jobs.FAILED, "error": str(e)}
+                continue
+            if table is None:
+                statuses[name] = {"status": job.status, "error": job.error}
+                continue
+            tables.append(table)
+            statuses[name] = {"status": query_jobs.DONE, "rows": table.num_rows, "truncated": job.pager.truncated}
+        for name, job in jobs.items():
+            statuses[name]["elapsed_ms"] = round(job.elapsed * 1000, 1)
+        merged = default_plan.merge(tables)
+        span["rows"] = merged.num_rows
+        span["failed"] = sum(1 for s in statuses.values() if s["status"] != query_jobs.DONE)
+    return {
+        "table": merged,
+        "merge": default_plan.kind,
+        "note": default_plan.note,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+        "targets": [{"target": name, **statuses[name]} for name in targets],
+    }
@@ -0,0 +1,193 @@
+"""
+CSV / Parquet ingestion into the connected database.
+
+Files are read as a stream of Arrow record batches (pyarrow's streaming CSV
+reader, or Parquet row batches), the table schema is inferred from the first
+batch, and each batch is written with the fastest bulk path of the dialect
+inside one transaction, so memory stays bounded by the batch size:
+
+- PostgreSQL: COPY ... FROM STDIN (FORMAT csv), one CSV buffer per batch
+- MySQL: multi-row INSERTs (PyMySQL rewrites executemany into them); LOAD DATA
+  LOCAL INFILE would need local_infile enabled on both client and server
+- SQLite: executemany inside the transaction, with the fast-load pragmas
+
+The schema catalog is refreshed as soon as the load commits.
+"""
+import datetime
+import io
+import os
+import re
+import time
+
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+from sqlalchemy import inspect
+
+import schema_catalog
+import sql_loader
+
+DEFAULT_BATCH_ROWS = 50_000
+CSV_BLOCK_SIZE = 2 * 1024 * 1024
+IF_EXISTS = ["fail", "replace", "append"]
+
+
+# ----------- Reading -----------
+def detect_format(filename):
+    return "parquet" if filename.lower().endswith((".parquet", ".pq")) else "csv"
+
+
+def table_name_for(filename):
+    """Turn a file name into a safe table name: ``Sales 2024.csv`` -> ``sales_2024``."""
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    name = re.sub(r"\W+", "_", stem).strip("_").lower() or "uploaded"
+    return f"t_{name}" if name[0].isdigit() else name
+
+
+def open_batches(source, fmt, batch_rows=DEFAULT_BATCH_ROWS):
+    """Return (schema, iterator of RecordBatches) for a CSV or Parquet file-like object or path."""
+    if fmt == "parquet":
+        parquet = pq.ParquetFile(source)
+        return parquet.schema_arrow, parquet.iter_batches(batch_size=batch_rows)
+    # Column types are inferred from the first block and then fixed for the rest of the file
+    reader = pacsv.open_csv(source, read_options=pacsv.ReadOptions(block_size=CSV_BLOCK_SIZE))
+    return reader.schema, iter(reader)
+
+
+# ----------- Schema -----------
+def sql_type(arrow_type, dialect):
+    if pa.types.is_boolean(arrow_type):
+        return "INTEGER" if dialect == "sqlite" else "BOOLEAN"
+    if pa.types.is_integer(arrow_type):
+        return "INTEGER" if dialect == "sqlite" else "BIGINT"
+    if pa.types.is_floating(arrow_type):
+        return {"sqlite": "REAL", "mysql": "DOUBLE"}.get(dialect, "DOUBLE PRECISION")
+    if pa.types.is_decimal(arrow_type):
+        return f"NUMERIC({arrow_type.precision}, {arrow_type.scale})"
+    if pa.types.is_date(arrow_type):
+        return "DATE"
+    if pa.types.is_timestamp(arrow_type):
+        return "DATETIME" if dialect == "mysql" else "TIMESTAMP"
+    if pa.types.is_time(arrow_type):
+        return "TIME"
+    return "TEXT"
+
+
+def quote(name, dialect):
+    if dialect == "mysql":
+        return "`" + name.replace("`", "``") + "`"
+    return '"' + name.replace('"', '""') + '"'
+
+
+def create_table_sql(table, schema, dialect):
+    columns = ",\n    ".join(f"{quote(field.name, dialect)} {sql_type(field.type, dialect)}" for field in schema)
+    return f"CREATE TABLE {quote(table, dialect)} (\n    {columns}\n)"
+
+
+def _prepare_table(conn, table, schema, if_exists):
+    dialect = conn.dialect.name
+    exists = inspect(conn).has_table(table)
+    if exists and if_exists == "fail":
+        raise ValueError(f"Table {table} already exists")
+    if exists and if_exists == "replace":
+        conn.exec_driver_sql(f"DROP TABLE {quote(table, dialect)}", execution_options={"no_parameters": True})
+        exists = False
+    if not exists:
+        # no_parameters: a header like "growth %" would otherwise be read as a format directive by pyformat drivers
+        conn.exec_driver_sql(create_table_sql(table, schema, dialect), execution_options={"no_parameters": True})
+
+
+# ----------- Writers -----------
+def _python_rows(batch, dialect):
+    columns = []
+    for column in batch.columns:
+        values = column.to_pylist()
+        if dialect == "sqlite" and (pa.types.is_temporal(column.type) or pa.types.is_decimal(column.type)):
+            # sqlite3's default date adapters are deprecated; store ISO text like the sample data
+            values = [v.isoformat() if isinstance(v, (datetime.date, datetime.time)) else (None if v is None else str(v)) for v in values]
+        columns.append(values)
+    return list(zip(*columns))
+
+
+def _write_postgres(cursor, table, batch):
+    buffer = io.BytesIO()
+    pacsv.write_csv(batch, buffer, pacsv.WriteOptions(include_header=False))
+    buffer.seek(0)
+    columns = ", ".join(quote(name, "postgresql") for name in batch.schema.names)
+    # pyarrow quotes every string, so an unquoted empty field is NULL and "" is an empty string
+    cursor.copy_expert(f"COPY {quote(table, 'postgresql')} ({columns}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+
+def _write_executemany(cursor, table, batch, dialect, marker):
+    columns = ", ".join(quote(name, dialect) for name in batch.schema.names)
+    if marker == "%s":
+        columns = columns.replace("%", "%%")
+    placeholders = ", ".join([marker] * batch.num_columns)
+    cursor.executemany(f"INSERT INTO {quote(table, dialect)} ({columns}) VALUES ({placeholders})", _python_rows(batch, dialect))
+
+
+def ingest(engine, source, fmt, table, if_exists="fail", batch_rows=DEFAULT_BATCH_ROWS, total_bytes=None,
+           on_progress=None, progress_every=1.0):
+    """
+    Stream a CSV or Parquet file into ``table`` in one transaction. Returns a stats
+    dict; the schema catalog for the engine is refreshed once the load commits.
+    """
+    dialect = engine.dialect.name
+    schema, batches = open_batches(source, fmt, batch_rows)
+    stats = {"table": table, "columns": len(schema), "rows": 0, "batches": 0, "elapsed_s": 0.0, "rows_per_s": 0.0}
+    start = time.perf_counter()
+    last_report = start
+
+    def report(force=False):
+        nonlocal last_report
+        now = time.perf_counter()
+        stats["elapsed_s"] = round(now - start, 3)
+        stats["rows_per_s"] = round(stats["rows"] / (now - start), 1) if now > start else 0.0
+        if on_progress is not None and (force or now - last_report >= progress_every):
+            last_report = now
+            position = source.tell() if hasattr(source, "tell") and not source.closed else None
+            on_progress(dict(stats, bytes=position, total_bytes=total_bytes))
+
+    with engine.connect() as conn:
+        restore = sql_loader.apply_fast_load(conn)
+        failed = False
+        try:
+            sql_loader.begin_load(conn)
+            _prepare_table(conn, table, schema, if_exists)
+            cursor = conn.connection.dbapi_connection.cursor()
+            marker = "?" if conn.dialect.paramstyle == "qmark" else "%s"
+            try:
+                for batch in batches:
+                    if batch.num_rows == 0:
+                        continue
+                    if dialect == "postgresql":
+                        _write_postgres(cursor, table, batch)
+                    else:
+                        _write_executemany(cursor, table, batch, dialect, marker)
+                    stats["rows"] += batch.num_rows
+                    stats["batches"] += 1
+                    report()
+            finally:
+                cursor.close()
+            conn.commit()
+        except Exception:
+            failed = True
+            conn.rollback()
+            raise
+        finally:
+            try:
+                for statement in restore:
+                    conn.exec_driver_sql(statement, execution_options={"no_parameters": True})
+                conn.commit()
+            except Exception:
+                # Never hide the error that stopped the load behind one from undoing the settings
+                if not failed:
+                    raise
+    report(force=True)
+    schema_catalog.get_catalog(engine)
+    return stats
+
+
+def ingest_path(engine, path, table=None, **options):
+    with open(path, "rb") as f:
+        return ingest(engine, f, detect_format(path), table or table_name_for(path), total_bytes=os.path.getsize(path), **options)
@@ -0,0 +1,197 @@
+"""
+Persistent NL -> SQL generation cache.
+
+Generated SQL is stored in a small SQLite file keyed on the normalized question,
+the schema fingerprint and the model name, so repeated questions skip the LLM
+round trip entirely. Entries expire after a TTL and the table is trimmed back to
+``max_entries`` by least-recent use. An optional near-duplicate tier compares a
+hashed bag-of-words vector of the question against cached questions for the same
+schema and model, to catch simple rephrasings. A near duplicate must name the
+same numbers and the same quoted or capitalized values ("Engineering" vs
+"Marketing"), since those change the SQL however alike the wording is.
+"""
+import hashlib
+import json
+import math
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_PATH = ".sqlgenius_cache.db"
+DEFAULT_MAX_ENTRIES = 1000
+DEFAULT_TTL_SECONDS = 7 * 24 * 3600
+DEFAULT_SIMILARITY_THRESHOLD = 0.9
+
+_VECTOR_DIM = 1024
+_lock = threading.Lock()
+_caches = {}
+
+
+def normalize_question(question):
+    text = re.sub(r"\s+", " ", (question or "").strip().lower())
+    return text.rstrip(" ?.!;")
+
+
+def _cache_key(question, fingerprint, model):
+    payload = "\x1f".join([normalize_question(question), fingerprint or "", model or ""])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _numbers(question):
+    return sorted(re.findall(r"\d+(?:\.\d+)?", question))
+
+
+def _entities(question):
+    """Quoted spans and capitalized words after the first, e.g. ['engineering', 'r&d']."""
+    text = re.sub(r"\s+", " ", (question or "").strip())
+    quoted = re.findall(r"[\"'“‘]([^\"'”’]+)[\"'”’]", text)
+    words = re.findall(r"[A-Z][\w&.-]*", " ".join(text.split(" ")[1:]))
+    return sorted({value.lower() for value in quoted + words})
+
+
+def question_vector(question):
+    """Sparse, L2-normalized hashed vector of word unigrams and bigrams."""
+    words = re.findall(r"[a-z0-9]+", normalize_question(question))
+    features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    vector = {}
+    for feature in features:
+        bucket = int(hashlib.blake2b(feature.encode("utf-8"), digest_size=4).hexdigest(), 16) % _VECTOR_DIM
+        vector[bucket] = vector.get(bucket, 0.0) + 1.0
+    norm = math.sqrt(sum(v * v for v in vector.values())) or 1.0
+    return {k: v / norm for k, v in vector.items()}
+
+
+def cosine(a, b):
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(v * b.get(k, 0.0) for k, v in a.items())
+
+
+class GenerationCache:
+    def __init__(self, path=DEFAULT_PATH, max_entries=DEFAULT_MAX_ENTRIES, ttl_seconds=DEFAULT_TTL_SECONDS,
+                 near_duplicates=False, similarity_threshold=DEFAULT_SIMILARITY_THRESHOLD):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.near_duplicates = near_duplicates
+        self.similarity_threshold = similarity_threshold
+        self.stats = {"hits": 0, "near_hits": 0, "misses": 0}
+        self._stats_lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS generations ("
+                " key TEXT PRIMARY KEY, question TEXT, schema_fingerprint TEXT, model TEXT,"
+                " sql TEXT, vector TEXT, created_at REAL, last_used REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS generations_scope ON generations(schema_fingerprint, model)")
+            conn.execute("CREATE INDEX IF NOT EXISTS generations_last_used ON generations(last_used)")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _count(self, name):
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    def get(self, question, fingerprint, model):
+        """Return cached SQL for the question, or None on a miss."""
+        now = time.time()
+        oldest = now - self.ttl_seconds
+        key = _cache_key(question, fingerprint, model)
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT sql FROM generations WHERE key = ? AND created_at >= ?", (key, oldest)
+            ).fetchone()
+            if row is not None:
+                conn.execute("UPDATE generations SET last_used = ? WHERE key = ?", (now, key))
+                self._count("hits")
+                return row[0]
+
+            if self.near_duplicates:
+                target = question_vector(question)
+                numbers = _numbers(question)
+                entities = _entities(question)
+                best_key, best_sql, best_score = None, None, 0.0
+                rows = conn.execute(
+                    "SELECT key, question, sql, vector FROM generations "
+                    "WHERE schema_fingerprint = ? AND model = ? AND created_at >= ?",
+                    (fingerprint, model, oldest),
+                )
+                for candidate_key, candidate_question, sql, vector in rows:
+                    # A rephrasing with different numbers needs different SQL, however similar the words
+                    if _numbers(candidate_question) != numbers:
+                        continue
+                    # Likewise for named values: "... in Engineering" is not "... in Marketing"
+                    if _entities(candidate_question) != entities:
+                        continue
+                    score = cosine(target, {int(k): v for k, v in json.loads(vector).items()})
+                    if score > best_score:
+                        best_key, best_sql, best_score = candidate_key, sql, score
+                if best_key is not None and best_score >= self.similarity_threshold:
+                    conn.execute("UPDATE generations SET last_used = ? WHERE key = ?", (now, best_key))
+                    self._count("near_hits")
+                    return best_sql
+
+        self._count("misses")
+        return None
+
+    def put(self, question, fingerprint, model, sql):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO generations VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    _cache_key(question, fingerprint, model),
+                    # Case is kept so that _entities() can read the named values back
+                    re.sub(r"\s+", " ", question.strip()).rstrip(" ?.!;"),
+                    fingerprint,
+                    model,
+                    sql,
+                    json.dumps(question_vector(question)),
+                    now,
+                    now,
+                ),
+            )
+            conn.execute("DELETE FROM generations WHERE created_at < ?", (now - self.ttl_seconds,))
+            conn.execute(
+                "DELETE FROM generations WHERE key IN ("
+                " SELECT key FROM generations ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM generations")
+        with self._stats_lock:
+            self.stats = {"hits": 0, "near_hits": 0, "misses": 0}
+
+    def summary(self):
+        with self._connect() as conn:
+            entries = conn.execute("SELECT COUNT(*) FROM generations").fetchone()[0]
+        with self._stats_lock:
+            stats = dict(self.stats)
+        lookups = stats["hits"] + stats["near_hits"] + stats["misses"]
+        stats["entries"] = entries
+        stats["hit_rate"] = round((stats["hits"] + stats["near_hits"]) / lookups, 3) if lookups else 0.0
+        return stats
+
+
+def get_cache(path=DEFAULT_PATH, **options):
+    """Return the process-wide cache for this file, applying any updated options."""
+    with _lock:
+        cache = _caches.get(path)
+        if cache is None:
+            cache = _caches[path] = GenerationCache(path, **options)
+        else:
+            for name, value in options.items():
+                setattr(cache, name, value)
+        return cache
@@ -0,0 +1,376 @@
+"""
+Workload-driven index advisor.
+
+Every approved query is recorded per engine with its plan. advise() mines the
+workload for columns used in filters, join conditions and GROUP BY, proposes
+single-column indexes (and a two-column one where a query filters on two
+columns of the same table), and ranks them by how much cheaper the recorded
+queries become with the index in place. Picks are greedy, so each proposal's
+benefit is measured with the earlier proposals already built:
+
+- SQLite: the schema and sqlite_stat1 are copied into an in-memory database,
+  where each candidate is created for real; benefit is the rows no longer read
+  by full scans (or automatic indexes), weighted by how often the query ran
+- PostgreSQL with the hypopg extension: hypothetical indexes, before/after
+  EXPLAIN total cost
+- otherwise: a usage score (filter > join > group by) for columns of tables
+  the recorded plans scan in full, without an after estimate
+
+Only SQLite indexes can be built from the app; for the other dialects the DDL
+is shown to hand to a DBA.
+"""
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import sqlparse
+from sqlalchemy import inspect, text
+from sqlparse import tokens as T
+
+import cost_guard
+import result_cache
+import schema_catalog
+import telemetry
+
+MAX_QUERIES = 500
+MAX_CANDIDATES = 20
+USE_WEIGHTS = {"filter": 3, "join": 2, "group": 1}
+
+_CLAUSES = {"WHERE": "filter", "ON": "join", "GROUP BY": "group"}
+_SQLITE_SCAN = re.compile(r"^(SCAN|SEARCH)\s+(?:TABLE\s+)?([^\s(]+)", re.IGNORECASE)
+
+_lock = threading.Lock()
+_workloads = {}
+
+
+# ----------- Workload -----------
+def record(engine, query, plan=None):
+    """Remember an approved query (and its cost_guard estimate, when one was made)."""
+    key = result_cache.normalize_sql(query)
+    if not key or not key.upper().startswith(("SELECT", "WITH")):
+        return
+    with _lock:
+        workload = _workloads.setdefault(engine, OrderedDict())
+        entry = workload.pop(key, None) or {"query": query, "count": 0, "plan": None}
+        entry["count"] += 1
+        if plan is not None and "error" not in plan:
+            entry["plan"] = plan
+        workload[key] = entry
+        while len(workload) > MAX_QUERIES:
+            workload.popitem(last=False)
+
+
+def workload(engine):
+    with _lock:
+        return [dict(entry) for entry in _workloads.get(engine, {}).values()]
+
+
+def clear(engine):
+    with _lock:
+        _workloads.pop(engine, None)
+
+
+# ----------- Workload Mining -----------
+def column_uses(query, catalog):
+    """[(table, column, use)] for columns in WHERE, JOIN ... ON and GROUP BY, resolved through aliases."""
+    aliases = {name.lower(): table for name, table in cost_guard.table_aliases(query).items()}
+    columns = {
+        name: {col["name"].lower(): col["name"] for col in table["columns"]}
+        for name, table in catalog.tables.items()
+    }
+    in_query = [table for table in set(aliases.values()) if table in columns]
+    tokens = [t for t in sqlparse.parse(query)[0].flatten() if not t.is_whitespace and t.ttype not in T.Comment]
+    uses, clause, calls = [], None, []
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if token.ttype in T.Keyword or token.ttype in T.DML:
+            clause = _CLAUSES.get(token.normalized, clause if token.normalized in ("AND", "OR", "NOT") else None)
+        elif token.ttype is T.Punctuation and token.value == "(":
+            # Columns wrapped in a function call cannot use a plain index
+            calls.append(i > 0 and tokens[i - 1].ttype in (T.Name, T.Keyword))
+        elif token.ttype is T.Punctuation and token.value == ")":
+            if calls:
+                calls.pop()
+        elif token.ttype in (T.Name, T.String.Symbol) and clause and not any(calls):
+            qualifier, name = None, token.value.strip('"`')
+            if i + 2 < len(tokens) and tokens[i + 1].value == "." and tokens[i + 2].ttype in (T.Name, T.String.Symbol):
+                qualifier, name = name, tokens[i + 2].value.strip('"`')
+                i += 2
+            if not (i + 1 < len(tokens) and tokens[i + 1].value == "("):
+                if qualifier is not None:
+                    owners = [aliases.get(qualifier.lower())]
+                else:
+                    owners = [table for table in in_query if name.lower() in columns[table]]
+                if len(owners) == 1 and owners[0] in columns and name.lower() in columns[owners[0]]:
+                    uses.append((owners[0], columns[owners[0]][name.lower()], clause))
+        i += 1
+    return uses
+
+
+def _existing_prefixes(engine, catalog, tables):
+    """Leading columns already served by an index or the primary key, per table."""
+    inspector = inspect(engine)
+    prefixes = {}
+    for table in tables:
+        served = set()
+        primary_key = catalog.tables[table]["primary_key"]
+        if primary_key:
+            served.add(tuple(c.lower() for c in primary_key[:1]))
+        try:
+            indexes = inspector.get_indexes(table)
+        except Exception:
+            indexes = []
+        for index in indexes:
+            names = [c.lower() for c in index.get("column_names") or [] if c]
+            for width in range(1, len(names) + 1):
+                served.add(tuple(names[:width]))
+        prefixes[table] = served
+    return prefixes
+
+
+def index_name(table, columns):
+    return "ix_" + "_".join([table, *columns])[:60]
+
+
+def index_ddl(table, columns, dialect):
+    quote = "`" if dialect == "mysql" else '"'
+    cols = ", ".join(f"{quote}{c}{quote}" for c in columns)
+    return f"CREATE INDEX {quote}{index_name(table, columns)}{quote} ON {quote}{table}{quote} ({cols})"
+
+
+def candidates(engine, entries, catalog):
+    """Candidate indexes not already covered, with the queries and uses behind each."""
+    found = {}
+    for number, entry in enumerate(entries):
+        try:
+            uses = column_uses(entry["query"], catalog)
+        except Exception:
+            continue
+        keys = [((table, (column,)), use) for table, column, use in uses]
+        filters = {}
+        for table, column, use in uses:
+            if use == "filter" and column not in filters.setdefault(table, []):
+                filters[table].append(column)
+        keys += [((table, tuple(cols[:2])), "filter") for table, cols in filters.items() if len(cols) > 1]
+        for key, use in keys:
+            candidate = found.setdefault(key, {"table": key[0], "columns": list(key[1]), "uses": {}, "queries": set()})
+            candidate["uses"][use] = candidate["uses"].get(use, 0) + entry["count"]
+            candidate["queries"].add(number)
+    served = _existing_prefixes(engine, catalog, {table for table, _ in found})
+    ranked = [
+        candidate for (table, columns), candidate in found.items()
+        if tuple(c.lower() for c in columns) not in served[table]
+    ]
+    ranked.sort(key=lambda c: -sum(USE_WEIGHTS[use] * n for use, n in c["uses"].items()))
+    return ranked[:MAX_CANDIDATES]
+
+
+# ----------- What-if Evaluation -----------
+def _sqlite_read_rows(plan_rows, aliases, sizes):
+    """Rows read by full scans and automatic-index builds in an EXPLAIN QUERY PLAN."""
+    total = 0
+    for detail in plan_rows:
+        match = _SQLITE_SCAN.match(detail)
+        if not match or detail.upper().startswith("SCAN CONSTANT ROW"):
+            continue
+        kind, table = match.group(1).upper(), aliases.get(match.group(2), match.group(2))
+        if (kind == "SCAN" and "COVERING INDEX" not in detail.upper()) or "USING AUTOMATIC" in detail.upper():
+            total += sizes.get(table) or 1
+    return total
+
+
+class _SQLiteWhatIf:
+    """In-memory copy of the schema and planner statistics, without the data."""
+
+    method = "hypothetical (in-memory schema copy)"
+
+    def __init__(self, engine):
+        self.shadow = sqlite3.connect(":memory:", check_same_thread=False)
+        with engine.connect() as conn:
+            for (ddl,) in conn.exec_driver_sql(
+                "SELECT sql FROM sqlite_master WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%' "
+                "ORDER BY CASE type WHEN 'table' THEN 0 WHEN 'index' THEN 1 ELSE 2 END"
+            ):
+                self.shadow.execute(ddl)
+            try:
+                stats = list(conn.exec_driver_sql("SELECT tbl, idx, stat FROM sqlite_stat1"))
+            except Exception:
+                stats = []
+            names = [name for (name,) in self.shadow.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+            self.sizes = {name: cost_guard.sqlite_table_rows(conn, name) for name in names}
+        if stats:
+            self.shadow.execute("ANALYZE")
+            self.shadow.executemany("INSERT INTO sqlite_stat1 (tbl, idx, stat) VALUES (?, ?, ?)", stats)
+            # Makes the planner reload the statistics it just received
+            self.shadow.execute("ANALYZE sqlite_master")
+
+    def cost(self, query):
+        plan = [row[-1] for row in self.shadow.execute(f"EXPLAIN QUERY PLAN {query.strip().rstrip(';')}")]
+        return _sqlite_read_rows(plan, cost_guard.table_aliases(query), self.sizes)
+
+    def create(self, candidate):
+        self.shadow.execute(index_ddl(candidate["table"], candidate["columns"], "sqlite"))
+
+    def drop(self, candidate):
+        self.shadow.execute(f'DROP INDEX "{index_name(candidate["table"], candidate["columns"])}"')
+
+    def close(self):
+        self.shadow.close()
+
+
+class _HypoPGWhatIf:
+    """Hypothetical indexes from the hypopg extension, private to one session."""
+
+    method = "hypothetical (hypopg)"
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.oids = {}
+
+    def cost(self, query):
+        try:
+            return cost_guard.explain(self.conn, query)["cost"] or 0.0
+        finally:
+            self.conn.rollback()
+
+    def create(self, candidate):
+        self.oids[index_name(candidate["table"], candidate["columns"])] = self.conn.execute(
+            text("SELECT indexrelid FROM hypopg_create_index(:ddl)"),
+            {"ddl": index_ddl(candidate["table"], candidate["columns"], "postgresql")},
+        ).scalar()
+
+    def drop(self, candidate):
+        oid = self.oids.pop(index_name(candidate["table"], candidate["columns"]))
+        self.conn.execute(text("SELECT hypopg_drop_index(:oid)"), {"oid": oid})
+
+    def close(self):
+        self.conn.execute(text("SELECT hypopg_reset()"))
+        self.conn.close()
+
+
+def _what_if(engine):
+    if engine.dialect.name == "sqlite":
+        return _SQLiteWhatIf(engine)
+    if engine.dialect.name == "postgresql":
+        conn = engine.connect()
+        if conn.exec_driver_sql("SELECT 1 FROM pg_extension WHERE extname = 'hypopg'").scalar():
+            return _HypoPGWhatIf(conn)
+        conn.close()
+    return None
+
+
+def _choose_greedily(what_if, entries, found):
+    """
+    Repeatedly keep the candidate that makes the workload cheapest given the
+    ones already kept, so an index made redundant by an earlier pick (say
+    (a) after (a, b)) is not proposed as well.
+    """
+    touching = {}
+    for candidate in found:
+        touching[candidate["table"]] = [
+            number for number, entry in enumerate(entries)
+            if candidate["table"] in cost_guard.table_aliases(entry["query"]).values()
+        ]
+    current = {}
+    for number in {n for numbers in touching.values() for n in numbers}:
+        try:
+            current[number] = what_if.cost(entries[number]["query"])
+        except Exception:
+            pass
+    chosen, remaining = [], list(found)
+    while remaining:
+        for candidate in remaining:
+            what_if.create(candidate)
+            try:
+                candidate["after_by_query"] = {
+                    n: what_if.cost(entries[n]["query"]) for n in touching[candidate["table"]] if n in current
+                }
+            finally:
+                what_if.drop(candidate)
+            numbers = candidate["after_by_query"]
+            candidate["before"] = sum(current[n] * entries[n]["count"] for n in numbers)
+            candidate["after"] = sum(numbers[n] * entries[n]["count"] for n in numbers)
+            candidate["score"] = candidate["before"] - candidate["after"]
+        best = max(remaining, key=lambda c: (c["score"], -len(c["columns"])))
+        if best["score"] <= 0:
+            break
+        what_if.create(best)
+        current.update(best["after_by_query"])
+        chosen.append(best)
+        remaining.remove(best)
+    return chosen
+
+
+def _score_by_usage(engine, entries, found):
+    """No what-if support: favour columns of tables the recorded plans scan in full."""
+    for candidate in found:
+        scanned = 0
+        for number in candidate["queries"]:
+            entry = entries[number]
+            if entry["plan"] is None:
+                try:
+                    entry["plan"] = cost_guard.estimate(engine, entry["query"])
+                except Exception:
+                    continue
+            if candidate["table"] in entry["plan"].get("full_scans", []):
+                scanned += entry["count"]
+        candidate["before"] = None
+        candidate["after"] = None
+        candidate["score"] = scanned * sum(USE_WEIGHTS[use] * n for use, n in candidate["uses"].items())
+    return sorted((c for c in found if c["score"] > 0), key=lambda c: -c["score"])
+
+
+def advise(engine):
+    """Ranked index proposals for the recorded workload of this engine."""
+    start = time.perf_counter()
+    entries = workload(engine)
+    with telemetry.span("index_advice", queries=len(entries)) as span:
+        catalog = schema_catalog.get_catalog(engine)
+        found = candidates(engine, entries, catalog)
+        chosen, method = [], None
+        if found:
+            what_if = _what_if(engine)
+            if what_if is None:
+                chosen, method = _score_by_usage(engine, entries, found), "usage score (no hypothetical indexes)"
+            else:
+                try:
+                    chosen, method = _choose_greedily(what_if, entries, found), what_if.method
+                finally:
+                    what_if.close()
+        proposals = [
+            {
+                "table": candidate["table"],
+                "columns": candidate["columns"],
+                "ddl": index_ddl(candidate["table"], candidate["columns"], engine.dialect.name),
+                "uses": ", ".join(f"{use} ×{n}" for use, n in sorted(candidate["uses"].items())),
+                "queries": len(candidate["queries"]),
+                "before": candidate["before"],
+                "after": candidate["after"],
+                "benefit": round(candidate["score"], 1),
+                "benefit_pct": round(100 * candidate["score"] / candidate["before"], 1) if candidate["before"] else None,
+            }
+            for candidate in chosen
+        ]
+        span.update(candidates=len(found), proposals=len(proposals))
+    return {
+        "queries": len(entries),
+        "method": method,
+        "proposals": proposals,
+        "elapsed_ms": round((time.perf_counter() - start) * 1000, 1),
+    }
+
+
+# ----------- Build -----------
+def create_indexes(engine, proposals):
+    """Build the proposed indexes on SQLite and refresh the planner statistics."""
+    if engine.dialect.name != "sqlite":
+        raise ValueError("Indexes can only be built from the app on SQLite; run the DDL on the server instead.")
+    with telemetry.span("index_build", indexes=len(proposals)), engine.begin() as conn:
+        for proposal in proposals:
+            conn.exec_driver_sql(proposal["ddl"].replace("CREATE INDEX", "CREATE INDEX IF NOT EXISTS", 1))
+        conn.exec_driver_sql("ANALYZE")
+    schema_catalog.invalidate(engine)
+    return [proposal["ddl"] for proposal in proposals]
@@ -0,0 +1,442 @@
+"""
+Process-wide Groq clients with retries, hedging and a circuit breaker.
+
+Clients are pooled per API key (and per event loop for the async ones), so
+keep-alive connections survive across Streamlit reruns and requests instead
+of paying TLS setup on every click. The wrappers expose the same
+``client.chat.completions.create(...)`` call as the SDK and add:
+
+- retries on 408 / 409 / 429 / 5xx and connection errors, with full-jitter
+  exponential backoff, or the server's ``Retry-After`` when it sends one
+- an optional hedged second request when the first is slower than the recent
+  p95 latency; the first answer wins (non-streaming calls only)
+- a circuit breaker that fails fast after repeated server failures and lets a
+  single trial request through once the cool-down has passed
+
+The SDK's own retries are turned off so attempts are counted once. Point
+``GROQ_BASE_URL`` at a local stub server to exercise all of this offline.
+"""
+import asyncio
+import email.utils
+import random
+import threading
+import time
+import weakref
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import groq
+import httpx
+
+DEFAULT_POLICY = {
+    "max_retries": 3,
+    "base_delay_s": 0.5,
+    "max_delay_s": 8.0,
+    "max_retry_after_s": 30.0,
+    "timeout_s": 60.0,
+    "hedge": False,
+    "hedge_quantile": 0.95,
+    "hedge_min_samples": 20,
+    "breaker_failures": 5,
+    "breaker_reset_s": 30.0,
+}
+RETRY_STATUSES = {408, 409, 429}
+LATENCY_WINDOW = 200
+
+_policy = dict(DEFAULT_POLICY)
+_policy_lock = threading.Lock()
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised without calling the API while the breaker is open."""
+
+
+def configure(**policy):
+    """Update the process-wide retry / hedging / breaker policy."""
+    unknown = set(policy) - set(DEFAULT_POLICY)
+    if unknown:
+        raise ValueError(f"Unknown LLM client options: {', '.join(sorted(unknown))}")
+    with _policy_lock:
+        _policy.update(policy)
+
+
+def policy():
+    with _policy_lock:
+        return dict(_policy)
+
+
+# ----------- Stats -----------
+_stats = {
+    "requests": 0,
+    "attempts": 0,
+    "retries": 0,
+    "rate_limited": 0,
+    "server_errors": 0,
+    "connection_errors": 0,
+    "hedges": 0,
+    "hedge_wins": 0,
+    "breaker_rejections": 0,
+    "breaker_trips": 0,
+    "clients_created": 0,
+}
+_stats_lock = threading.Lock()
+
+
+def _record(**increments):
+    with _stats_lock:
+        for name, value in increments.items():
+            _stats[name] += value
+
+
+class LatencyWindow:
+    """Recent successful call latencies, for the hedging threshold."""
+
+    def __init__(self, size=LATENCY_WINDOW):
+        self.samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            self.samples.append(seconds)
+
+    def quantile(self, q, min_samples):
+        with self._lock:
+            if len(self.samples) < min_samples:
+                return None
+            ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class CircuitBreaker:
+    def __init__(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self._trials = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self.opened_at is None:
+                return "closed"
+            return "half-open" if time.monotonic() - self.opened_at >= policy()["breaker_reset_s"] else "open"
+
+    def before_call(self):
+        """Raise CircuitOpenError while open; return a trial token when this call is the half-open trial, else None."""
+        with self._lock:
+            if self.opened_at is None:
+                return None
+            if time.monotonic() - self.opened_at < policy()["breaker_reset_s"] or self.trial_in_flight:
+                _record(breaker_rejections=1)
+                raise CircuitOpenError("LLM API is failing; not sending requests for a while")
+            # Half-open: this call is the trial
+            self.trial_in_flight = True
+            self._trials += 1
+            return self._trials
+
+    def abandon_trial(self, token):
+        """
+        End a trial that neither succeeded nor failed (cancelled, or given up
+        after rate limiting) so the next call can try again; opened_at is kept.
+        """
+        with self._lock:
+            if self.trial_in_flight and token == self._trials:
+                self.trial_in_flight = False
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.trial_in_flight or self.failures >= policy()["breaker_failures"]:
+                if self.opened_at is None or self.trial_in_flight:
+                    _record(breaker_trips=1)
+                self.opened_at = time.monotonic()
+            self.trial_in_flight = False
+
+
+def summary():
+    with _stats_lock:
+        stats = dict(_stats)
+    threshold = latencies.quantile(policy()["hedge_quantile"], policy()["hedge_min_samples"])
+    stats["hedge_threshold_ms"] = round(threshold * 1000, 1) if threshold is not None else None
+    stats["breaker"] = breaker.state
+    stats["pooled_clients"] = len(_sync_clients) + sum(len(c) for c in list(_async_clients.values())) + len(_unbound_async)
+    return stats
+
+
+latencies = LatencyWindow()
+breaker = CircuitBreaker()
+
+
+# ----------- Retry Decisions -----------
+def _classify(error):
+    """'rate_limited' / 'server_errors' / 'connection_errors' for retryable errors, else None."""
+    if isinstance(error, groq.APIConnectionError):
+        return "connection_errors"
+    if isinstance(error, groq.APIStatusError):
+        if error.status_code == 429:
+            return "rate_limited"
+        if error.status_code >= 500 or error.status_code in RETRY_STATUSES:
+            return "server_errors"
+    return None
+
+
+def _retry_after(error):
+    """Seconds the server asked us to wait, if it said."""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    if headers.get("retry-after-ms"):
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        parsed = email.utils.parsedate_to_datetime(value)
+        return max(0.0, parsed.timestamp() - time.time()) if parsed else None
+
+
+def backoff_delay(attempt, error=None, settings=None):
+    settings = settings or policy()
+    server_delay = _retry_after(error) if error is not None else None
+    if server_delay is not None:
+        return min(server_delay, settings["max_retry_after_s"])
+    # Full jitter: spreads retries from concurrent sessions instead of synchronising them
+    return random.uniform(0, min(settings["max_delay_s"], settings["base_delay_s"] * 2 ** attempt))
+
+
+def _failed(error, attempt, settings):
+    """Record a failed attempt; return the delay before retrying, or None to give up."""
+    kind = _classify(error)
+    if kind is None:
+        # The API answered (e.g. 400 / 401): not an outage, and it ends a half-open trial
+        breaker.success()
+        return None
+    _record(**{kind: 1})
+    if kind != "rate_limited":
+        # Throttling means the API is up; only real failures count towards the breaker
+        breaker.failure()
+    if attempt >= settings["max_retries"] or breaker.state == "open":
+        return None
+    _record(retries=1)
+    return backoff_delay(attempt, error, settings)
+
+
+# ----------- Sync Client -----------
+_hedge_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="sqlgenius-llm-hedge")
+
+
+class _Completions:
+    def __init__(self, create):
+        self.create = create
+
+
+class _Chat:
+    def __init__(self, create):
+        self.completions = _Completions(create)
+
+
+class LLMClient:
+    def __init__(self, api_key):
+        settings = policy()
+        self.api_key = api_key
+        self.raw = groq.Groq(
+            api_key=api_key,
+            max_retries=0,
+            timeout=settings["timeout_s"],
+            http_client=groq.DefaultHttpxClient(limits=httpx.Limits(max_connections=50, max_keepalive_connections=20)),
+        )
+        self.chat = _Chat(self._create)
+
+    def _once(self, kwargs):
+        start = time.perf_counter()
+        response = self.raw.chat.completions.create(**kwargs)
+        latencies.observe(time.perf_counter() - start)
+        return response
+
+    def _hedged(self, kwargs, threshold):
+        first = _hedge_pool.submit(self._once, kwargs)
+        done, _ = wait([first], timeout=threshold)
+        if done:
+            return first.result()
+        _record(hedges=1)
+        second = _hedge_pool.submit(self._once, kwargs)
+        pending = {first, second}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is second:
+                        _record(hedge_wins=1)
+                    # The slower request cannot be aborted from here; its answer is dropped
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def _create(self, **kwargs):
+        settings = policy()
+        trial = breaker.before_call()
+        _record(requests=1)
+        attempt = 0
+        try:
+            while True:
+                _record(attempts=1)
+                threshold = latencies.quantile(settings["hedge_quantile"], settings["hedge_min_samples"])
+                try:
+                    if settings["hedge"] and threshold is not None and not kwargs.get("stream"):
+                        response = self._hedged(kwargs, threshold)
+                    elif kwargs.get("stream"):
+                        response = self.raw.chat.completions.create(**kwargs)
+                    else:
+                        response = self._once(kwargs)
+                except Exception as e:
+                    delay = _failed(e, attempt, settings)
+                    if delay is None:
+                        raise
+                    time.sleep(delay)
+                    attempt += 1
+                    continue
+                breaker.success()
+                return response
+        finally:
+            if trial is not None:
+                # A no-op once success() / failure() has settled the trial
+                breaker.abandon_trial(trial)
+
+
+# ----------- Async Client -----------
+class AsyncLLMClient:
+    def __init__(self, api_key):
+        settings = policy()
+        self.api_key = api_key
+        self.raw = groq.AsyncGroq(
+            api_key=api_key,
+            max_retries=0,
+            timeout=settings["timeout_s"],
+            http_client=groq.DefaultAsyncHttpxClient(limits=httpx.Limits(max_connections=50, max_keepalive_connections=20)),
+        )
+        self.chat = _Chat(self._create)
+
+    async def _once(self, kwargs):
+        start = time.perf_counter()
+        response = await self.raw.chat.completions.create(**kwargs)
+        latencies.observe(time.perf_counter() - start)
+        return response
+
+    async def _hedged(self, kwargs, threshold):
+        first = asyncio.ensure_future(self._once(kwargs))
+        done, _ = await asyncio.wait([first], timeout=threshold)
+        if done:
+            return first.result()
+        _record(hedges=1)
+        second = asyncio.ensure_future(self._once(kwargs))
+        pending = {first, second}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            _record(hedge_wins=1)
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _create(self, **kwargs):
+        settings = policy()
+        trial = breaker.before_call()
+        _record(requests=1)
+        attempt = 0
+        try:
+            while True:
+                _record(attempts=1)
+                threshold = latencies.quantile(settings["hedge_quantile"], settings["hedge_min_samples"])
+                try:
+                    if settings["hedge"] and threshold is not None and not kwargs.get("stream"):
+                        response = await self._hedged(kwargs, threshold)
+                    elif kwargs.get("stream"):
+                        response = await self.raw.chat.completions.create(**kwargs)
+                    else:
+                        response = await self._once(kwargs)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    delay = _failed(e, attempt, settings)
+                    if delay is None:
+                        raise
+                    await asyncio.sleep(delay)
+                    attempt += 1
+                    continue
+                breaker.success()
+                return response
+        finally:
+            if trial is not None:
+                # A no-op once success() / failure() has settled the trial
+                breaker.abandon_trial(trial)
+
+
+# ----------- Pools -----------
+_sync_clients = {}
+# Async connections belong to the event loop that opened them
+_async_clients = weakref.WeakKeyDictionary()
+_unbound_async = {}
+_pool_lock = threading.Lock()
+
+
+def get_client(api_key):
+    with _pool_lock:
+        client = _sync_clients.get(api_key)
+        if client is None:
+            client = _sync_clients[api_key] = LLMClient(api_key)
+            _record(clients_created=1)
+        return client
+
+
+def get_async_client(api_key):
+    """The pooled async client for ``api_key`` on the running event loop (or for the next loop to use it)."""
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = None
+    with _pool_lock:
+        clients = _async_clients.setdefault(loop, {}) if loop is not None else _unbound_async
+        client = clients.get(api_key)
+        if client is None:
+            client = clients[api_key] = AsyncLLMClient(api_key)
+            _record(clients_created=1)
+        return client
+
+
+# ----------- Background Loop -----------
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def run(coroutine):
+    """
+    Run a coroutine on a long-lived background event loop and wait for it, so
+    async clients (and their connections) are reused across synchronous calls.
+    """
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="sqlgenius-llm-loop", daemon=True).start()
+    return asyncio.run_coroutine_threadsafe(coroutine, _loop).result()
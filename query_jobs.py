@@ -0,0 +1,237 @@
+"""
+Non-blocking query execution.
+
+Approved queries are submitted to a bounded, process-wide worker pool as
+tracked jobs instead of running inside the Streamlit script thread. Each job
+gets a per-dialect statement timeout and can be cancelled for real on the
+server:
+
+- PostgreSQL: SET LOCAL statement_timeout, cancelled with pg_cancel_backend()
+- MySQL: MAX_EXECUTION_TIME optimizer hint, cancelled with KILL QUERY
+- SQLite: a progress handler that interrupts past the deadline, cancelled with
+  sqlite3.Connection.interrupt()
+
+Jobs nobody has polled for a while (the browser tab was closed) are cancelled
+and their cursors released by a background reaper, which also releases the
+open cursor of a collected result nobody has paged through for as long.
+"""
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import text
+
+import result_pager
+
+DEFAULT_WORKERS = 4
+DEFAULT_TIMEOUT_S = 30
+ABANDON_AFTER_S = 60
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+TIMED_OUT = "timed out"
+
+_TIMEOUT_MARKERS = ("statement timeout", "maximum statement execution time", "interrupted")
+
+
+def add_mysql_time_limit(query, timeout_ms):
+    """Scope MAX_EXECUTION_TIME to this SELECT with an optimizer hint."""
+    return re.sub(r"^\s*SELECT\b", f"SELECT /*+ MAX_EXECUTION_TIME({int(timeout_ms)}) */", query, count=1, flags=re.IGNORECASE)
+
+
+class QueryJob:
+    def __init__(self, engine, query, timeout_s, pager_options):
+        self.id = uuid.uuid4().hex[:12]
+        self.engine = engine
+        self.query = query
+        self.timeout_s = timeout_s
+        self.pager_options = pager_options
+        self.status = QUEUED
+        self.error = None
+        self.pager = None
+        self.submitted_at = time.monotonic()
+        self.started_at = None
+        self.finished_at = None
+        self.last_polled = time.monotonic()
+        self._backend_id = None
+        self._dbapi_conn = None
+        self._cancel_requested = False
+        self._lock = threading.Lock()
+
+    @property
+    def finished(self):
+        return self.status in (DONE, FAILED, CANCELLED, TIMED_OUT)
+
+    @property
+    def elapsed(self):
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    def poll(self):
+        self.last_polled = time.monotonic()
+        return {"id": self.id, "status": self.status, "elapsed_s": round(self.elapsed, 1), "error": self.error}
+
+    # --- per-dialect hooks ---
+    def _on_connect(self, conn):
+        dialect = conn.dialect.name
+        timeout_ms = int(self.timeout_s * 1000) if self.timeout_s else 0
+        if dialect == "postgresql":
+            self._backend_id = conn.exec_driver_sql("SELECT pg_backend_pid()").scalar()
+            if timeout_ms:
+                # SET LOCAL lasts until the transaction ends, so the pooled connection is not affected
+                conn.exec_driver_sql(f"SET LOCAL statement_timeout = {timeout_ms}")
+        elif dialect == "mysql":
+            self._backend_id = conn.exec_driver_sql("SELECT CONNECTION_ID()").scalar()
+        elif dialect == "sqlite":
+            self._dbapi_conn = conn.connection.dbapi_connection
+            self._dbapi_conn.set_progress_handler(self._sqlite_progress, 10_000)
+
+    def _sqlite_progress(self):
+        if self._cancel_requested:
+            return 1
+        if self.timeout_s and time.monotonic() - self.started_at > self.timeout_s:
+            return 1
+        return 0
+
+    def run(self):
+        with self._lock:
+            if self._cancel_requested:
+                self.status = CANCELLED
+                return
+            self.status = RUNNING
+            self.started_at = time.monotonic()
+        query = self.query
+        if self.engine.dialect.name == "mysql" and self.timeout_s:
+            query = add_mysql_time_limit(query, self.timeout_s * 1000)
+        try:
+            self.pager = result_pager.ResultPager(
+                self.engine, query, on_connect=self._on_connect, **self.pager_options
+            ).open()
+            self.status = DONE
+        except Exception as e:
+            message = str(e)
+            if self._cancel_requested:
+                self.status = CANCELLED
+            elif any(marker in message.lower() for marker in _TIMEOUT_MARKERS):
+                self.status = TIMED_OUT
+            else:
+                self.status = FAILED
+            self.error = message
+        finally:
+            if self._dbapi_conn is not None:
+                # Later pages are fetched on demand; the deadline only covers the first one
+                self._dbapi_conn.set_progress_handler(None, 0)
+                self._dbapi_conn = None
+            self._backend_id = None
+            self.finished_at = time.monotonic()
+
+    def cancel(self):
+        """Stop the query on the server, or drop the job if it has not started yet."""
+        with self._lock:
+            self._cancel_requested = True
+            if self.status == QUEUED:
+                self.status = CANCELLED
+                return
+        if self.finished:
+            return
+        dialect = self.engine.dialect.name
+        if dialect == "sqlite" and self._dbapi_conn is not None:
+            self._dbapi_conn.interrupt()
+        elif self._backend_id is not None:
+            with self.engine.connect() as conn:
+                if dialect == "postgresql":
+                    conn.execute(text("SELECT pg_cancel_backend(:pid)"), {"pid": self._backend_id})
+                elif dialect == "mysql":
+                    conn.exec_driver_sql(f"KILL QUERY {int(self._backend_id)}")
+
+    def close(self):
+        if self.pager is not None:
+            self.pager.close()
+
+
+class JobManager:
+    def __init__(self, max_workers=DEFAULT_WORKERS, abandon_after_s=ABANDON_AFTER_S):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="sqlgenius-query")
+        self.abandon_after_s = abandon_after_s
+        self.jobs = {}
+        self.pagers = {}
+        self._lock = threading.Lock()
+        reaper = threading.Thread(target=self._reap_forever, name="sqlgenius-query-reaper", daemon=True)
+        reaper.start()
+
+    def submit(self, engine, query, timeout_s=DEFAULT_TIMEOUT_S, **pager_options):
+        job = QueryJob(engine, query, timeout_s, pager_options)
+        with self._lock:
+            self.jobs[job.id] = job
+        self.executor.submit(job.run)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def forget(self, job_id):
+        with self._lock:
+            self.jobs.pop(job_id, None)
+
+    def collect(self, job_id):
+        """
+        Take a finished job's pager out of the manager. A pager that still has
+        rows to fetch stays watched, so its connection is released once nobody
+        has asked for a page in ``abandon_after_s``.
+        """
+        with self._lock:
+            job = self.jobs.pop(job_id, None)
+            if job is None or job.pager is None:
+                return None
+            if not job.pager.exhausted:
+                self.pagers[job_id] = job.pager
+            return job.pager
+
+    def reap(self):
+        """Cancel jobs whose session stopped polling, drop finished jobs nobody collected and release idle pagers."""
+        now = time.monotonic()
+        with self._lock:
+            stale = [job for job in self.jobs.values() if now - job.last_polled > self.abandon_after_s]
+            for job in stale:
+                if job.finished:
+                    del self.jobs[job.id]
+            idle = [
+                (job_id, pager) for job_id, pager in self.pagers.items()
+                if pager.exhausted or now - pager.last_used > self.abandon_after_s
+            ]
+            for job_id, _ in idle:
+                del self.pagers[job_id]
+        for _, pager in idle:
+            pager.release()
+        for job in stale:
+            if job.finished:
+                job.close()
+            else:
+                job.cancel()
+
+    def _reap_forever(self):
+        while True:
+            time.sleep(5)
+            try:
+                self.reap()
+            except Exception:
+                pass
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_manager():
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = JobManager()
+        return _manager
@@ -0,0 +1,276 @@
+"""
+Parameterized query templates that bypass the LLM.
+
+Approved SQL can be promoted into a template: every literal that also appears
+in the question becomes a bind parameter (:p0, :p1, ...) and the question
+becomes a pattern with a slot in its place. New questions are matched against
+the templates of the same schema fingerprint and dialect with these
+patterns, locally and in well under a millisecond, and a match skips
+generate_sql entirely. A text slot only binds a quoted or capitalized value,
+so "the largest department" is not read as a department named "largest".
+
+The template SQL is run with bind parameters, so its text is identical for
+every slot value and SQLite reuses the compiled statement from sqlite3's
+statement cache. psycopg2 and pymysql interpolate the parameters on the
+client, so PostgreSQL and MySQL still plan every run; there the saving is the
+skipped LLM call only. Hit rate and latency saved (the running average of
+real generations minus the match time) are tracked in summary().
+"""
+import json
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import sqlparse
+from sqlparse import tokens as T
+
+DEFAULT_PATH = ".sqlgenius_templates.db"
+
+_QUOTES = "\"'“”‘’"
+_QUOTE = f"[{_QUOTES}]?"
+_lock = threading.Lock()
+_stores = {}
+
+
+# ----------- Extraction -----------
+def _literals(sql):
+    """[(token index, value)] for the string and number literals of the first statement."""
+    tokens = list(sqlparse.parse(sql)[0].flatten())
+    found = []
+    for index, token in enumerate(tokens):
+        if token.ttype in T.Literal.String.Single:
+            found.append((index, token.value[1:-1].replace("''", "'")))
+        elif token.ttype in T.Literal.Number.Integer:
+            found.append((index, int(token.value)))
+        elif token.ttype in T.Literal.Number.Float:
+            found.append((index, float(token.value)))
+    return tokens, found
+
+
+def _find(question, value):
+    """(start, end) of a literal's value in the question, or None."""
+    if isinstance(value, str):
+        if not value.strip():
+            return None
+        match = re.search(rf"(?<!\w){re.escape(value)}(?!\w)", question, re.IGNORECASE)
+    else:
+        match = re.search(rf"(?<![\w.]){re.escape(str(value))}(?![\w.])", question)
+    return match.span() if match else None
+
+
+def _looks_like_value(text, start, value):
+    """A text slot only binds a quoted or capitalized span ("Engineering", 'R&D'), not any word."""
+    quoted = start > 0 and text[start - 1] in _QUOTES
+    return quoted or value[:1].isupper() or value[:1].isdigit()
+
+
+def _question_text(question):
+    return re.sub(r"\s+", " ", (question or "").strip()).rstrip(" ?.!;")
+
+
+def build_template(question, sql):
+    """
+    Turn an approved (question, sql) pair into {"pattern", "sql", "slots"}.
+    Raises ValueError when no literal of the SQL appears in the question.
+    """
+    question = _question_text(question)
+    tokens, literals = _literals(sql.strip().rstrip(";"))
+    slots, spans = [], []
+    for value in dict.fromkeys(value for _, value in literals):
+        span = _find(question, value)
+        # The longer value wins when two literals overlap in the question ("New York" vs "York")
+        if span is None or any(s < span[1] and span[0] < e for s, e in spans):
+            continue
+        slots.append({"value": value, "kind": "text" if isinstance(value, str) else type(value).__name__, "span": span})
+        spans.append(span)
+    if not slots:
+        raise ValueError("None of the literals in the SQL appear in the question, so there is nothing to parameterize.")
+    slots.sort(key=lambda slot: slot["span"])
+
+    pattern, position = "", 0
+    for number, slot in enumerate(slots):
+        start, end = slot["span"]
+        pattern += re.escape(question[position:start])
+        if slot["kind"] == "text":
+            pattern += rf"{_QUOTE}(?P<p{number}>.+?){_QUOTE}"
+        elif slot["kind"] == "int":
+            pattern += rf"(?P<p{number}>-?\d+)"
+        else:
+            pattern += rf"(?P<p{number}>-?\d+(?:\.\d+)?)"
+        position = end
+    pattern += re.escape(question[position:])
+    pattern = re.sub(r"(\\ )+", r"\\s+", pattern)
+
+    names = {slot["value"]: f"p{number}" for number, slot in enumerate(slots)}
+    values = dict(literals)
+    parts = []
+    for index, token in enumerate(tokens):
+        if index in values and values[index] in names:
+            parts.append(f":{names[values[index]]}")
+        else:
+            parts.append(token.value)
+    return {
+        "pattern": pattern,
+        "sql": "".join(parts),
+        "slots": [{"name": names[s["value"]], "kind": s["kind"], "example": s["value"]} for s in slots],
+    }
+
+
+def render(template_sql, params):
+    """The template with its parameters inlined as literals, for review and display."""
+    def literal(match):
+        value = params[match.group(1)]
+        return "'" + value.replace("'", "''") + "'" if isinstance(value, str) else str(value)
+
+    return re.sub(r"(?<![:\w]):(p\d+)\b", literal, template_sql)
+
+
+# ----------- Store -----------
+class TemplateStore:
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        self.stats = {"lookups": 0, "hits": 0, "generations": 0, "generation_ms_total": 0.0, "saved_ms": 0.0}
+        self._stats_lock = threading.Lock()
+        self._compiled = {}
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS templates ("
+                " id INTEGER PRIMARY KEY, schema_fingerprint TEXT, dialect TEXT, question TEXT,"
+                " pattern TEXT, sql TEXT, slots TEXT, hits INTEGER DEFAULT 0, created_at REAL,"
+                " UNIQUE(schema_fingerprint, dialect, pattern))"
+            )
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _templates(self, fingerprint, dialect):
+        """Compiled templates for one schema and dialect, loaded once per scope."""
+        scope = (fingerprint, dialect)
+        with self._stats_lock:
+            compiled = self._compiled.get(scope)
+        if compiled is None:
+            with self._connect() as conn:
+                rows = conn.execute(
+                    "SELECT id, question, pattern, sql, slots FROM templates WHERE schema_fingerprint = ? AND dialect = ?",
+                    (fingerprint, dialect),
+                ).fetchall()
+            compiled = []
+            for id_, question, pattern, sql, slots in rows:
+                slots = json.loads(slots)
+                compiled.append({
+                    "id": id_, "regex": re.compile(pattern, re.IGNORECASE), "sql": sql, "slots": slots,
+                    "fixed": len(question) - sum(len(str(slot["example"])) for slot in slots),
+                })
+            # The most specific pattern wins when several match
+            compiled.sort(key=lambda t: -t["fixed"])
+            with self._stats_lock:
+                self._compiled[scope] = compiled
+        return compiled
+
+    def promote(self, question, sql, fingerprint, dialect):
+        template = build_template(question, sql)
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO templates (schema_fingerprint, dialect, question, pattern, sql, slots, created_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (fingerprint, dialect, _question_text(question), template["pattern"], template["sql"],
+                 json.dumps(template["slots"]), time.time()),
+            )
+        with self._stats_lock:
+            self._compiled.pop((fingerprint, dialect), None)
+        return template
+
+    def match(self, question, fingerprint, dialect):
+        """{"id", "sql", "params", "rendered", "match_ms"} for the best matching template, or None."""
+        start = time.perf_counter()
+        text = _question_text(question)
+        found = None
+        for template in self._templates(fingerprint, dialect):
+            match = template["regex"].fullmatch(text)
+            if match is None:
+                continue
+            params = {}
+            for slot in template["slots"]:
+                value = match.group(slot["name"]).strip()
+                # A text slot that swallowed a whole clause is not the same question
+                if slot["kind"] == "text" and len(value.split()) > len(str(slot["example"]).split()) + 2:
+                    params = None
+                    break
+                if slot["kind"] == "text" and not _looks_like_value(text, match.start(slot["name"]), value):
+                    # "largest department" is not a department called "largest": leave it to the LLM
+                    params = None
+                    break
+                params[slot["name"]] = {"int": int, "float": float}.get(slot["kind"], str)(value)
+            if params is not None:
+                found = template, params
+                break
+        match_ms = (time.perf_counter() - start) * 1000
+        with self._stats_lock:
+            self.stats["lookups"] += 1
+            if found is not None:
+                self.stats["hits"] += 1
+                generations = self.stats["generations"]
+                if generations:
+                    self.stats["saved_ms"] += max(self.stats["generation_ms_total"] / generations - match_ms, 0.0)
+        if found is None:
+            return None
+        template, params = found
+        with self._connect() as conn:
+            conn.execute("UPDATE templates SET hits = hits + 1 WHERE id = ?", (template["id"],))
+        return {
+            "id": template["id"],
+            "sql": template["sql"],
+            "params": params,
+            "rendered": render(template["sql"], params),
+            "match_ms": round(match_ms, 3),
+        }
+
+    def observe_generation(self, elapsed_ms):
+        """Record how long a real LLM generation took; a template hit is credited with the average."""
+        with self._stats_lock:
+            self.stats["generations"] += 1
+            self.stats["generation_ms_total"] += elapsed_ms
+
+    def entries(self, fingerprint=None):
+        query = "SELECT id, question, sql, hits FROM templates"
+        args = ()
+        if fingerprint is not None:
+            query += " WHERE schema_fingerprint = ?"
+            args = (fingerprint,)
+        with self._connect() as conn:
+            return [dict(zip(("id", "question", "sql", "hits"), row)) for row in conn.execute(query + " ORDER BY hits DESC", args)]
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM templates")
+        with self._stats_lock:
+            self._compiled.clear()
+
+    def summary(self):
+        with self._connect() as conn:
+            templates = conn.execute("SELECT COUNT(*) FROM templates").fetchone()[0]
+        with self._stats_lock:
+            stats = dict(self.stats)
+        generations = stats.pop("generations")
+        stats["templates"] = templates
+        stats["hit_rate"] = round(stats["hits"] / stats["lookups"], 3) if stats["lookups"] else 0.0
+        stats["avg_generation_ms"] = round(stats.pop("generation_ms_total") / generations, 1) if generations else 0.0
+        stats["saved_ms"] = round(stats["saved_ms"], 1)
+        return stats
+
+
+def get_store(path=DEFAULT_PATH):
+    with _lock:
+        store = _stores.get(path)
+        if store is None:
+            store = _stores[path] = TemplateStore(path)
+        return store
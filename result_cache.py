@@ -0,0 +1,192 @@
+"""
+Data-version-aware query result cache.
+
+Completed results of read-only queries are kept in memory as Arrow tables,
+keyed on the normalized SQL text and the engine they ran on, and evicted least
+recently used once the total size passes a byte budget. Before a cached result
+is served, a cheap probe checks that the data behind it has not changed:
+
+- SQLite: size and mtime of the database file and its WAL
+- PostgreSQL: pg_stat_user_tables insert/update/delete counters of the referenced tables
+- MySQL: information_schema.TABLES update time and row estimate of the referenced tables
+
+On PostgreSQL and MySQL a result is only cached when every referenced name is
+a base table the probe can see; a view, another schema's table or a name in a
+different case would otherwise leave the token unchanged forever.
+"""
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import sqlparse
+from sqlalchemy import bindparam, text
+
+import cost_guard
+import engine_registry
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+_VOLATILE = re.compile(
+    r"\b(RANDOM|RAND|NOW|UUID|GEN_RANDOM_UUID|CURRENT_DATE|CURRENT_TIME|CURRENT_TIMESTAMP|LOCALTIME|LOCALTIMESTAMP|SYSDATE)\b"
+    # SQLite's date functions read the clock when given 'now': date('now'), strftime('%Y', 'now'), ...
+    r"|'now'",
+    re.IGNORECASE,
+)
+
+
+def normalize_sql(query):
+    formatted = sqlparse.format(query, keyword_case="upper", strip_comments=True)
+    return re.sub(r"\s+", " ", formatted).strip().rstrip(";").strip()
+
+
+def is_cacheable(query):
+    return engine_registry.is_read_only(query) and not _VOLATILE.search(query)
+
+
+# ----------- Data Version Probes -----------
+def _sqlite_version(engine, tables):
+    path = engine.url.database
+    if not path or path == ":memory:":
+        return None
+    version = []
+    for suffix in ("", "-wal"):
+        try:
+            stat = os.stat(path + suffix)
+            version.append((suffix, stat.st_size, stat.st_mtime_ns))
+        except FileNotFoundError:
+            version.append((suffix, None, None))
+    return tuple(version)
+
+
+def _postgres_version(engine, tables):
+    stmt = text(
+        "SELECT relname, n_tup_ins, n_tup_upd, n_tup_del, n_live_tup FROM pg_stat_user_tables "
+        "WHERE schemaname = current_schema() AND relname IN :tables ORDER BY relname"
+    ).bindparams(bindparam("tables", expanding=True))
+    with engine.connect() as conn:
+        return _complete(tables, tuple(tuple(row) for row in conn.execute(stmt, {"tables": sorted(tables) or [""]})))
+
+
+def _mysql_version(engine, tables):
+    stmt = text(
+        "SELECT TABLE_NAME, UPDATE_TIME, TABLE_ROWS FROM information_schema.TABLES "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME IN :tables ORDER BY TABLE_NAME"
+    ).bindparams(bindparam("tables", expanding=True))
+    with engine.connect() as conn:
+        engine_registry.fresh_mysql_stats(conn)
+        return _complete(tables, tuple(tuple(str(v) for v in row) for row in conn.execute(stmt, {"tables": sorted(tables) or [""]})))
+
+
+def _complete(tables, rows):
+    """The probe rows, or None unless there is exactly one per referenced table."""
+    if not tables or sorted(row[0] for row in rows) != sorted(tables):
+        return None
+    return rows
+
+
+_PROBES = {"sqlite": _sqlite_version, "postgresql": _postgres_version, "mysql": _mysql_version}
+
+
+def data_version(engine, query):
+    """Cheap token that changes when data in the tables the query reads changes (None if unknown)."""
+    probe = _PROBES.get(engine.dialect.name)
+    if probe is None:
+        return None
+    tables = set(cost_guard.table_aliases(query).values())
+    return probe(engine, tables)
+
+
+# ----------- Cache -----------
+class ResultCache:
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.stats = {"hits": 0, "misses": 0, "stale": 0, "saved_s": 0.0}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(engine, query, params=None):
+        # Template queries share their text, so the bound values are part of the key
+        return (engine.url.render_as_string(hide_password=True), normalize_sql(query), tuple(sorted((params or {}).items())))
+
+    def get(self, engine, query, params=None):
+        """Return (table, original_seconds) if a fresh cached result exists, else None."""
+        if not is_cacheable(query):
+            return None
+        key = self.key(engine, query, params)
+        with self._lock:
+            entry = self.entries.get(key)
+        if entry is None:
+            self._count("misses")
+            return None
+        try:
+            current = data_version(engine, query)
+        except Exception:
+            current = None
+        if current is None or current != entry["version"]:
+            with self._lock:
+                if self.entries.get(key) is entry:
+                    del self.entries[key]
+                    self.total_bytes -= entry["bytes"]
+                self.stats["stale"] += 1
+                self.stats["misses"] += 1
+            return None
+        with self._lock:
+            self.entries.move_to_end(key)
+            self.stats["hits"] += 1
+            self.stats["saved_s"] += entry["seconds"]
+        return entry["table"], entry["seconds"]
+
+    def put(self, engine, query, table, seconds, version, params=None):
+        if version is None or not is_cacheable(query):
+            return False
+        size = table.nbytes
+        if size > self.max_bytes:
+            return False
+        key = self.key(engine, query, params)
+        with self._lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.total_bytes -= previous["bytes"]
+            self.entries[key] = {"table": table, "bytes": size, "seconds": seconds, "version": version, "stored_at": time.time()}
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes and self.entries:
+                _, evicted = self.entries.popitem(last=False)
+                self.total_bytes -= evicted["bytes"]
+        return True
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+    def summary(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats["entries"] = len(self.entries)
+            stats["cached_mb"] = round(self.total_bytes / (1024 * 1024), 2)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else 0.0
+        stats["saved_s"] = round(stats["saved_s"], 3)
+        return stats
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache(max_bytes=None):
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResultCache(max_bytes or DEFAULT_MAX_BYTES)
+        elif max_bytes:
+            _cache.max_bytes = max_bytes
+        return _cache
@@ -0,0 +1,265 @@
+"""
+Streaming result export to CSV, Parquet and Arrow IPC.
+
+The query runs again on a server-side cursor (``stream_results`` /
+``yield_per``) and every batch of rows goes straight from the DB-API cursor to
+an Arrow record batch to the file writer, so memory stays bounded by the batch
+size (plus one Parquet row group) however large the result is:
+
+- CSV: pyarrow's CSV writer, one batch at a time
+- Parquet: one row group per ``row_group_rows`` rows, compressed with zstd
+- Arrow IPC: the random-access file format (.arrow), one record batch at a time
+
+A result that is already complete in memory (a fully fetched pager or a cached
+result) is written from its pages without touching the database.
+
+Headless, e.g. from cron:
+
+    python result_export.py "SELECT * FROM orders" --out orders.parquet --db-type SQLite --sqlite-path sample.db
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.ipc as ipc
+import pyarrow.parquet as pq
+from sqlalchemy import text
+
+import engine_registry
+import result_pager
+import sqlgenius_core as core
+import telemetry
+
+DEFAULT_BATCH_ROWS = 10_000
+DEFAULT_ROW_GROUP_ROWS = 100_000
+DEFAULT_EXPORT_DIR = ".sqlgenius_exports"
+# Streamlit holds a download in memory, so bigger exports are left on disk
+DOWNLOAD_MAX_BYTES = 200 * 1024 * 1024
+FORMATS = {"csv": "text/csv", "parquet": "application/vnd.apache.parquet", "arrow": "application/vnd.apache.arrow.file"}
+
+
+def detect_format(path):
+    extension = os.path.splitext(path)[1].lower().lstrip(".")
+    fmt = {"ipc": "arrow", "feather": "arrow", "pq": "parquet"}.get(extension, extension)
+    if fmt not in FORMATS:
+        raise ValueError(f"Cannot tell the export format from {path!r}; use .csv, .parquet or .arrow")
+    return fmt
+
+
+# ----------- Batches -----------
+def query_batches(engine, query, params=None, batch_rows=DEFAULT_BATCH_ROWS, max_rows=None):
+    """Record batches of ``query``'s rows, fetched from a server-side cursor one batch at a time."""
+    engine = engine_registry.route_engine(engine, query)
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=batch_rows).execute(text(query), params or {})
+        if not result.returns_rows:
+            raise ValueError("The query does not return rows, so there is nothing to export.")
+        columns = list(result.keys())
+        schema = None
+        fetched = 0
+        while max_rows is None or fetched < max_rows:
+            rows = result.fetchmany(batch_rows if max_rows is None else min(batch_rows, max_rows - fetched))
+            if not rows:
+                break
+            batch = result_pager.rows_to_batch(columns, rows, schema)
+            schema = batch.schema
+            fetched += batch.num_rows
+            yield batch
+        if schema is None:
+            yield _empty_batch(columns)
+
+
+def _empty_batch(columns):
+    return pa.RecordBatch.from_arrays([pa.array([], type=pa.string()) for _ in columns], names=list(columns))
+
+
+def _file_schema(schema):
+    # Columns that were all NULL so far are written as strings, which any later value can be cast to
+    return pa.schema([field.with_type(pa.string()) if pa.types.is_null(field.type) else field for field in schema])
+
+
+def _conform(batch, schema):
+    if batch.schema.equals(schema):
+        return batch
+    try:
+        return batch.cast(schema)
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError) as e:
+        changed = [f"{old.name} ({old.type} -> {new.type})" for old, new in zip(schema, batch.schema) if old.type != new.type]
+        raise ValueError(f"Column type changed mid-export: {', '.join(changed)}. Export as CSV instead.") from e
+
+
+# ----------- Writers -----------
+class _CSVWriter:
+    def __init__(self, sink, schema, row_group_rows):
+        self.sink = sink
+        self.schema = schema
+        self.writer = pacsv.CSVWriter(sink, schema)
+
+    def write(self, batch):
+        try:
+            batch = _conform(batch, self.schema)
+        except ValueError:
+            # CSV has no column types: carry on with the new ones, without a second header
+            self.writer.close()
+            self.schema = batch.schema
+            self.writer = pacsv.CSVWriter(self.sink, self.schema, write_options=pacsv.WriteOptions(include_header=False))
+        self.writer.write_batch(batch)
+
+    def close(self):
+        self.writer.close()
+
+
+class _ParquetWriter:
+    def __init__(self, sink, schema, row_group_rows):
+        self.schema = schema
+        self.row_group_rows = row_group_rows
+        self.writer = pq.ParquetWriter(sink, schema, compression="zstd")
+        self.pending = []
+        self.pending_rows = 0
+
+    def write(self, batch):
+        self.pending.append(_conform(batch, self.schema))
+        self.pending_rows += batch.num_rows
+        if self.pending_rows >= self.row_group_rows:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.writer.write_table(pa.Table.from_batches(self.pending), row_group_size=self.row_group_rows)
+            self.pending, self.pending_rows = [], 0
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+class _ArrowWriter:
+    def __init__(self, sink, schema, row_group_rows):
+        self.schema = schema
+        self.writer = ipc.new_file(sink, schema)
+
+    def write(self, batch):
+        self.writer.write_batch(_conform(batch, self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+_WRITERS = {"csv": _CSVWriter, "parquet": _ParquetWriter, "arrow": _ArrowWriter}
+
+
+def write_batches(batches, fmt, sink, row_group_rows=DEFAULT_ROW_GROUP_ROWS, on_progress=None, progress_every=1.0):
+    """
+    Write record batches to ``sink`` (a path or a binary file object) as ``fmt``.
+    Returns {"format", "rows", "batches", "bytes", "elapsed_s", "rows_per_s", "mb_per_s"}.
+    """
+    if fmt not in _WRITERS:
+        raise ValueError(f"Unsupported export format: {fmt}")
+    stats = {"format": fmt, "rows": 0, "batches": 0, "bytes": 0, "elapsed_s": 0.0, "rows_per_s": 0.0, "mb_per_s": 0.0}
+    start = time.perf_counter()
+    last_report = start
+    out = pa.OSFile(sink, "wb") if isinstance(sink, (str, os.PathLike)) else pa.PythonFile(sink, mode="w")
+
+    def report(force=False):
+        nonlocal last_report
+        now = time.perf_counter()
+        stats["bytes"] = out.tell()
+        stats["elapsed_s"] = round(now - start, 3)
+        stats["rows_per_s"] = round(stats["rows"] / (now - start), 1) if now > start else 0.0
+        stats["mb_per_s"] = round(stats["bytes"] / (1024 * 1024) / (now - start), 2) if now > start else 0.0
+        if on_progress is not None and (force or now - last_report >= progress_every):
+            last_report = now
+            on_progress(dict(stats))
+
+    with telemetry.span("export", format=fmt) as span:
+        writer = None
+        try:
+            for batch in batches:
+                if writer is None:
+                    writer = _WRITERS[fmt](out, _file_schema(batch.schema), row_group_rows)
+                if batch.num_rows == 0:
+                    continue
+                writer.write(batch)
+                stats["rows"] += batch.num_rows
+                stats["batches"] += 1
+                report()
+            if writer is not None:
+                writer.close()
+            report(force=True)
+        finally:
+            out.close()
+            # Releases the server-side cursor when the export stops early
+            close = getattr(batches, "close", None)
+            if close is not None:
+                close()
+        span.update(rows=stats["rows"], bytes=stats["bytes"])
+    return stats
+
+
+def export_query(engine, query, fmt, sink, params=None, batch_rows=DEFAULT_BATCH_ROWS, max_rows=None, **options):
+    """Re-run ``query`` on a server-side cursor and stream its rows into ``sink``."""
+    return write_batches(query_batches(engine, query, params, batch_rows, max_rows), fmt, sink, **options)
+
+
+def export_pager(pager, fmt, sink, **options):
+    """Write a result that is already complete in memory (see ResultPager.exhausted)."""
+    return write_batches(iter(pager.pages or [_empty_batch(pager.columns)]), fmt, sink, **options)
+
+
+# ----------- CLI -----------
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Stream a query result into a CSV, Parquet or Arrow IPC file.")
+    parser.add_argument("query", help="SQL to run, or @file.sql to read it from a file")
+    parser.add_argument("--out", required=True, help="Output file; the format follows the extension unless --format is given")
+    parser.add_argument("--format", choices=sorted(FORMATS))
+    parser.add_argument("--batch-rows", type=int, default=DEFAULT_BATCH_ROWS, help="Rows fetched and written at a time")
+    parser.add_argument("--row-group-rows", type=int, default=DEFAULT_ROW_GROUP_ROWS, help="Rows per Parquet row group")
+    parser.add_argument("--max-rows", type=int, help="Stop after this many rows")
+    parser.add_argument("--db-type", choices=["SQLite", "PostgreSQL", "MySQL"], required=True)
+    parser.add_argument("--sqlite-path", default="sample.db")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port")
+    parser.add_argument("--user")
+    parser.add_argument("--password", help="Defaults to $DB_PASSWORD")
+    parser.add_argument("--dbname")
+    parser.add_argument("--replica-url")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    query = args.query
+    if query.startswith("@"):
+        with open(query[1:], encoding="utf-8") as f:
+            query = f.read()
+    try:
+        config = core.engine_config(
+            args.db_type, args.sqlite_path, args.host, args.port, args.user,
+            args.password or os.environ.get("DB_PASSWORD", ""), args.dbname,
+        )
+    except FileNotFoundError as e:
+        sys.exit(str(e))
+    engine = core.get_engine(args.db_type, config, {"pool_size": 1, "max_overflow": 0}, args.replica_url)
+    # Written next to the target and renamed at the end, so a scheduled reader never sees half a file
+    partial = args.out + ".partial"
+    try:
+        stats = export_query(
+            engine, query, args.format or detect_format(args.out), partial,
+            batch_rows=args.batch_rows, max_rows=args.max_rows, row_group_rows=args.row_group_rows,
+            on_progress=lambda p: print(f"{p['rows']:,} rows, {p['rows_per_s']:,.0f} rows/s", file=sys.stderr),
+        )
+    except Exception:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    os.replace(partial, args.out)
+    print(json.dumps(dict(stats, path=args.out)), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
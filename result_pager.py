@@ -0,0 +1,166 @@
+"""
+Chunked, bounded query results.
+
+Instead of materializing a whole result with pd.read_sql_query, a ResultPager
+keeps a server-side cursor open (``stream_results`` / ``yield_per``) and pulls
+one page at a time into an Arrow record batch. Fetching stops at a row cap or a
+byte cap, so a runaway ``SELECT *`` cannot take the process down, and the pages
+can be handed to st.dataframe as Arrow without another copy.
+
+A pager that is not exhausted holds a pooled connection (and an open
+transaction or read snapshot) until it is; the job manager releases pagers
+nobody has paged through for a while (see JobManager.collect).
+"""
+import threading
+import time
+
+import pyarrow as pa
+from sqlalchemy import text
+
+import telemetry
+
+DEFAULT_PAGE_SIZE = 1000
+DEFAULT_MAX_ROWS = 100_000
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+def rows_to_batch(columns, rows, schema=None):
+    """Column-wise conversion of DB-API rows to a RecordBatch, keeping earlier page types when possible."""
+    arrays = []
+    for i, name in enumerate(columns):
+        values = [row[i] for row in rows]
+        previous = schema.field(i).type if schema is not None else None
+        try:
+            if previous is not None and not pa.types.is_null(previous):
+                arrays.append(pa.array(values, type=previous))
+            else:
+                arrays.append(pa.array(values))
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError, OverflowError):
+            # Mixed-type columns (common in SQLite) fall back to strings
+            arrays.append(pa.array([None if v is None else str(v) for v in values], type=pa.string()))
+    return pa.RecordBatch.from_arrays(arrays, names=list(columns))
+
+
+class ResultPager:
+    def __init__(self, engine, query, page_size=DEFAULT_PAGE_SIZE, max_rows=DEFAULT_MAX_ROWS, max_bytes=DEFAULT_MAX_BYTES,
+                 on_connect=None, params=None):
+        self.engine = engine
+        self.query = query
+        self.params = params
+        self.page_size = page_size
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.pages = []
+        self.columns = []
+        self.rows_fetched = 0
+        self.bytes_fetched = 0
+        self.rowcount = None
+        self.exhausted = False
+        self.truncated = False
+        self.released = False
+        self.last_used = time.monotonic()
+        self.on_connect = on_connect
+        self._conn = None
+        self._result = None
+        self._lock = threading.Lock()
+
+    def open(self):
+        self._conn = self.engine.connect()
+        try:
+            if self.on_connect is not None:
+                # Lets callers set per-connection options (timeouts, backend ids) before the query runs
+                self.on_connect(self._conn)
+            result = self._conn.execution_options(stream_results=True, yield_per=self.page_size).execute(text(self.query), self.params or {})
+        except Exception:
+            self.close()
+            raise
+        if not result.returns_rows:
+            self._conn.commit()
+            self.rowcount = result.rowcount
+            self.exhausted = True
+            self.close()
+            return self
+        self._result = result
+        self.columns = list(result.keys())
+        self._fetch_page()
+        return self
+
+    @classmethod
+    def from_table(cls, table, page_size=DEFAULT_PAGE_SIZE):
+        """A fully-fetched pager over an in-memory Arrow table, e.g. a cached result."""
+        pager = cls(None, None, page_size=page_size)
+        pager.columns = list(table.column_names)
+        pager.pages = table.to_batches(max_chunksize=page_size)
+        pager.rows_fetched = table.num_rows
+        pager.bytes_fetched = table.nbytes
+        pager.exhausted = True
+        return pager
+
+    def to_table(self):
+        if not self.pages:
+            return pa.table({name: pa.array([], type=pa.null()) for name in self.columns})
+        return pa.Table.from_batches(self.pages)
+
+    @property
+    def returns_rows(self):
+        return self.rowcount is None
+
+    def _fetch_page(self):
+        if self.exhausted:
+            return None
+        limit = min(self.page_size, self.max_rows - self.rows_fetched)
+        with telemetry.span("fetch_page") as span:
+            rows = self._result.fetchmany(limit)
+            span["rows"] = len(rows)
+        batch = None
+        if rows:
+            schema = self.pages[-1].schema if self.pages else None
+            with telemetry.span("arrow_convert", rows=len(rows)) as span:
+                batch = rows_to_batch(self.columns, rows, schema)
+                span["bytes"] = batch.nbytes
+            self.pages.append(batch)
+            self.rows_fetched += batch.num_rows
+            self.bytes_fetched += batch.nbytes
+        if len(rows) < limit:
+            self.exhausted = True
+        elif self.rows_fetched >= self.max_rows or self.bytes_fetched >= self.max_bytes:
+            # Stopped at a cap: peek one row to tell the user whether anything was cut off
+            self.truncated = bool(self._result.fetchmany(1))
+            self.exhausted = True
+        if self.exhausted:
+            self.close()
+        return batch
+
+    def page(self, index):
+        """Return page ``index`` (0-based), fetching forward as needed, or None past the end."""
+        with self._lock:
+            self.last_used = time.monotonic()
+            while index >= len(self.pages) and not self.exhausted:
+                self._fetch_page()
+            return self.pages[index] if index < len(self.pages) else None
+
+    def page_table(self, index):
+        batch = self.page(index)
+        if batch is None:
+            return pa.table({name: [] for name in self.columns})
+        return pa.Table.from_batches([batch])
+
+    def has_page(self, index):
+        return index < len(self.pages) or not self.exhausted
+
+    def release(self):
+        """Stop fetching and give the connection back; the rows fetched so far stay available."""
+        with self._lock:
+            if self.exhausted:
+                return
+            # Whatever was not fetched is cut off, just as at a row/byte cap
+            self.truncated = self.released = self.exhausted = True
+            self.close()
+
+    def close(self):
+        if self._result is not None:
+            self._result.close()
+            self._result = None
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
@@ -0,0 +1,281 @@
+"""
+Cached schema catalog.
+
+Tables, columns, types, primary keys and foreign keys are loaded with a couple
+of bulk catalog queries per dialect instead of one inspector round trip per
+table. Catalogs are cached per engine and only reloaded, table by table, when a
+cheap DDL fingerprint changes:
+
+- SQLite: PRAGMA schema_version, then sqlite_master to find the changed tables
+- PostgreSQL: per-table checksum over pg_class / pg_attribute / pg_constraint
+- MySQL: information_schema.TABLES create/update times
+"""
+import hashlib
+import json
+import threading
+
+from sqlalchemy import bindparam, inspect, text
+
+import engine_registry
+import telemetry
+
+_lock = threading.Lock()
+_catalogs = {}
+
+
+# ----------- Catalog -----------
+class SchemaCatalog:
+    def __init__(self, dialect):
+        self.dialect = dialect
+        self.tables = {}
+        self.table_tokens = {}
+        self.version = None
+        self.loaded = False
+        self.lock = threading.Lock()
+        self._fingerprint = None
+
+    @property
+    def fingerprint(self):
+        """Digest of the catalog contents, stable across processes."""
+        if self._fingerprint is None:
+            payload = json.dumps(self.tables, sort_keys=True, default=str)
+            self._fingerprint = hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+        return self._fingerprint
+
+    def table_names(self):
+        return sorted(self.tables)
+
+    def to_prompt(self, with_types=False, tables=None):
+        schema_lines = []
+        for table_name in tables if tables is not None else self.table_names():
+            columns = self.tables[table_name]["columns"]
+            if with_types:
+                col_defs = ", ".join([f"{col['name']} {col['type']}" for col in columns])
+            else:
+                col_defs = ", ".join([col["name"] for col in columns])
+            schema_lines.append(f"{table_name}({col_defs})")
+        return "\n".join(schema_lines)
+
+
+def _new_table(name, comment=None):
+    return {"name": name, "columns": [], "primary_key": [], "foreign_keys": [], "comment": comment or ""}
+
+
+def _with_filter(sql, column, names):
+    if names is None:
+        return text(sql.format(filter="")), {}
+    stmt = text(sql.format(filter=f"AND {column} IN :names")).bindparams(bindparam("names", expanding=True))
+    return stmt, {"names": list(names)}
+
+
+def _add_column(table, name, type_, nullable, primary_key, comment=None):
+    table["columns"].append(
+        {"name": name, "type": str(type_).upper(), "nullable": bool(nullable), "comment": comment or ""}
+    )
+    if primary_key:
+        table["primary_key"].append(name)
+
+
+# ----------- Dialect Loaders -----------
+class _SQLiteLoader:
+    _tables_sql = "SELECT name, sql FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"
+    _columns_sql = (
+        "SELECT m.name, p.name, p.type, p.\"notnull\", p.pk FROM sqlite_master m "
+        "JOIN pragma_table_info(m.name) p "
+        "WHERE m.type = 'table' AND m.name NOT LIKE 'sqlite_%' {filter} ORDER BY m.name, p.cid"
+    )
+    _fks_sql = (
+        "SELECT m.name, f.\"from\", f.\"table\", f.\"to\" FROM sqlite_master m "
+        "JOIN pragma_foreign_key_list(m.name) f "
+        "WHERE m.type = 'table' AND m.name NOT LIKE 'sqlite_%' {filter} ORDER BY m.name, f.id, f.seq"
+    )
+
+    def probe(self, conn):
+        return conn.exec_driver_sql("PRAGMA schema_version").scalar()
+
+    def table_tokens(self, conn, version):
+        return {name: sql for name, sql in conn.execute(text(self._tables_sql))}
+
+    def load_tables(self, conn, names):
+        tables = {}
+        stmt, params = _with_filter(self._columns_sql, "m.name", names)
+        for table_name, name, type_, notnull, pk in conn.execute(stmt, params):
+            table = tables.setdefault(table_name, _new_table(table_name))
+            _add_column(table, name, type_, not notnull, pk)
+        stmt, params = _with_filter(self._fks_sql, "m.name", names)
+        for table_name, column, ref_table, ref_column in conn.execute(stmt, params):
+            if table_name in tables:
+                tables[table_name]["foreign_keys"].append(
+                    {"column": column, "ref_table": ref_table, "ref_column": ref_column}
+                )
+        return tables
+
+
+class _PostgresLoader:
+    _tokens_sql = (
+        "SELECT c.relname, md5("
+        "  c.xmin::text || ':' || coalesce(obj_description(c.oid, 'pg_class'), '') || ':' ||"
+        "  coalesce((SELECT string_agg(a.attname || ':' || a.atttypid || ':' || a.attnotnull, ',' ORDER BY a.attnum)"
+        "            FROM pg_attribute a WHERE a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped), '') || ':' ||"
+        "  coalesce((SELECT string_agg(co.oid::text, ',' ORDER BY co.oid)"
+        "            FROM pg_constraint co WHERE co.conrelid = c.oid), '')"
+        ") FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace "
+        "WHERE n.nspname = current_schema() AND c.relkind IN ('r', 'p', 'v', 'm')"
+    )
+    _columns_sql = (
+        "SELECT c.table_name, c.column_name, c.data_type, c.is_nullable = 'YES', "
+        "  pk.column_name IS NOT NULL, "
+        "  col_description(format('%I.%I', c.table_schema, c.table_name)::regclass, c.ordinal_position), "
+        "  obj_description(format('%I.%I', c.table_schema, c.table_name)::regclass, 'pg_class') "
+        "FROM information_schema.columns c "
+        "LEFT JOIN ("
+        "  SELECT kcu.table_name, kcu.column_name FROM information_schema.table_constraints tc "
+        "  JOIN information_schema.key_column_usage kcu "
+        "    ON kcu.constraint_name = tc.constraint_name AND kcu.constraint_schema = tc.constraint_schema "
+        "  WHERE tc.constraint_type = 'PRIMARY KEY' AND tc.table_schema = current_schema()"
+        ") pk ON pk.table_name = c.table_name AND pk.column_name = c.column_name "
+        "WHERE c.table_schema = current_schema() {filter} ORDER BY c.table_name, c.ordinal_position"
+    )
+    _fks_sql = (
+        "SELECT kcu.table_name, kcu.column_name, ccu.table_name, ccu.column_name "
+        "FROM information_schema.table_constraints tc "
+        "JOIN information_schema.key_column_usage kcu "
+        "  ON kcu.constraint_name = tc.constraint_name AND kcu.constraint_schema = tc.constraint_schema "
+        "JOIN information_schema.constraint_column_usage ccu "
+        "  ON ccu.constraint_name = tc.constraint_name AND ccu.constraint_schema = tc.constraint_schema "
+        "WHERE tc.constraint_type = 'FOREIGN KEY' AND tc.table_schema = current_schema() {filter}"
+    )
+
+    def probe(self, conn):
+        return {name: token for name, token in conn.execute(text(self._tokens_sql))}
+
+    def table_tokens(self, conn, version):
+        return version
+
+    def load_tables(self, conn, names):
+        tables = {}
+        stmt, params = _with_filter(self._columns_sql, "c.table_name", names)
+        for table_name, name, type_, nullable, pk, col_comment, table_comment in conn.execute(stmt, params):
+            table = tables.setdefault(table_name, _new_table(table_name, table_comment))
+            _add_column(table, name, type_, nullable, pk, col_comment)
+        stmt, params = _with_filter(self._fks_sql, "kcu.table_name", names)
+        for table_name, column, ref_table, ref_column in conn.execute(stmt, params):
+            if table_name in tables:
+                tables[table_name]["foreign_keys"].append(
+                    {"column": column, "ref_table": ref_table, "ref_column": ref_column}
+                )
+        return tables
+
+
+class _MySQLLoader:
+    _tokens_sql = (
+        "SELECT TABLE_NAME, CONCAT_WS('|', CREATE_TIME, UPDATE_TIME, TABLE_COMMENT) "
+        "FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE()"
+    )
+    _columns_sql = (
+        "SELECT c.TABLE_NAME, c.COLUMN_NAME, c.COLUMN_TYPE, c.IS_NULLABLE = 'YES', c.COLUMN_KEY = 'PRI', "
+        "  c.COLUMN_COMMENT, t.TABLE_COMMENT "
+        "FROM information_schema.COLUMNS c JOIN information_schema.TABLES t "
+        "  ON t.TABLE_SCHEMA = c.TABLE_SCHEMA AND t.TABLE_NAME = c.TABLE_NAME "
+        "WHERE c.TABLE_SCHEMA = DATABASE() {filter} ORDER BY c.TABLE_NAME, c.ORDINAL_POSITION"
+    )
+    _fks_sql = (
+        "SELECT TABLE_NAME, COLUMN_NAME, REFERENCED_TABLE_NAME, REFERENCED_COLUMN_NAME "
+        "FROM information_schema.KEY_COLUMN_USAGE "
+        "WHERE TABLE_SCHEMA = DATABASE() AND REFERENCED_TABLE_NAME IS NOT NULL {filter}"
+    )
+
+    def probe(self, conn):
+        # Otherwise UPDATE_TIME may be up to information_schema_stats_expiry old
+        engine_registry.fresh_mysql_stats(conn)
+        return {name: token for name, token in conn.execute(text(self._tokens_sql))}
+
+    def table_tokens(self, conn, version):
+        return version
+
+    def load_tables(self, conn, names):
+        tables = {}
+        stmt, params = _with_filter(self._columns_sql, "c.TABLE_NAME", names)
+        for table_name, name, type_, nullable, pk, col_comment, table_comment in conn.execute(stmt, params):
+            table = tables.setdefault(table_name, _new_table(table_name, table_comment))
+            _add_column(table, name, type_, nullable, pk, col_comment)
+        stmt, params = _with_filter(self._fks_sql, "TABLE_NAME", names)
+        for table_name, column, ref_table, ref_column in conn.execute(stmt, params):
+            if table_name in tables:
+                tables[table_name]["foreign_keys"].append(
+                    {"column": column, "ref_table": ref_table, "ref_column": ref_column}
+                )
+        return tables
+
+
+class _InspectorLoader:
+    """Fallback for other dialects, using SQLAlchemy's multi-table reflection."""
+
+    def probe(self, conn):
+        return tuple(sorted(inspect(conn).get_table_names()))
+
+    def table_tokens(self, conn, version):
+        return {name: name for name in version}
+
+    def load_tables(self, conn, names):
+        inspector = inspect(conn)
+        filter_names = list(names) if names is not None else None
+        columns = inspector.get_multi_columns(filter_names=filter_names)
+        pks = inspector.get_multi_pk_constraint(filter_names=filter_names)
+        fks = inspector.get_multi_foreign_keys(filter_names=filter_names)
+        tables = {}
+        for (_, table_name), cols in columns.items():
+            table = tables.setdefault(table_name, _new_table(table_name))
+            pk_cols = pks.get((None, table_name), {}).get("constrained_columns", [])
+            for col in cols:
+                _add_column(table, col["name"], col["type"], col.get("nullable", True), col["name"] in pk_cols, col.get("comment"))
+            for fk in fks.get((None, table_name), []):
+                for column, ref_column in zip(fk["constrained_columns"], fk["referred_columns"]):
+                    table["foreign_keys"].append(
+                        {"column": column, "ref_table": fk["referred_table"], "ref_column": ref_column}
+                    )
+        return tables
+
+
+_LOADERS = {"sqlite": _SQLiteLoader, "postgresql": _PostgresLoader, "mysql": _MySQLLoader}
+
+
+# ----------- Cache -----------
+def _refresh(catalog, conn, loader):
+    version = loader.probe(conn)
+    if catalog.loaded and version == catalog.version:
+        return []
+    tokens = loader.table_tokens(conn, version)
+    if not catalog.loaded:
+        changed = None
+    else:
+        changed = [name for name, token in tokens.items() if catalog.table_tokens.get(name) != token]
+    tables = loader.load_tables(conn, changed) if changed is None or changed else {}
+    for name in set(catalog.tables) - set(tokens):
+        del catalog.tables[name]
+    catalog.tables.update(tables)
+    catalog.table_tokens = tokens
+    catalog._fingerprint = None
+    catalog.version = version
+    catalog.loaded = True
+    return list(tables)
+
+
+def get_catalog(engine):
+    """Return the cached catalog for this engine, reloading only tables whose DDL changed."""
+    with _lock:
+        catalog = _catalogs.get(engine)
+        if catalog is None:
+            catalog = _catalogs[engine] = SchemaCatalog(engine.dialect.name)
+    loader = _LOADERS.get(engine.dialect.name, _InspectorLoader)()
+    with telemetry.span("schema_load") as span:
+        with catalog.lock:
+            with engine.connect() as conn:
+                _refresh(catalog, conn, loader)
+        span["tables"] = len(catalog.tables)
+    return catalog
+
+
+def invalidate(engine):
+    with _lock:
+        _catalogs.pop(engine, None)
@@ -0,0 +1,176 @@
+"""
+Relevance-pruned schema context.
+
+Large schemas blow up the prompt sent to the LLM, so before building it we rank
+tables against the question with a small BM25 index over table names, column
+names and comments, pull in the tables on the foreign-key join paths between
+the hits, and keep adding tables only while the estimated token budget allows.
+"""
+import math
+import re
+import threading
+from collections import Counter, deque
+
+import telemetry
+
+DEFAULT_TOP_K = 8
+DEFAULT_TOKEN_BUDGET = 1500
+
+_STOPWORDS = {
+    "a", "all", "an", "and", "are", "by", "each", "for", "from", "give", "how", "in", "is", "it",
+    "list", "me", "many", "of", "on", "or", "show", "the", "their", "them", "to", "what", "which",
+    "who", "with", "whose", "get", "find", "display", "along", "over", "after", "before",
+}
+
+_lock = threading.Lock()
+_indexes = {}
+
+
+def estimate_tokens(text):
+    # Roughly four characters per token for English text and SQL identifiers
+    return max(1, math.ceil(len(text) / 4)) if text else 0
+
+
+def _stem(word):
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if word.endswith("sses"):
+        return word[:-2]
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def tokenize(text):
+    words = re.findall(r"[a-z0-9]+", re.sub(r"([a-z])([A-Z])", r"\1 \2", text or "").lower())
+    return [_stem(w) for w in words if w not in _STOPWORDS]
+
+
+# ----------- Index -----------
+class SchemaIndex:
+    """BM25 index over one catalog snapshot plus its foreign-key graph."""
+
+    def __init__(self, catalog, k1=1.5, b=0.75):
+        self.catalog = catalog
+        self.k1 = k1
+        self.b = b
+        self.docs = {}
+        self.graph = {name: set() for name in catalog.tables}
+        for name, table in catalog.tables.items():
+            # Table names count twice so a name hit outranks a stray column hit
+            terms = tokenize(name) * 2 + tokenize(table.get("comment", ""))
+            for col in table["columns"]:
+                terms += tokenize(col["name"]) + tokenize(col.get("comment", ""))
+            self.docs[name] = Counter(terms)
+            for fk in table["foreign_keys"]:
+                if fk["ref_table"] in self.graph and fk["ref_table"] != name:
+                    self.graph[name].add(fk["ref_table"])
+                    self.graph[fk["ref_table"]].add(name)
+        self.avg_len = sum(sum(d.values()) for d in self.docs.values()) / max(1, len(self.docs))
+        doc_freq = Counter(term for doc in self.docs.values() for term in doc)
+        n = len(self.docs)
+        self.idf = {term: math.log(1 + (n - df + 0.5) / (df + 0.5)) for term, df in doc_freq.items()}
+        self.table_tokens = {name: estimate_tokens(catalog.to_prompt(tables=[name])) for name in catalog.tables}
+
+    def score(self, question):
+        terms = set(tokenize(question))
+        scores = {}
+        for name, doc in self.docs.items():
+            length = sum(doc.values())
+            total = 0.0
+            for term in terms:
+                tf = doc.get(term)
+                if tf:
+                    norm = tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * length / self.avg_len))
+                    total += self.idf[term] * norm
+            if total > 0:
+                scores[name] = total
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+
+    def join_path(self, source, target):
+        """Shortest foreign-key path between two tables, endpoints included."""
+        previous = {source: None}
+        queue = deque([source])
+        while queue:
+            node = queue.popleft()
+            if node == target:
+                path = []
+                while node is not None:
+                    path.append(node)
+                    node = previous[node]
+                return path[::-1]
+            for neighbour in sorted(self.graph[node]):
+                if neighbour not in previous:
+                    previous[neighbour] = node
+                    queue.append(neighbour)
+        return [source]
+
+
+def get_index(catalog):
+    key = (id(catalog), catalog.fingerprint)
+    with _lock:
+        index = _indexes.get(key)
+        if index is None:
+            _indexes.clear()
+            index = _indexes[key] = SchemaIndex(catalog)
+        return index
+
+
+# ----------- Selection -----------
+def select_tables(catalog, question, top_k=DEFAULT_TOP_K, token_budget=DEFAULT_TOKEN_BUDGET):
+    index = get_index(catalog)
+    all_tables = catalog.table_names()
+    full_tokens = sum(index.table_tokens.values())
+    if len(all_tables) <= top_k and full_tokens <= token_budget:
+        return all_tables
+
+    seeds = [name for name, _ in index.score(question)[:top_k]]
+    selected = []
+    used = 0
+
+    def add(names):
+        nonlocal used
+        new = [n for n in dict.fromkeys(names) if n not in selected]
+        cost = sum(index.table_tokens[n] for n in new)
+        if used + cost > token_budget:
+            return False
+        selected.extend(new)
+        used += cost
+        return True
+
+    for seed in seeds:
+        # Bring in the join path to the tables already chosen so the model can write the joins
+        path = []
+        for chosen in list(selected):
+            path += index.join_path(chosen, seed)
+        if not add(path + [seed]):
+            add([seed])
+
+    # Spend what is left of the budget on tables the hits reference directly
+    for name in list(selected):
+        for neighbour in sorted(index.graph.get(name, ())):
+            add([neighbour])
+    if not selected:
+        for name in all_tables:
+            if not add([name]):
+                break
+    return sorted(selected)
+
+
+def prune_schema(catalog, question, top_k=DEFAULT_TOP_K, token_budget=DEFAULT_TOKEN_BUDGET):
+    """Return (schema_text, stats) restricted to the tables relevant to the question."""
+    with telemetry.span("schema_prune") as span:
+        tables = select_tables(catalog, question, top_k, token_budget)
+        full_text = catalog.to_prompt()
+        schema_text = catalog.to_prompt(tables=tables)
+        full_tokens = estimate_tokens(full_text)
+        schema_tokens = estimate_tokens(schema_text)
+        span["tokens"] = schema_tokens
+    stats = {
+        "tables_total": len(catalog.tables),
+        "tables_selected": len(tables),
+        "full_schema_tokens": full_tokens,
+        "schema_tokens": schema_tokens,
+        "reduction_pct": round(100 * (1 - schema_tokens / full_tokens), 1) if full_tokens else 0.0,
+    }
+    return schema_text, stats
@@ -0,0 +1,146 @@
+"""
+Speculative SQL generation: several candidates raced against validation.
+
+Instead of generate -> validate -> repair one round trip at a time, N
+candidates are requested at once with different temperatures and prompt
+variants. Each is validated as soon as it arrives (local checks from
+sql_validation, then EXPLAIN on the connected engine), the first one that
+passes wins and the requests still in flight are cancelled.
+
+The stats show what it buys and costs: how often a candidate other than the
+first to arrive won (a serial flow would have needed a retry there), and the
+tokens spent on candidates that were not used.
+"""
+import asyncio
+import threading
+import time
+
+import cost_guard
+import engine_registry
+import schema_retrieval
+import sql_generation
+import sql_validation
+import telemetry
+
+DEFAULT_CANDIDATES = 3
+TEMPERATURES = [0.0, 0.6, 0.9, 0.3, 0.75]
+
+
+# ----------- Stats -----------
+_stats = {
+    "races": 0,
+    "candidates": 0,
+    "cancelled": 0,
+    "first_passed": 0,
+    "retries_saved": 0,
+    "no_winner": 0,
+    "extra_tokens": 0,
+    "winner_ms_total": 0.0,
+}
+_stats_lock = threading.Lock()
+
+
+def _record(**increments):
+    with _stats_lock:
+        for name, value in increments.items():
+            _stats[name] += value
+
+
+def summary():
+    with _stats_lock:
+        stats = dict(_stats)
+    races = stats["races"]
+    stats["retry_saved_pct"] = round(100 * stats["retries_saved"] / races, 1) if races else 0.0
+    stats["extra_tokens_per_race"] = round(stats["extra_tokens"] / races, 1) if races else 0.0
+    stats["avg_winner_ms"] = round(stats.pop("winner_ms_total") / races, 1) if races else 0.0
+    return stats
+
+
+# ----------- Candidates -----------
+def _explain(engine, sql):
+    """Errors from asking the database for a plan, without running the query."""
+    try:
+        cost_guard.estimate(engine_registry.route_engine(engine, sql), sql)
+    except Exception as e:
+        return [f"EXPLAIN failed: {str(e).splitlines()[0]}"]
+    return []
+
+
+async def _candidate(index, client, model, prompt, temperature, catalog, dialect, engine, run_blocking):
+    usage = {}
+    sql = await sql_generation.acomplete_sql(client, model, prompt, temperature=temperature, usage=usage)
+    if sql.startswith("-- Error"):
+        result = {"ok": False, "errors": [sql]}
+    else:
+        result = await run_blocking(sql_validation.validate, sql, catalog, dialect)
+        if result["ok"] and engine is not None:
+            errors = await run_blocking(_explain, engine, sql)
+            result = dict(result, ok=not errors, errors=errors)
+    return {"index": index, "sql": sql, "ok": result["ok"], "errors": result["errors"],
+            "temperature": temperature, "usage": usage}
+
+
+async def race(client, model, schema, question, catalog, dialect, engine=None, candidates=DEFAULT_CANDIDATES,
+               run_blocking=None):
+    """
+    Generate ``candidates`` SQL queries concurrently and return the first that
+    passes validation and EXPLAIN, as (sql, report). When none passes, the
+    first to arrive is returned so the caller can still repair it. Validation
+    and EXPLAIN run through ``run_blocking(fn, *args)`` (asyncio.to_thread by default).
+    """
+    run_blocking = run_blocking or asyncio.to_thread
+    start = time.perf_counter()
+    prompts = [sql_generation.build_prompt(schema, question, variant=i) for i in range(candidates)]
+    with telemetry.span("speculation", candidates=candidates) as span:
+        tasks = [
+            asyncio.create_task(_candidate(i, client, model, prompts[i], TEMPERATURES[i % len(TEMPERATURES)],
+                                           catalog, dialect, engine, run_blocking))
+            for i in range(candidates)
+        ]
+        arrived, winner = [], None
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                try:
+                    outcome = await next_done
+                except Exception as e:
+                    outcome = {"index": None, "sql": None, "ok": False, "errors": [str(e)], "usage": {}}
+                arrived.append(outcome)
+                if outcome["ok"]:
+                    winner = outcome
+                    break
+        finally:
+            # Cancelling the task closes its HTTP request, so the model stops generating
+            pending = [task for task in tasks if not task.done()]
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        chosen = winner or next((o for o in arrived if o["sql"]), None)
+        extra_tokens = sum(
+            o["usage"].get("prompt_tokens", 0) + o["usage"].get("completion_tokens", 0) for o in arrived if o is not chosen
+        )
+        # Cancelled requests were still billed for their prompt
+        extra_tokens += sum(schema_retrieval.estimate_tokens(prompts[i]) for i, task in enumerate(tasks) if task.cancelled())
+        retry_saved = winner is not None and arrived[0] is not winner
+        _record(
+            races=1,
+            candidates=candidates,
+            cancelled=len(pending),
+            first_passed=1 if winner is not None and arrived[0] is winner else 0,
+            retries_saved=1 if retry_saved else 0,
+            no_winner=0 if winner else 1,
+            extra_tokens=extra_tokens,
+            winner_ms_total=elapsed_ms,
+        )
+        span.update(winner=winner["index"] if winner else None, cancelled=len(pending), tokens=extra_tokens)
+    report = {
+        "candidates": candidates,
+        "arrived": len(arrived),
+        "cancelled": len(pending),
+        "winner": winner["index"] if winner else None,
+        "retry_saved": retry_saved,
+        "extra_tokens": extra_tokens,
+        "elapsed_ms": round(elapsed_ms, 1),
+        "rejected": [{"index": o["index"], "errors": o["errors"]} for o in arrived if not o["ok"]],
+    }
+    return (chosen["sql"] if chosen else "-- Error: No candidate returned SQL."), report
@@ -0,0 +1,281 @@
+"""
+Prompt building and SQL extraction for SQLCreatorAgent.
+
+Besides the plain request/response path this has a streaming mode: tokens are
+handed to a callback as they arrive, and the stream is closed as soon as the
+first complete statement has been seen, so nothing the model writes after it is
+waited for.
+"""
+import re
+import time
+
+import sqlparse
+
+import telemetry
+
+_DOLLAR_TAG = re.compile(r"\$[A-Za-z_][A-Za-z0-9_]*\$|\$\$")
+
+
+# Extra instructions for speculative candidates, so they do not all make the same mistake
+PROMPT_VARIANTS = [
+    "",
+    "Use only tables and columns that appear in the schema, qualified with their table alias.\n",
+    "Check the join conditions against the foreign keys in the schema before answering.\n",
+]
+
+
+def build_prompt(schema, user_input, variant=0):
+    return (
+        f"You are an expert SQL assistant. Based on the following schema and request, write a SQL query.\n"
+        f"Schema:\n{schema}\n\n"
+        f"Request: {user_input}\n\n"
+        f"{PROMPT_VARIANTS[variant % len(PROMPT_VARIANTS)]}"
+        f"Respond ONLY with a valid SQL query. No explanation, markdown, or comments."
+    )
+
+
+def build_repair_prompt(sql, errors, dialect):
+    problems = "\n".join(f"- {error}" for error in errors)
+    return (
+        f"This {dialect} SQL query failed validation:\n{sql}\n\n"
+        f"Errors:\n{problems}\n\n"
+        f"Respond ONLY with the corrected SQL query. No explanation, markdown, or comments."
+    )
+
+
+def extract_first_statement(full_response):
+    clean_text = full_response.replace("```sql", "").replace("```", "").strip()
+    parsed = sqlparse.parse(clean_text)
+    if parsed and len(parsed) > 0:
+        return str(parsed[0]).strip()
+    else:
+        return "-- Error: No valid SQL statement found."
+
+
+# ----------- Incremental Statement Detection -----------
+class StatementEndFinder:
+    """
+    Finds the end of the first complete statement in a completion that arrives
+    in pieces. The scan position and the open quote / comment / fence are kept
+    between feeds, so each piece is scanned once instead of re-scanning the
+    whole text on every chunk. A statement ends at a top-level semicolon or at
+    the markdown fence closing the SQL block.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.pos = 0
+        self.started = False
+        self.in_fence = False
+        # None at top level, else ("quote", char) / ("line",) / ("block",) / ("dollar", tag) / ("fence",)
+        self.open = None
+        self.end = None
+        self.stopped = False
+
+    def feed(self, delta):
+        """Append ``delta``; return the index just past the first statement, or None while it is still being written."""
+        self.text += delta
+        if self.end is None and not self.stopped:
+            self._scan()
+        return self.end
+
+    def _scan(self):
+        text = self.text
+        n = len(text)
+        i = self.pos
+        while i < n:
+            if self.open is not None:
+                i = self._close(i)
+                if i is None:
+                    return
+                continue
+            c = text[i]
+            if c in "`-/$" and self._ambiguous(i):
+                # Too little text yet to tell e.g. "``" from a fence or "-" from a comment
+                break
+            if text.startswith("```", i):
+                if self.in_fence:
+                    if self.started:
+                        self.end = i
+                    else:
+                        self.stopped = True
+                    return
+                # Opening fence: anything before it was prose, the SQL starts on the next line
+                self.open = ("fence",)
+                i += 3
+                continue
+            if text.startswith("--", i):
+                self.open = ("line",)
+                i += 2
+                continue
+            if text.startswith("/*", i):
+                self.open = ("block",)
+                i += 2
+                continue
+            if c in "'\"`":
+                self.open = ("quote", c)
+                self.started = True
+                i += 1
+                continue
+            if c == "$":
+                tag = _DOLLAR_TAG.match(text, i)
+                if tag:
+                    self.open = ("dollar", tag.group())
+                    self.started = True
+                    i = tag.end()
+                    continue
+            if c == ";":
+                if self.started:
+                    self.end = i + 1
+                    return
+            elif not c.isspace():
+                self.started = True
+            i += 1
+        self.pos = i
+
+    def _ambiguous(self, i):
+        rest = self.text[i:]
+        if rest[0] == "$":
+            return re.fullmatch(r"\$[A-Za-z0-9_]*", rest) is not None
+        return len(rest) < 3 and ("```".startswith(rest) or "--".startswith(rest) or "/*".startswith(rest))
+
+    def _close(self, i):
+        """Scan the open construct from i; return the index past its end, or None (and remember i) if it is still open."""
+        text = self.text
+        n = len(text)
+        kind = self.open[0]
+        if kind in ("line", "fence"):
+            newline = text.find("\n", i)
+            if newline == -1:
+                self.pos = n
+                return None
+            if kind == "fence":
+                self.in_fence = True
+                self.started = False
+            self.open = None
+            return newline + 1
+        if kind in ("block", "dollar"):
+            closing = "*/" if kind == "block" else self.open[1]
+            close = text.find(closing, i)
+            if close == -1:
+                # The closing marker may be split across chunks
+                self.pos = max(i, n - len(closing) + 1)
+                return None
+            self.open = None
+            return close + len(closing)
+        quote = self.open[1]
+        j = i
+        while j < n:
+            c = text[j]
+            if c == "\\" and quote != "`":
+                if j + 1 >= n:
+                    break
+                j += 2
+                continue
+            if c == quote:
+                if j + 1 >= n:
+                    # A doubled quote is an escape, so wait for the next character
+                    break
+                if text[j + 1] == quote:
+                    j += 2
+                    continue
+                self.open = None
+                return j + 1
+            j += 1
+        self.pos = j
+        return None
+
+
+def find_statement_end(text):
+    """
+    Return the index just past the first complete statement in a partial
+    completion, or None while it is still being written (see StatementEndFinder).
+    """
+    return StatementEndFinder().feed(text)
+
+
+# ----------- Completion -----------
+def _usage(span, response):
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        span["prompt_tokens"] = usage.prompt_tokens
+        span["completion_tokens"] = usage.completion_tokens
+
+
+def _cleanup(text):
+    with telemetry.span("sql_cleanup", bytes=len(text)):
+        return extract_first_statement(text)
+
+
+def complete_sql(client, model, prompt):
+    with telemetry.span("llm_call", model=model, streamed=False) as span:
+        response = client.chat.completions.create(
+            model=model,
+            messages=[{"role": "user", "content": prompt}]
+        )
+        _usage(span, response)
+    return _cleanup(response.choices[0].message.content)
+
+
+async def acomplete_sql(client, model, prompt, temperature=None, usage=None):
+    """
+    Same as complete_sql, for an AsyncGroq client. ``usage``, if given, is a
+    dict that receives the prompt / completion token counts.
+    """
+    options = {} if temperature is None else {"temperature": temperature}
+    with telemetry.span("llm_call", model=model, streamed=False) as span:
+        response = await client.chat.completions.create(
+            model=model,
+            messages=[{"role": "user", "content": prompt}],
+            **options,
+        )
+        _usage(span, response)
+        if usage is not None:
+            usage.update({k: span[k] for k in ("prompt_tokens", "completion_tokens") if k in span})
+    return _cleanup(response.choices[0].message.content)
+
+
+def stream_sql(client, model, prompt, on_text=None):
+    """
+    Stream the completion, calling on_text with the text so far, and stop at the
+    end of the first statement. Returns (sql, stats).
+    """
+    start = time.perf_counter()
+    first_token_at = None
+    cut_off = False
+    text = ""
+    finder = StatementEndFinder()
+    with telemetry.span("llm_call", model=model, streamed=True) as span:
+        stream = client.chat.completions.create(
+            model=model,
+            messages=[{"role": "user", "content": prompt}],
+            stream=True,
+        )
+        try:
+            for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if not delta:
+                    continue
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                text += delta
+                end = finder.feed(delta)
+                if end is not None:
+                    text = text[:end]
+                    cut_off = True
+                if on_text is not None:
+                    on_text(text)
+                if cut_off:
+                    break
+        finally:
+            # Closing the response is what actually stops the server generating
+            stream.close()
+        span["completion_tokens"] = len(text) // 4
+        span["cut_off"] = cut_off
+    stats = {
+        "time_to_first_token_ms": round((first_token_at - start) * 1000, 1) if first_token_at else None,
+        "total_ms": round((time.perf_counter() - start) * 1000, 1),
+        "cut_off": cut_off,
+        "chars": len(text),
+    }
+    return _cleanup(text), stats
@@ -0,0 +1,425 @@
+"""
+Streaming, transactional loader for SQL setup scripts.
+
+The script is read from the upload (or a file) in chunks and split into
+statements incrementally, so a multi-GB dump never has to fit in memory.
+Everything runs in one transaction (a script's own BEGIN / COMMIT are
+skipped); runs of small INSERT ... VALUES statements into the same table are
+parsed and sent as one executemany batch; and fast-load settings are applied
+only for the duration of the load:
+
+- SQLite: WAL journal, synchronous=OFF, a large page cache, in-memory temp store
+- PostgreSQL: SET LOCAL synchronous_commit = off
+- MySQL: unique_checks / foreign_key_checks off for the session
+
+    python sql_loader.py dump.sql --url sqlite:///sample.db
+"""
+import argparse
+import codecs
+import decimal
+import re
+import sys
+import time
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+DEFAULT_BATCH_SIZE = 5000
+# INSERTs with more rows than this are already batched and run as they are
+SMALL_INSERT_ROWS = 100
+
+_LEADING_COMMENTS = re.compile(r"(?:\s+|--[^\n]*(?:\n|$)|/\*.*?\*/)*", re.DOTALL)
+_TRIGGER = re.compile(r"CREATE\s+(?:OR\s+REPLACE\s+)?(?:TEMP(?:ORARY)?\s+)?TRIGGER\b", re.IGNORECASE)
+_DELIMITER = re.compile(r"DELIMITER[ \t]+(\S+)[ \t]*\r?\n", re.IGNORECASE)
+# MySQL commits implicitly before and after these, so a later rollback cannot undo what came before
+_IMPLICIT_COMMIT = re.compile(r"(?:CREATE|ALTER|DROP|TRUNCATE|RENAME)\b", re.IGNORECASE)
+# Dumps wrap themselves in a transaction (sqlite3's iterdump, pg_dump, mysqldump); the loader already owns one
+_TRANSACTION_CONTROL = re.compile(
+    r"(?:BEGIN(?:\s+(?:DEFERRED|IMMEDIATE|EXCLUSIVE|WORK))?(?:\s+TRANSACTION)?|START\s+TRANSACTION"
+    r"|COMMIT(?:\s+(?:WORK|TRANSACTION))?|END(?:\s+TRANSACTION)?)\s*;?",
+    re.IGNORECASE,
+)
+
+
+# ----------- Statement Splitting -----------
+class StatementSplitter:
+    """Incremental statement splitter that respects quotes, comments, dollar quotes and triggers."""
+
+    def __init__(self, backslash_escapes=False):
+        self.backslash_escapes = backslash_escapes
+        self.buffer = ""
+        self.start = 0
+        self.pos = 0
+        self._set_delimiter(";")
+
+    def _set_delimiter(self, delimiter):
+        self.delimiter = delimiter
+        self._special = re.compile(re.escape(delimiter) + r"|'|\"|`|--|/\*|\$[A-Za-z_]*\$")
+
+    def _emit(self, statement):
+        statement = statement[_LEADING_COMMENTS.match(statement).end():].rstrip()
+        return statement or None
+
+    def _skip_quoted(self, quote, i):
+        buf = self.buffer
+        j = i + 1
+        while True:
+            k = buf.find(quote, j)
+            if self.backslash_escapes:
+                b = buf.find("\\", j)
+                if b != -1 and (k == -1 or b < k):
+                    j = b + 2
+                    continue
+            if k == -1 or k + 1 >= len(buf):
+                # Unterminated, or we cannot yet tell a closing quote from a doubled one
+                return None
+            if buf[k + 1] == quote:
+                j = k + 2
+                continue
+            return k + 1
+
+    def feed(self, text):
+        """Add text and yield every statement that is now complete."""
+        self.buffer += text
+        buf = self.buffer
+        i = self.pos
+        while True:
+            if self.start == i:
+                # Client-side DELIMITER commands (mysqldump triggers and routines)
+                lead = _LEADING_COMMENTS.match(buf, i).end()
+                if buf.startswith(("DELIMITER", "delimiter"), lead):
+                    match = _DELIMITER.match(buf, lead)
+                    if match is None:
+                        break
+                    self._set_delimiter(match.group(1))
+                    i = self.start = match.end()
+                    continue
+            match = self._special.search(buf, i)
+            if match is None:
+                # Keep a tail so a token split across chunks is seen whole next time
+                i = max(i, len(buf) - 64)
+                break
+            token = match.group()
+            if token == self.delimiter:
+                statement = buf[self.start:match.start()]
+                if self.delimiter == ";" and _TRIGGER.match(statement.lstrip()) and not statement.rstrip().upper().endswith("END"):
+                    i = match.end()
+                    continue
+                emitted = self._emit(statement)
+                if emitted:
+                    yield emitted
+                i = self.start = match.end()
+                continue
+            if token in ("'", '"', "`"):
+                end = self._skip_quoted(token, match.start())
+            elif token == "--":
+                end = buf.find("\n", match.end())
+                end = None if end == -1 else end + 1
+            elif token == "/*":
+                end = buf.find("*/", match.end())
+                end = None if end == -1 else end + 2
+            else:
+                end = buf.find(token, match.end())
+                end = None if end == -1 else end + len(token)
+            if end is None:
+                # Wait for more input and rescan this construct from its start
+                i = match.start()
+                break
+            i = end
+        # Drop what has been emitted so the buffer only holds the statement in progress
+        self.buffer = buf[self.start:]
+        self.pos = i - self.start
+        self.start = 0
+
+    def finish(self):
+        statement = self._emit(self.buffer)
+        self.buffer = ""
+        self.start = self.pos = 0
+        if statement:
+            yield statement
+
+
+# ----------- INSERT Coalescing -----------
+_INSERT = re.compile(
+    r"INSERT\s+INTO\s+(?P<table>(?:[`\"]?[\w$]+[`\"]?\.)?[`\"]?[\w$]+[`\"]?)\s*(?P<columns>\([^()]*\))?\s*VALUES\s*",
+    re.IGNORECASE,
+)
+_NUMBER = re.compile(r"-?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?")
+_WORD = re.compile(r"(NULL|TRUE|FALSE)\b", re.IGNORECASE)
+_MYSQL_ESCAPES = {"0": "\0", "b": "\b", "n": "\n", "r": "\r", "t": "\t", "Z": "\x1a"}
+
+
+def _parse_string(text, i, backslash_escapes):
+    parts = []
+    j = i + 1
+    while j < len(text):
+        c = text[j]
+        if c == "\\" and backslash_escapes and j + 1 < len(text):
+            parts.append(_MYSQL_ESCAPES.get(text[j + 1], text[j + 1]))
+            j += 2
+        elif c == "'":
+            if text.startswith("'", j + 1):
+                parts.append("'")
+                j += 2
+            else:
+                return "".join(parts), j + 1
+        else:
+            parts.append(c)
+            j += 1
+    return None, None
+
+
+def parse_insert(statement, backslash_escapes=False, exact_decimals=True):
+    """
+    Parse INSERT INTO t (cols) VALUES (...), (...) made only of literals.
+    Returns (table, columns_sql, rows) or None for anything else. Non-integer
+    numbers become Decimal, so NUMERIC columns get the literal's exact value,
+    or float with ``exact_decimals=False``.
+    """
+    match = _INSERT.match(statement)
+    if match is None:
+        return None
+    text = statement
+    i = match.end()
+    rows = []
+    n = len(text)
+    while True:
+        while i < n and text[i].isspace():
+            i += 1
+        if i >= n or text[i] != "(":
+            return None
+        i += 1
+        row = []
+        while True:
+            while i < n and text[i].isspace():
+                i += 1
+            if i >= n:
+                return None
+            if text[i] == "'":
+                value, i = _parse_string(text, i, backslash_escapes)
+                if i is None:
+                    return None
+            else:
+                number = _NUMBER.match(text, i)
+                word = _WORD.match(text, i)
+                if number:
+                    literal = number.group()
+                    if re.fullmatch(r"-?\d+", literal):
+                        value = int(literal)
+                    else:
+                        value = decimal.Decimal(literal) if exact_decimals else float(literal)
+                    i = number.end()
+                elif word:
+                    value = {"NULL": None, "TRUE": True, "FALSE": False}[word.group(1).upper()]
+                    i = word.end()
+                else:
+                    # Expressions, function calls, casts: run the statement as written
+                    return None
+            row.append(value)
+            while i < n and text[i].isspace():
+                i += 1
+            if i < n and text[i] == ",":
+                i += 1
+                continue
+            if i < n and text[i] == ")":
+                i += 1
+                break
+            return None
+        if rows and len(row) != len(rows[0]):
+            return None
+        rows.append(tuple(row))
+        while i < n and text[i].isspace():
+            i += 1
+        if i < n and text[i] == ",":
+            i += 1
+            continue
+        if i == n:
+            return match.group("table"), match.group("columns") or "", rows
+        # ON CONFLICT, RETURNING and friends
+        return None
+
+
+# ----------- Fast-Load Settings -----------
+def apply_fast_load(conn):
+    """Apply per-dialect fast-load settings and return the statements that undo them."""
+    dialect = conn.dialect.name
+    if dialect == "sqlite":
+        previous = {
+            "journal_mode": conn.exec_driver_sql("PRAGMA journal_mode").scalar(),
+            "synchronous": conn.exec_driver_sql("PRAGMA synchronous").scalar(),
+            "cache_size": conn.exec_driver_sql("PRAGMA cache_size").scalar(),
+            "temp_store": conn.exec_driver_sql("PRAGMA temp_store").scalar(),
+        }
+        conn.exec_driver_sql("PRAGMA journal_mode = WAL")
+        conn.exec_driver_sql("PRAGMA synchronous = OFF")
+        conn.exec_driver_sql("PRAGMA cache_size = -262144")
+        conn.exec_driver_sql("PRAGMA temp_store = MEMORY")
+        return [f"PRAGMA {name} = {value}" for name, value in previous.items()]
+    if dialect == "mysql":
+        conn.exec_driver_sql("SET SESSION unique_checks = 0, foreign_key_checks = 0")
+        return ["SET SESSION unique_checks = 1, foreign_key_checks = 1"]
+    return []
+
+
+def begin_load(conn):
+    dialect = conn.dialect.name
+    if dialect == "sqlite":
+        # pysqlite only opens transactions implicitly before DML; make the DDL part of it too
+        conn.exec_driver_sql("BEGIN")
+    elif dialect == "postgresql":
+        conn.exec_driver_sql("SET LOCAL synchronous_commit = off")
+
+
+def _executemany(conn, table, columns, rows):
+    dialect = conn.dialect.name
+    cursor = conn.connection.dbapi_connection.cursor()
+    try:
+        if dialect == "postgresql":
+            from psycopg2.extras import execute_values
+
+            execute_values(cursor, f"INSERT INTO {table} {columns} VALUES %s", rows, page_size=1000)
+        else:
+            marker = "?" if conn.dialect.paramstyle == "qmark" else "%s"
+            placeholders = ", ".join([marker] * len(rows[0]))
+            cursor.executemany(f"INSERT INTO {table} {columns} VALUES ({placeholders})", rows)
+    finally:
+        cursor.close()
+
+
+# ----------- Loader -----------
+def iter_text(source, chunk_size=DEFAULT_CHUNK_SIZE, encoding="utf-8"):
+    """Yield decoded text chunks from a binary or text file-like object."""
+    decoder = codecs.getincrementaldecoder(encoding)(errors="strict")
+    while True:
+        chunk = source.read(chunk_size)
+        if not chunk:
+            break
+        yield decoder.decode(chunk) if isinstance(chunk, bytes) else chunk
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+def load_script(engine, source, total_bytes=None, on_progress=None, batch_size=DEFAULT_BATCH_SIZE,
+                chunk_size=DEFAULT_CHUNK_SIZE, progress_every=1.0):
+    """
+    Run a SQL script from a file-like object in one transaction. Returns a stats
+    dict; on failure the transaction is rolled back and a RuntimeError naming the
+    failing statement is raised (on MySQL, DDL has already committed whatever
+    came before it).
+    """
+    dialect = engine.dialect.name
+    backslash_escapes = dialect == "mysql"
+    # sqlite3 cannot bind Decimal, and SQLite reads a decimal literal as a double anyway
+    exact_decimals = dialect != "sqlite"
+    committed = False
+    splitter = StatementSplitter(backslash_escapes=backslash_escapes)
+    stats = {"statements": 0, "rows": 0, "batches": 0, "bytes": 0, "elapsed_s": 0.0, "rows_per_s": 0.0}
+    start = time.perf_counter()
+    last_report = start
+    batch_key = None
+    batch_rows = []
+
+    def report(force=False):
+        nonlocal last_report
+        now = time.perf_counter()
+        stats["elapsed_s"] = round(now - start, 3)
+        stats["rows_per_s"] = round(stats["rows"] / (now - start), 1) if now > start else 0.0
+        if on_progress is not None and (force or now - last_report >= progress_every):
+            last_report = now
+            on_progress(dict(stats, total_bytes=total_bytes))
+
+    def flush(conn):
+        nonlocal batch_key, batch_rows
+        if batch_rows:
+            _executemany(conn, batch_key[0], batch_key[1], batch_rows)
+            stats["rows"] += len(batch_rows)
+            stats["batches"] += 1
+        batch_key, batch_rows = None, []
+
+    def run(conn, statement):
+        nonlocal batch_key, committed
+        if _TRANSACTION_CONTROL.fullmatch(statement):
+            return
+        stats["statements"] += 1
+        parsed = parse_insert(statement, backslash_escapes, exact_decimals) if statement[:6].upper() == "INSERT" else None
+        if parsed is not None and len(parsed[2]) <= SMALL_INSERT_ROWS:
+            table, columns, rows = parsed
+            key = (table, columns, len(rows[0]))
+            if key != batch_key:
+                flush(conn)
+                batch_key = key
+            batch_rows.extend(rows)
+            if len(batch_rows) >= batch_size:
+                flush(conn)
+            return
+        flush(conn)
+        if dialect == "mysql" and _IMPLICIT_COMMIT.match(statement):
+            committed = True
+        # no_parameters: pyformat drivers would otherwise read a % in string data as a format directive
+        result = conn.exec_driver_sql(statement, execution_options={"no_parameters": True})
+        if statement[:6].upper() == "INSERT" and result.rowcount and result.rowcount > 0:
+            stats["rows"] += result.rowcount
+
+    with engine.connect() as conn:
+        restore = apply_fast_load(conn)
+        failed = False
+        try:
+            begin_load(conn)
+            for chunk in iter_text(source, chunk_size):
+                stats["bytes"] += len(chunk.encode("utf-8"))
+                for statement in splitter.feed(chunk):
+                    run(conn, statement)
+                    report()
+            for statement in splitter.finish():
+                run(conn, statement)
+            flush(conn)
+            conn.commit()
+        except Exception as e:
+            failed = True
+            conn.rollback()
+            if committed:
+                outcome = "everything up to its last CREATE/ALTER/DROP stays loaded (MySQL commits DDL implicitly)"
+            else:
+                outcome = "nothing was loaded"
+            raise RuntimeError(f"Statement {stats['statements']} failed, {outcome}: {e}") from e
+        finally:
+            try:
+                for statement in restore:
+                    conn.exec_driver_sql(statement, execution_options={"no_parameters": True})
+                conn.commit()
+            except Exception:
+                # Never hide the error that stopped the load behind one from undoing the settings
+                if not failed:
+                    raise
+    report(force=True)
+    return stats
+
+
+def load_path(engine, path, **options):
+    with open(path, "rb") as f:
+        f.seek(0, 2)
+        total_bytes = f.tell()
+        f.seek(0)
+        return load_script(engine, f, total_bytes=total_bytes, **options)
+
+
+def main(argv=None):
+    from sqlalchemy import create_engine
+
+    parser = argparse.ArgumentParser(description="Load a SQL script in one streaming transaction")
+    parser.add_argument("script")
+    parser.add_argument("--url", default="sqlite:///sample.db", help="SQLAlchemy database URL")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    def progress(p):
+        print(f"{p['bytes'] / 1e6:,.1f}/{p['total_bytes'] / 1e6:,.1f} MB, {p['rows']:,} rows, "
+              f"{p['rows_per_s']:,.0f} rows/s", file=sys.stderr)
+
+    engine = create_engine(args.url)
+    stats = load_path(engine, args.script, on_progress=progress, batch_size=args.batch_size)
+    print(f"{stats['statements']:,} statements, {stats['rows']:,} rows in {stats['elapsed_s']:.2f}s "
+          f"({stats['rows_per_s']:,.0f} rows/s)")
+
+
+if __name__ == "__main__":
+    main()
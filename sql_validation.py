@@ -0,0 +1,284 @@
+"""
+Local validation of generated SQL against the schema catalog.
+
+Before anything reaches the database the query is parsed with sqlparse and
+checked for:
+
+- exactly one statement, and a read-only one (no DDL / DML)
+- tables and columns that exist in the catalog (with "did you mean" hints)
+- constructs from another dialect (TOP, ILIKE, ``::`` casts, backticks, ...)
+- on SQLite, a compile of the query against an empty in-memory copy of the
+  schema, which catches every syntax and name error without touching the file
+
+When validation fails the errors alone are sent back to the model for a
+bounded number of repair attempts, instead of a failed run and a manual
+regeneration.
+"""
+import asyncio
+import difflib
+import re
+import sqlite3
+import threading
+import time
+
+import sqlparse
+from sqlparse import tokens as T
+
+import cost_guard
+import engine_registry
+import sql_generation
+import telemetry
+
+DEFAULT_MAX_REPAIRS = 2
+
+_SYSTEM_PREFIXES = ("sqlite_", "pg_", "information_schema", "mysql.", "performance_schema")
+
+_DIALECT_RULES = [
+    (re.compile(r"\bSELECT\s+(?:DISTINCT\s+)?TOP\s+\d+", re.IGNORECASE), {"sqlite", "postgresql", "mysql"},
+     "TOP n is SQL Server syntax; use LIMIT n"),
+    (re.compile(r"\bILIKE\b", re.IGNORECASE), {"sqlite", "mysql"},
+     "ILIKE is PostgreSQL only; use LOWER(column) LIKE LOWER(pattern)"),
+    (re.compile(r"::\s*[A-Za-z_]"), {"sqlite", "mysql"},
+     "`::` casts are PostgreSQL only; use CAST(expression AS type)"),
+    (re.compile(r"`"), {"postgresql", "sqlite"},
+     "backtick-quoted identifiers are MySQL syntax; use double quotes"),
+    (re.compile(r"\bLIMIT\s+\d+\s*,\s*\d+", re.IGNORECASE), {"postgresql"},
+     "LIMIT offset, count is MySQL syntax; use LIMIT count OFFSET offset"),
+    (re.compile(r"\bFETCH\s+(?:FIRST|NEXT)\b", re.IGNORECASE), {"sqlite", "mysql"},
+     "FETCH FIRST is not supported; use LIMIT"),
+    (re.compile(r"\b(?:DATE_TRUNC|TO_CHAR|AGE)\s*\(", re.IGNORECASE), {"sqlite", "mysql"},
+     "DATE_TRUNC / TO_CHAR / AGE are PostgreSQL functions"),
+    (re.compile(r"\b(?:DATE_FORMAT|CURDATE|DATEDIFF|DATE_SUB|DATE_ADD)\s*\(", re.IGNORECASE), {"sqlite", "postgresql"},
+     "DATE_FORMAT / CURDATE / DATEDIFF / DATE_ADD / DATE_SUB are MySQL functions"),
+    (re.compile(r"\bSTRFTIME\s*\(", re.IGNORECASE), {"postgresql", "mysql"},
+     "STRFTIME is SQLite only"),
+    (re.compile(r"\bNOW\s*\(", re.IGNORECASE), {"sqlite"},
+     "NOW() does not exist in SQLite; use DATE('now') or DATETIME('now')"),
+]
+
+
+# ----------- Stats -----------
+_stats = {
+    "validations": 0,
+    "failures": 0,
+    "repair_calls": 0,
+    "repaired": 0,
+    "retries_avoided": 0,
+    "total_ms": 0.0,
+}
+_stats_lock = threading.Lock()
+
+
+def _record(**increments):
+    with _stats_lock:
+        for name, value in increments.items():
+            _stats[name] += value
+
+
+def summary():
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["avg_ms"] = round(stats["total_ms"] / stats["validations"], 2) if stats["validations"] else 0.0
+    stats["total_ms"] = round(stats["total_ms"], 2)
+    return stats
+
+
+# ----------- Checks -----------
+def _name(token):
+    value = token.value
+    if value[:1] in ('"', "`", "[") and len(value) > 1:
+        value = value[1:-1]
+    return value.lower()
+
+
+def _code_only(statement):
+    """Statement text with string literals and comments blanked out, for the dialect rules."""
+    return "".join(
+        " " if token.ttype in T.String.Single or token.ttype in T.Comment else token.value
+        for token in statement.flatten()
+    )
+
+
+def _is_name(token):
+    return token.ttype == T.Name or token.ttype == T.String.Symbol
+
+
+def _suggest(name, candidates):
+    close = difflib.get_close_matches(name, candidates, n=3, cutoff=0.6)
+    return f"; did you mean {', '.join(close)}?" if close else ""
+
+
+def _check_references(statement, query, catalog):
+    errors = []
+    known = {name.lower(): {c["name"].lower() for c in info["columns"]} for name, info in catalog.tables.items()}
+    all_columns = set().union(*known.values()) if known else set()
+    tokens = [t for t in statement.flatten() if not t.is_whitespace and t.ttype not in T.Comment]
+
+    def at(i):
+        return tokens[i] if 0 <= i < len(tokens) else None
+
+    # Aliases, CTE names and functions are collected first: ORDER BY may use an alias defined later
+    aliases = {k.lower(): v.lower() for k, v in cost_guard.table_aliases(query).items()}
+    defined = set()
+    for i, token in enumerate(tokens):
+        if not _is_name(token):
+            continue
+        prev, nxt = at(i - 1), at(i + 1)
+        if nxt is not None and nxt.ttype == T.Punctuation and nxt.value == "(":
+            continue
+        if prev is not None and prev.ttype in T.Keyword and prev.normalized in ("AS", "END"):
+            defined.add(_name(token))
+        elif prev is not None and (_is_name(prev) or prev.value == ")" or prev.ttype in T.Literal) and not (
+            at(i - 2) is not None and at(i - 2).value == "."
+        ):
+            defined.add(_name(token))
+        elif nxt is not None and nxt.normalized == "AS" and at(i + 2) is not None and at(i + 2).value == "(":
+            defined.add(_name(token))  # CTE name
+
+    for alias, table in sorted(aliases.items()):
+        if table in known or table in defined or table in all_columns or table.startswith(_SYSTEM_PREFIXES):
+            continue
+        if re.search(rf"\b{re.escape(table)}\s*\(", query, re.IGNORECASE):
+            continue  # table-valued function
+        errors.append(f"Unknown table `{table}`{_suggest(table, known)}")
+        known[table] = None  # report once
+
+    for i, token in enumerate(tokens):
+        if not _is_name(token):
+            continue
+        name = _name(token)
+        prev, nxt = at(i - 1), at(i + 1)
+        if nxt is not None and nxt.ttype == T.Punctuation and nxt.value in (".", "("):
+            continue
+        if prev is not None and prev.ttype == T.Punctuation and prev.value == ".":
+            qualifier = at(i - 2)
+            table = aliases.get(_name(qualifier)) if qualifier is not None else None
+            columns = known.get(table) if table else None
+            if columns and name not in columns:
+                errors.append(f"Unknown column `{name}` in table `{table}`{_suggest(name, columns)}")
+            continue
+        if name in defined or name in aliases:
+            continue
+        referenced = [known[t] for t in set(aliases.values()) if known.get(t)]
+        if referenced and not any(name in columns for columns in referenced):
+            candidates = set().union(*referenced)
+            errors.append(
+                f"Unknown column `{name}` in {', '.join(sorted(f'`{t}`' for t in set(aliases.values()) if known.get(t)))}"
+                f"{_suggest(name, candidates)}"
+            )
+    return list(dict.fromkeys(errors))
+
+
+def _check_dialect(statement, dialect):
+    code = _code_only(statement)
+    return [message for pattern, dialects, message in _DIALECT_RULES if dialect in dialects and pattern.search(code)]
+
+
+_shadows = {}
+_shadows_lock = threading.Lock()
+
+
+def _sqlite_shadow(catalog):
+    """An empty in-memory database with the catalog's tables, cached per schema fingerprint."""
+    fingerprint = catalog.fingerprint
+    with _shadows_lock:
+        if fingerprint not in _shadows:
+            conn = sqlite3.connect(":memory:", check_same_thread=False)
+            for name, info in catalog.tables.items():
+                columns = ", ".join(f'"{c["name"]}" {c.get("type") or ""}' for c in info["columns"])
+                try:
+                    conn.execute(f'CREATE TABLE "{name}" ({columns})')
+                except sqlite3.Error:
+                    pass
+            if len(_shadows) >= 8:
+                _shadows.pop(next(iter(_shadows))).close()
+            _shadows[fingerprint] = (conn, threading.Lock())
+        return _shadows[fingerprint]
+
+
+def _check_sqlite_compile(query, catalog):
+    conn, lock = _sqlite_shadow(catalog)
+    with lock:
+        try:
+            conn.execute(f"EXPLAIN {query}")
+        except sqlite3.ProgrammingError:
+            # Unbound parameters; the statement itself compiled
+            return []
+        except sqlite3.Error as e:
+            return [f"SQLite rejected the query: {e}"]
+    return []
+
+
+def validate(query, catalog, dialect):
+    """Return {"ok", "errors", "elapsed_ms"} for a generated query, without touching the database."""
+    with telemetry.span("validation") as span:
+        result = _validate(query, catalog, dialect)
+        span["ok"] = result["ok"]
+    return result
+
+
+def _validate(query, catalog, dialect):
+    start = time.perf_counter()
+    errors = []
+    statements = [s for s in sqlparse.parse(query.strip()) if s.token_first(skip_cm=True) is not None]
+    if not statements:
+        errors.append("No SQL statement found")
+    elif len(statements) > 1:
+        errors.append(f"Expected a single statement, found {len(statements)}")
+    else:
+        statement = statements[0]
+        text = str(statement).strip().rstrip(";")
+        if statement.get_type() != "SELECT" or not engine_registry.is_read_only(text):
+            errors.append(f"Only read-only SELECT queries are allowed, got {statement.get_type()}")
+        else:
+            errors.extend(_check_dialect(statement, dialect))
+            if catalog is not None and catalog.tables:
+                errors.extend(_check_references(statement, text, catalog))
+                if not errors and dialect == "sqlite":
+                    errors.extend(_check_sqlite_compile(text, catalog))
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    _record(validations=1, failures=1 if errors else 0, total_ms=elapsed_ms)
+    return {"ok": not errors, "errors": errors, "elapsed_ms": round(elapsed_ms, 2)}
+
+
+# ----------- Repair -----------
+def validate_and_repair(client, model, query, catalog, dialect, max_repairs=DEFAULT_MAX_REPAIRS):
+    """
+    Validate a query and, while it fails, ask the model to fix only the reported
+    errors, at most ``max_repairs`` times. Returns (query, report) where report
+    has the final validation result plus "attempts" and "repaired".
+    """
+    result = validate(query, catalog, dialect)
+    attempts = 0
+    while not result["ok"] and attempts < max_repairs and client is not None:
+        attempts += 1
+        _record(repair_calls=1)
+        prompt = sql_generation.build_repair_prompt(query, result["errors"], dialect)
+        query = sql_generation.complete_sql(client, model, prompt)
+        if query.startswith("-- Error"):
+            break
+        result = validate(query, catalog, dialect)
+    repaired = attempts > 0 and result["ok"]
+    if repaired:
+        # Each successful local repair replaces a failed database run plus a manual regeneration
+        _record(repaired=1, retries_avoided=1)
+    return query, dict(result, attempts=attempts, repaired=repaired)
+
+
+async def avalidate_and_repair(client, model, query, catalog, dialect, max_repairs=DEFAULT_MAX_REPAIRS, run_blocking=None):
+    """Same as validate_and_repair, for an AsyncGroq client; validation runs through ``run_blocking`` off the loop."""
+    run_blocking = run_blocking or asyncio.to_thread
+    result = await run_blocking(validate, query, catalog, dialect)
+    attempts = 0
+    while not result["ok"] and attempts < max_repairs and client is not None:
+        attempts += 1
+        _record(repair_calls=1)
+        prompt = sql_generation.build_repair_prompt(query, result["errors"], dialect)
+        query = await sql_generation.acomplete_sql(client, model, prompt)
+        if query.startswith("-- Error"):
+            break
+        result = await run_blocking(validate, query, catalog, dialect)
+    repaired = attempts > 0 and result["ok"]
+    if repaired:
+        _record(repaired=1, retries_avoided=1)
+    return query, dict(result, attempts=attempts, repaired=repaired)
@@ -0,0 +1,375 @@
+"""
+UI-free SQLGenius pipeline: engines, schema, generation and execution.
+
+The Streamlit app, batch.py and api_server.py are thin shells over these
+functions. Importing this module only loads the standard library and the
+small pure-Python helpers (prompt building, schema retrieval, generation
+cache, telemetry); SQLAlchemy, pyarrow, pandas, groq and the database drivers
+are imported on first use, so a CLI or worker that only needs part of the
+pipeline does not pay for the rest.
+
+    python sqlgenius_core.py --import-time
+
+prints the cold import time of this module against IMPORT_BUDGET_MS.
+"""
+import os
+import time
+
+import generation_cache
+import schema_retrieval
+import sql_generation
+import telemetry
+
+DEFAULT_MODEL = "llama3-8b-8192"
+IMPORT_BUDGET_MS = 150
+
+
+# ----------- Engines -----------
+def engine_config(db_type, sqlite_path="sample.db", host="localhost", port=None, user=None, password=None, dbname=None):
+    """
+    The connection config engine_registry expects for ``db_type``. A SQLite file
+    must already exist: sqlite3 would otherwise create an empty database there.
+    """
+    if db_type == "SQLite":
+        if not os.path.isfile(sqlite_path):
+            raise FileNotFoundError(f"No SQLite database at {sqlite_path}")
+        return {"path": sqlite_path}
+    return {
+        "host": host,
+        "port": port or ("5432" if db_type == "PostgreSQL" else "3306"),
+        "user": user,
+        "password": password or "",
+        "dbname": dbname,
+    }
+
+
+def get_engine(db_type, config, pool_options=None, replica_url=None):
+    # Engines live in a process-wide registry so every caller shares one pool per config
+    import engine_registry
+
+    return engine_registry.get_engine(db_type, config, pool_options, replica_url or None)
+
+
+def check_connection(engine):
+    """Raise if the database cannot be reached."""
+    from sqlalchemy import text
+
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+
+
+# ----------- Schema -----------
+def load_catalog(engine):
+    """The cached schema catalog for ``engine``, or None if it cannot be read."""
+    import schema_catalog
+
+    try:
+        return schema_catalog.get_catalog(engine)
+    except Exception:
+        return None
+
+
+def extract_schema(engine):
+    import schema_catalog
+
+    try:
+        # Bulk-loaded and cached per engine; only re-read when the DDL fingerprint changes
+        return schema_catalog.get_catalog(engine).to_prompt()
+    except Exception as e:
+        return "-- Failed to extract schema: " + str(e)
+
+
+# ----------- Generation -----------
+def groq_client(api_key):
+    """The pooled client for ``api_key``: keep-alive connections, retries, hedging, circuit breaker."""
+    import llm_client
+
+    return llm_client.get_client(api_key)
+
+
+def async_groq_client(api_key):
+    import llm_client
+
+    return llm_client.get_async_client(api_key)
+
+
+async def _race(api_key, *args):
+    import speculation
+
+    # Created on the loop that runs the race, so its pooled connections stay usable there
+    return await speculation.race(async_groq_client(api_key), *args)
+
+
+def _lookup(cache, question, fingerprint, model, result):
+    if cache is None:
+        return None
+    sql = cache.get(question, fingerprint, model)
+    result["cache_hit"] = sql is not None
+    return sql
+
+
+def _prompt(question, catalog, schema, top_k, token_budget, result):
+    schema_stats = None
+    if catalog is not None:
+        # Only send the tables relevant to the question, within the token budget
+        schema, schema_stats = schema_retrieval.prune_schema(catalog, question, top_k=top_k, token_budget=token_budget)
+    elif schema is None:
+        schema = "-- No database connected."
+    with telemetry.span("prompt_build") as span:
+        prompt = sql_generation.build_prompt(schema, question)
+        span["tokens"] = schema_retrieval.estimate_tokens(prompt)
+    if schema_stats:
+        prompt_tokens = schema_retrieval.estimate_tokens(prompt)
+        schema_stats["prompt_tokens"] = prompt_tokens
+        schema_stats["full_prompt_tokens"] = prompt_tokens + schema_stats["full_schema_tokens"] - schema_stats["schema_tokens"]
+    result["schema_stats"] = schema_stats
+    return schema, prompt
+
+
+def _store(cache, question, fingerprint, model, result):
+    sql = result["sql"]
+    valid = result["validation"] is None or result["validation"]["ok"]
+    if cache is not None and valid and sql and not sql.startswith("-- Error"):
+        cache.put(question, fingerprint, model, sql)
+
+
+def _new_result():
+    return {"sql": None, "cache_hit": False, "schema_stats": None, "generation_stats": None, "validation": None,
+            "speculation": None}
+
+
+def generate_sql(client, model, question, catalog=None, schema=None, dialect=None, cache=None,
+                 top_k=schema_retrieval.DEFAULT_TOP_K, token_budget=schema_retrieval.DEFAULT_TOKEN_BUDGET,
+                 stream=False, on_text=None, validate=True, max_repairs=None, speculate=1, engine=None):
+    """
+    Answer ``question`` with one SQL statement. Returns a dict with "sql",
+    "cache_hit", "schema_stats", "generation_stats", "validation" and
+    "speculation".
+
+    ``catalog`` enables schema pruning, validation and caching per schema
+    fingerprint; without it ``schema`` (prompt text) is sent as is. With
+    ``speculate`` > 1 that many candidates are raced (see speculation.py),
+    checked with EXPLAIN on ``engine`` when given; streaming is skipped then.
+    """
+    result = _new_result()
+    dialect = dialect or (catalog.dialect if catalog is not None else "sqlite")
+    fingerprint = catalog.fingerprint if catalog is not None else "no-schema"
+    # Repeated questions against the same schema and model skip the LLM entirely
+    result["sql"] = _lookup(cache, question, fingerprint, model, result)
+    if result["sql"] is not None:
+        return result
+    schema, prompt = _prompt(question, catalog, schema, top_k, token_budget, result)
+    sql = None
+    if speculate > 1:
+        import llm_client
+
+        sql, result["speculation"] = llm_client.run(
+            _race(client.api_key, model, schema, question, catalog, dialect, engine, speculate)
+        )
+    elif stream:
+        try:
+            sql, result["generation_stats"] = sql_generation.stream_sql(client, model, prompt, on_text)
+        except Exception:
+            # Fall back to the plain request/response path
+            sql = None
+    if sql is None:
+        sql = sql_generation.complete_sql(client, model, prompt)
+    if validate and sql and not sql.startswith("-- Error"):
+        import sql_validation
+
+        # Hallucinated tables or columns are caught locally and fixed by sending back only the errors
+        sql, result["validation"] = sql_validation.validate_and_repair(
+            client, model, sql, catalog, dialect,
+            max_repairs=sql_validation.DEFAULT_MAX_REPAIRS if max_repairs is None else max_repairs,
+        )
+    result["sql"] = sql
+    _store(cache, question, fingerprint, model, result)
+    return result
+
+
+async def agenerate_sql(client, model, question, catalog=None, schema=None, dialect=None, cache=None,
+                        top_k=schema_retrieval.DEFAULT_TOP_K, token_budget=schema_retrieval.DEFAULT_TOKEN_BUDGET,
+                        validate=True, max_repairs=None, before_call=None, speculate=1, engine=None, run_blocking=None):
+    """
+    Same as generate_sql, for an AsyncGroq client. ``before_call`` is awaited
+    right before the LLM request (e.g. a rate limiter); cache hits skip it.
+    The cache, schema pruning and validation block, so they run through
+    ``run_blocking(fn, *args)`` (asyncio.to_thread by default) off the event loop.
+    """
+    import asyncio
+
+    run_blocking = run_blocking or asyncio.to_thread
+    result = _new_result()
+    dialect = dialect or (catalog.dialect if catalog is not None else "sqlite")
+    fingerprint = catalog.fingerprint if catalog is not None else "no-schema"
+    result["sql"] = await run_blocking(_lookup, cache, question, fingerprint, model, result)
+    if result["sql"] is not None:
+        return result
+    schema, prompt = await run_blocking(_prompt, question, catalog, schema, top_k, token_budget, result)
+    if before_call is not None:
+        await before_call()
+    start = time.perf_counter()
+    if speculate > 1:
+        import speculation
+
+        sql, result["speculation"] = await speculation.race(
+            client, model, schema, question, catalog, dialect, engine, speculate, run_blocking=run_blocking
+        )
+    else:
+        sql = await sql_generation.acomplete_sql(client, model, prompt)
+    result["generation_stats"] = {"total_ms": round((time.perf_counter() - start) * 1000, 1)}
+    if validate and not sql.startswith("-- Error"):
+        import sql_validation
+
+        sql, result["validation"] = await sql_validation.avalidate_and_repair(
+            client, model, sql, catalog, dialect,
+            max_repairs=sql_validation.DEFAULT_MAX_REPAIRS if max_repairs is None else max_repairs,
+            run_blocking=run_blocking,
+        )
+    result["sql"] = sql
+    await run_blocking(_store, cache, question, fingerprint, model, result)
+    return result
+
+
+def sql_by_dialect(client, model, question, sql, dialect, engines, **options):
+    """
+    {dialect: sql} covering every dialect among ``engines``. ``sql`` is kept for
+    its own dialect; each other dialect gets one generation against the schema
+    of its first engine. ``options`` are passed on to generate_sql.
+    """
+    queries = {dialect: sql}
+    for engine in engines:
+        name = engine.dialect.name
+        if name in queries:
+            continue
+        if client is None:
+            # Without a model to ask, the same SQL is tried everywhere
+            queries[name] = sql
+            continue
+        queries[name] = generate_sql(client, model, question, catalog=load_catalog(engine), dialect=name, **options)["sql"]
+    return queries
+
+
+# ----------- Execution -----------
+def cached_result(engine, query, page_size, params=None):
+    """(pager, seconds the original run took) from the result cache, or None."""
+    import engine_registry
+    import result_cache
+    import result_pager
+
+    engine = engine_registry.route_engine(engine, query)
+    hit = result_cache.get_cache().get(engine, query, params)
+    if hit is None:
+        return None
+    table, seconds = hit
+    return result_pager.ResultPager.from_table(table, page_size), seconds
+
+
+def _data_version(engine, query):
+    import result_cache
+
+    if not result_cache.is_cacheable(query):
+        return None
+    try:
+        # Taken before the query runs so a concurrent write can only make the entry stale
+        return result_cache.data_version(engine, query)
+    except Exception:
+        return None
+
+
+def prepare_query(engine, query, timeout_s, **pager_options):
+    """A QueryJob the caller runs itself (``job.run()`` on its own executor)."""
+    import engine_registry
+    import query_jobs
+
+    engine = engine_registry.route_engine(engine, query)
+    data_version = _data_version(engine, query)
+    job = query_jobs.QueryJob(engine, query, timeout_s, pager_options)
+    job.data_version = data_version
+    return job
+
+
+def submit_query(engine, query, timeout_s, **pager_options):
+    # Runs on the shared worker pool; the first page is fetched there and the rest on demand
+    import engine_registry
+    import query_jobs
+
+    engine = engine_registry.route_engine(engine, query)
+    data_version = _data_version(engine, query)
+    job = query_jobs.get_manager().submit(engine, query, timeout_s, **pager_options)
+    job.data_version = data_version
+    return job
+
+
+def cache_result(job):
+    """Store a finished, complete result in the result cache. Returns whether it was stored."""
+    import result_cache
+
+    pager = job.pager
+    if pager is None or not pager.returns_rows or not pager.exhausted or pager.truncated:
+        return False
+    if any(not page.schema.equals(pager.pages[0].schema) for page in pager.pages):
+        return False
+    return result_cache.get_cache().put(
+        job.engine, job.query, pager.to_table(), job.elapsed, job.data_version, job.pager_options.get("params")
+    )
+
+
+def run_query(engine, query, params=None):
+    """Run ``query`` (with bind ``params``) and return all rows as a pandas DataFrame."""
+    import engine_registry
+    import pandas as pd
+    from sqlalchemy import text
+
+    engine = engine_registry.route_engine(engine, query)
+    with engine.connect() as conn:
+        return pd.read_sql_query(text(query), conn, params=params)
+
+
+def run_sql(engine, sql, max_rows):
+    """
+    Run a read-only ``sql`` and return {"columns", "row_count", "rows"} with at
+    most ``max_rows`` rows as strings. Anything else raises ValueError, and the
+    connection is never committed.
+    """
+    import engine_registry
+    from sqlalchemy import text
+
+    if not engine_registry.is_read_only(sql):
+        raise ValueError("Only a single read-only SELECT can be run unattended")
+    engine = engine_registry.route_engine(engine, sql)
+    with engine.connect() as conn:
+        result = conn.execute(text(sql))
+        if not result.returns_rows:
+            return {"columns": [], "row_count": result.rowcount, "rows": []}
+        columns = list(result.keys())
+        rows = []
+        row_count = 0
+        for row in result:
+            if row_count < max_rows:
+                rows.append([str(v) if v is not None else None for v in row])
+            row_count += 1
+        return {"columns": columns, "row_count": row_count, "rows": rows}
+
+
+# ----------- Cold Start -----------
+def measure_import_ms(module=__name__, runs=5):
+    """Median import time of ``module`` in fresh interpreters, in milliseconds."""
+    import statistics
+    import subprocess
+    import sys
+
+    code = f"import time; t = time.perf_counter(); import {module}; print((time.perf_counter() - t) * 1000)"
+    here = os.path.dirname(os.path.abspath(__file__))
+    samples = [float(subprocess.check_output([sys.executable, "-c", code], text=True, cwd=here)) for _ in range(runs)]
+    return round(statistics.median(samples), 1)
+
+
+if __name__ == "__main__":
+    import sys
+
+    if "--import-time" not in sys.argv[1:]:
+        sys.exit("usage: python sqlgenius_core.py --import-time")
+    elapsed = measure_import_ms("sqlgenius_core")
+    print(f"import sqlgenius_core: {elapsed} ms (budget {IMPORT_BUDGET_MS} ms)")
+    sys.exit(0 if elapsed <= IMPORT_BUDGET_MS else 1)
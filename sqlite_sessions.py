@@ -0,0 +1,192 @@
+"""
+Per-session SQLite databases.
+
+Instead of every browser session reading and writing the one shared
+sample.db, each session gets its own file under a sessions directory, created
+as a consistent snapshot of the read-only base database (sqlite3's online
+backup API, so a base in WAL mode is copied correctly). Setup scripts, file
+uploads and write queries then only touch that session's copy, and the
+engines opened on it use WAL with a busy timeout (see engine_registry).
+
+Limits:
+
+- per session: "max_bytes" in the engine config caps the file through
+  max_page_count, so a runaway load fails with "database or disk is full"
+- in total: a new session is refused once the directory would grow past the
+  quota, after idle sessions have been reaped
+- idle sessions (no script run for ``idle_s``) have their engines disposed
+  and their files deleted by a background reaper
+
+The limits are process-wide, so they come from the environment
+(SQLGENIUS_SESSION_IDLE_S, SQLGENIUS_SESSION_QUOTA_MB,
+SQLGENIUS_SESSION_MAX_MB) rather than from any one browser session.
+"""
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+import engine_registry
+import index_advisor
+import schema_catalog
+
+DEFAULT_ROOT = ".sqlgenius_sessions"
+DEFAULT_BASE_PATH = "sample.db"
+DEFAULT_IDLE_S = int(os.environ.get("SQLGENIUS_SESSION_IDLE_S", 30 * 60))
+DEFAULT_QUOTA_BYTES = int(os.environ.get("SQLGENIUS_SESSION_QUOTA_MB", 1024)) * 1024 * 1024
+DEFAULT_SESSION_MAX_BYTES = int(os.environ.get("SQLGENIUS_SESSION_MAX_MB", 256)) * 1024 * 1024
+
+_SUFFIXES = ("", "-wal", "-shm", "-journal")
+
+
+class QuotaExceededError(RuntimeError):
+    pass
+
+
+def new_session_id():
+    return uuid.uuid4().hex[:16]
+
+
+def _file_bytes(path):
+    total = 0
+    for suffix in _SUFFIXES:
+        try:
+            total += os.path.getsize(path + suffix)
+        except OSError:
+            pass
+    return total
+
+
+class SessionStore:
+    def __init__(self, root=DEFAULT_ROOT, base_path=DEFAULT_BASE_PATH, idle_s=DEFAULT_IDLE_S,
+                 quota_bytes=DEFAULT_QUOTA_BYTES, session_max_bytes=DEFAULT_SESSION_MAX_BYTES):
+        self.root = root
+        self.base_path = base_path
+        self.idle_s = idle_s
+        self.quota_bytes = quota_bytes
+        self.session_max_bytes = session_max_bytes
+        self.last_used = {}
+        self.stats = {"snapshots": 0, "reaped": 0, "refused": 0, "snapshot_ms_total": 0.0}
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        reaper = threading.Thread(target=self._reap_forever, name="sqlgenius-session-reaper", daemon=True)
+        reaper.start()
+
+    def _path(self, session_id):
+        if not session_id.isalnum():
+            raise ValueError(f"Invalid session id: {session_id!r}")
+        return os.path.join(self.root, f"{session_id}.db")
+
+    def _sessions(self):
+        return [name[:-3] for name in os.listdir(self.root) if name.endswith(".db")]
+
+    def usage_bytes(self):
+        return sum(_file_bytes(self._path(session_id)) for session_id in self._sessions())
+
+    def _snapshot(self, path):
+        start = time.perf_counter()
+        partial = path + ".partial"
+        target = sqlite3.connect(partial)
+        try:
+            if os.path.exists(self.base_path):
+                source = sqlite3.connect(f"file:{os.path.abspath(self.base_path)}?mode=ro", uri=True)
+                try:
+                    source.backup(target)
+                finally:
+                    source.close()
+            target.execute("PRAGMA journal_mode=WAL")
+        finally:
+            target.close()
+        # A half-written copy is never picked up by a concurrent run of the same session
+        os.replace(partial, path)
+        with self._lock:
+            self.stats["snapshots"] += 1
+            self.stats["snapshot_ms_total"] += (time.perf_counter() - start) * 1000
+
+    def exists(self, session_id):
+        """Whether the session still has its database (False once released or reaped)."""
+        return os.path.exists(self._path(session_id))
+
+    def config(self, session_id):
+        """
+        The SQLite engine config for this session, snapshotting the base on
+        first use. Raises QuotaExceededError when there is no room for a new copy.
+        """
+        path = self._path(session_id)
+        with self._lock:
+            self.last_used[session_id] = time.time()
+        if not os.path.exists(path):
+            base_bytes = _file_bytes(self.base_path)
+            if self.usage_bytes() + base_bytes > self.quota_bytes:
+                self.reap()
+                if self.usage_bytes() + base_bytes > self.quota_bytes:
+                    with self._lock:
+                        self.stats["refused"] += 1
+                    raise QuotaExceededError(
+                        f"Session storage is full ({self.usage_bytes() / 2**20:,.0f} of "
+                        f"{self.quota_bytes / 2**20:,.0f} MB); try again once idle sessions expire."
+                    )
+            self._snapshot(path)
+        return {"path": path, "max_bytes": self.session_max_bytes}
+
+    def release(self, session_id):
+        """Dispose the session's engines and delete its database."""
+        path = self._path(session_id)
+        for engine in engine_registry.dispose_sqlite(path):
+            schema_catalog.invalidate(engine)
+            index_advisor.clear(engine)
+        for suffix in _SUFFIXES:
+            try:
+                os.remove(path + suffix)
+            except FileNotFoundError:
+                pass
+        with self._lock:
+            self.last_used.pop(session_id, None)
+
+    def reap(self):
+        """Release sessions idle for longer than ``idle_s``, including files left by an earlier process."""
+        now = time.time()
+        for session_id in self._sessions():
+            with self._lock:
+                last_used = self.last_used.get(session_id)
+            if last_used is None:
+                path = self._path(session_id)
+                last_used = max((os.path.getmtime(path + s) for s in _SUFFIXES if os.path.exists(path + s)), default=now)
+            if now - last_used > self.idle_s:
+                self.release(session_id)
+                with self._lock:
+                    self.stats["reaped"] += 1
+
+    def _reap_forever(self):
+        while True:
+            time.sleep(min(self.idle_s / 4, 60))
+            try:
+                self.reap()
+            except Exception:
+                pass
+
+    def summary(self):
+        with self._lock:
+            stats = dict(self.stats)
+        snapshots = stats["snapshots"]
+        stats["avg_snapshot_ms"] = round(stats.pop("snapshot_ms_total") / snapshots, 1) if snapshots else 0.0
+        stats["sessions"] = len(self._sessions())
+        stats["disk_mb"] = round(self.usage_bytes() / (1024 * 1024), 2)
+        stats["quota_mb"] = round(self.quota_bytes / (1024 * 1024), 2)
+        stats["session_max_mb"] = round(self.session_max_bytes / (1024 * 1024), 2)
+        stats["idle_min"] = round(self.idle_s / 60, 1)
+        return stats
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """Return the process-wide session store."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = SessionStore()
+        return _store
@@ -0,0 +1,295 @@
+"""
+Per-stage span timing.
+
+Each stage of a request (schema load, prompt build, LLM call, SQL cleanup,
+validation, execution, Arrow conversion, rendering) is wrapped in a span that
+records its duration plus token / row / byte counts. Spans are:
+
+- attached to the current trace, which the sidebar draws as a waterfall
+- appended to a local JSONL log (``.sqlgenius_spans.jsonl``)
+- folded into per-stage latency reservoirs served as Prometheus text on
+  ``http://localhost:9464/metrics`` with p50 / p95 / p99 quantiles
+"""
+import contextvars
+import json
+import os
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+DEFAULT_LOG_PATH = ".sqlgenius_spans.jsonl"
+DEFAULT_METRICS_PORT = int(os.environ.get("SQLGENIUS_METRICS_PORT", "9464"))
+MAX_LOG_BYTES = 50 * 1024 * 1024
+RESERVOIR_SIZE = 2048
+QUANTILES = (0.5, 0.95, 0.99)
+COUNTED = ("tokens", "prompt_tokens", "completion_tokens", "rows", "bytes")
+
+_current = contextvars.ContextVar("sqlgenius_trace", default=None)
+
+
+class Trace:
+    """The spans of one user action, with offsets relative to its start."""
+
+    def __init__(self, name):
+        self.id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.started_at = time.perf_counter()
+        self.wall_start = time.time()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def record(self, stage, duration_s, started_at=None, **attrs):
+        """Add a span timed elsewhere (e.g. on a worker thread)."""
+        started_at = started_at if started_at is not None else time.perf_counter() - duration_s
+        span = {
+            "trace_id": self.id,
+            "trace": self.name,
+            "stage": stage,
+            "offset_ms": round((started_at - self.started_at) * 1000, 2),
+            "duration_ms": round(duration_s * 1000, 2),
+            **attrs,
+        }
+        with self._lock:
+            self.spans.append(span)
+        _finish(span)
+        return span
+
+    @property
+    def total_ms(self):
+        with self._lock:
+            return max((s["offset_ms"] + s["duration_ms"] for s in self.spans), default=0.0)
+
+
+@contextmanager
+def use(trace):
+    """Make ``trace`` the current trace, so spans opened anywhere below attach to it."""
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+
+
+def trace(name):
+    return use(Trace(name))
+
+
+def current():
+    return _current.get()
+
+
+@contextmanager
+def span(stage, **attrs):
+    """
+    Time a stage. Yields a dict the caller can add counts to
+    (``tokens``, ``rows``, ``bytes``, ...) before the span closes.
+    """
+    memory = _memory_enter() if tracemalloc.is_tracing() else None
+    started_at = time.perf_counter()
+    error = None
+    try:
+        yield attrs
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        duration_s = time.perf_counter() - started_at
+        if memory is not None:
+            attrs["peak_kb"] = _memory_exit(memory)
+        if error:
+            attrs["error"] = error
+        active = _current.get()
+        if active is not None:
+            active.record(stage, duration_s, started_at, **attrs)
+        else:
+            _finish({"trace_id": None, "trace": None, "stage": stage, "offset_ms": 0.0,
+                     "duration_ms": round(duration_s * 1000, 2), **attrs})
+
+
+# ----------- Peak Memory -----------
+# Only measured while tracemalloc is tracing (e.g. under benchmark.py). Nested
+# spans each reset the tracemalloc peak, so every open span keeps the highest
+# absolute value seen so far and hands it up to its parent when it closes.
+_memory_stack = contextvars.ContextVar("sqlgenius_memory_stack", default=())
+
+
+def _memory_enter():
+    current_bytes, peak = tracemalloc.get_traced_memory()
+    stack = _memory_stack.get()
+    if stack:
+        stack[-1]["max"] = max(stack[-1]["max"], peak)
+    tracemalloc.reset_peak()
+    frame = {"start": current_bytes, "max": current_bytes}
+    frame["token"] = _memory_stack.set(stack + (frame,))
+    return frame
+
+
+def _memory_exit(frame):
+    _, peak = tracemalloc.get_traced_memory()
+    frame["max"] = max(frame["max"], peak)
+    _memory_stack.reset(frame["token"])
+    stack = _memory_stack.get()
+    if stack:
+        stack[-1]["max"] = max(stack[-1]["max"], frame["max"])
+    return round((frame["max"] - frame["start"]) / 1024, 1)
+
+
+# ----------- Sinks -----------
+class StageMetrics:
+    def __init__(self, reservoir_size=RESERVOIR_SIZE):
+        self.reservoir_size = reservoir_size
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def observe(self, span):
+        with self._lock:
+            stage = self.stages.get(span["stage"])
+            if stage is None:
+                stage = self.stages[span["stage"]] = {
+                    "durations": deque(maxlen=self.reservoir_size),
+                    "count": 0,
+                    "sum": 0.0,
+                    "errors": 0,
+                    "peak_kb": 0.0,
+                    "counters": dict.fromkeys(COUNTED, 0),
+                }
+            seconds = span["duration_ms"] / 1000
+            stage["durations"].append(seconds)
+            stage["count"] += 1
+            stage["sum"] += seconds
+            stage["errors"] += 1 if span.get("error") else 0
+            stage["peak_kb"] = max(stage["peak_kb"], span.get("peak_kb") or 0.0)
+            for name in COUNTED:
+                value = span.get(name)
+                if isinstance(value, (int, float)):
+                    stage["counters"][name] += value
+
+    def summary(self):
+        """{stage: {count, p50_ms, p95_ms, p99_ms, ...}} over the recent reservoir."""
+        with self._lock:
+            snapshot = {name: (sorted(s["durations"]), s["count"], s["peak_kb"], dict(s["counters"]))
+                        for name, s in self.stages.items()}
+        result = {}
+        for name, (durations, count, peak_kb, counters) in sorted(snapshot.items()):
+            result[name] = {"count": count}
+            for q in QUANTILES:
+                result[name][f"p{int(q * 100)}_ms"] = round(_quantile(durations, q) * 1000, 2)
+            if peak_kb:
+                result[name]["peak_kb"] = peak_kb
+            result[name].update({counter: value for counter, value in counters.items() if value})
+        return result
+
+    def reset(self):
+        with self._lock:
+            self.stages.clear()
+
+    def prometheus(self):
+        with self._lock:
+            snapshot = {
+                name: (sorted(s["durations"]), s["count"], s["sum"], s["errors"], dict(s["counters"]))
+                for name, s in self.stages.items()
+            }
+        lines = [
+            "# HELP sqlgenius_stage_duration_seconds Duration of SQLGenius request stages.",
+            "# TYPE sqlgenius_stage_duration_seconds summary",
+        ]
+        for name, (durations, count, total, _, _) in sorted(snapshot.items()):
+            for q in QUANTILES:
+                lines.append(f'sqlgenius_stage_duration_seconds{{stage="{name}",quantile="{q}"}} {_quantile(durations, q):.6f}')
+            lines.append(f'sqlgenius_stage_duration_seconds_sum{{stage="{name}"}} {total:.6f}')
+            lines.append(f'sqlgenius_stage_duration_seconds_count{{stage="{name}"}} {count}')
+        lines += [
+            "# HELP sqlgenius_stage_errors_total Stages that raised.",
+            "# TYPE sqlgenius_stage_errors_total counter",
+        ]
+        for name, (_, _, _, errors, _) in sorted(snapshot.items()):
+            lines.append(f'sqlgenius_stage_errors_total{{stage="{name}"}} {errors}')
+        for counter in COUNTED:
+            lines += [
+                f"# HELP sqlgenius_stage_{counter}_total {counter.replace('_', ' ').capitalize()} handled per stage.",
+                f"# TYPE sqlgenius_stage_{counter}_total counter",
+            ]
+            for name, (_, _, _, _, counters) in sorted(snapshot.items()):
+                if counters[counter]:
+                    lines.append(f'sqlgenius_stage_{counter}_total{{stage="{name}"}} {counters[counter]}')
+        return "\n".join(lines) + "\n"
+
+
+def _quantile(values, q):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class SpanLog:
+    def __init__(self, path=DEFAULT_LOG_PATH, max_bytes=MAX_LOG_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def write(self, span):
+        line = json.dumps(dict(span, ts=round(time.time(), 3)), default=str) + "\n"
+        with self._lock:
+            try:
+                if os.path.exists(self.path) and os.path.getsize(self.path) > self.max_bytes:
+                    os.replace(self.path, self.path + ".1")
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(line)
+            except OSError:
+                pass
+
+
+metrics = StageMetrics()
+span_log = SpanLog()
+logging_enabled = True
+
+
+def _finish(span):
+    metrics.observe(span)
+    if logging_enabled:
+        span_log.write(span)
+
+
+# ----------- Metrics Endpoint -----------
+def _handler_class():
+    # http.server pulls in the email package; only paid for when the endpoint is started
+    from http.server import BaseHTTPRequestHandler
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/metrics", "/"):
+                self.send_error(404)
+                return
+            body = metrics.prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return MetricsHandler
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(port=DEFAULT_METRICS_PORT, host="127.0.0.1"):
+    """Serve /metrics from a daemon thread, once per process. Returns the port, or None if it is taken."""
+    from http.server import ThreadingHTTPServer
+
+    global _server
+    with _server_lock:
+        if _server is None:
+            try:
+                _server = ThreadingHTTPServer((host, port), _handler_class())
+            except OSError:
+                return None
+            threading.Thread(target=_server.serve_forever, name="sqlgenius-metrics", daemon=True).start()
+        return _server.server_address[1]
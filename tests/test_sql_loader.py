@@ -0,0 +1,26 @@
+import io
+import sqlite3
+
+import sqlalchemy as sa
+
+import sql_loader
+
+
+def test_loads_sqlite_iterdump(tmp_path):
+    source = sqlite3.connect(":memory:")
+    source.executescript("""
+        CREATE TABLE departments (id INTEGER PRIMARY KEY, name TEXT NOT NULL);
+        INSERT INTO departments VALUES (1, 'Engineering'), (2, 'R&D 50%');
+        CREATE INDEX departments_name ON departments (name);
+    """)
+    dump = "\n".join(source.iterdump())
+    assert dump.startswith("BEGIN TRANSACTION;") and dump.rstrip().endswith("COMMIT;")
+
+    engine = sa.create_engine(f"sqlite:///{tmp_path / 'loaded.db'}")
+    stats = sql_loader.load_script(engine, io.StringIO(dump))
+
+    assert stats["rows"] == 2
+    with engine.connect() as conn:
+        assert conn.exec_driver_sql("SELECT id, name FROM departments ORDER BY id").all() == [
+            (1, "Engineering"), (2, "R&D 50%"),
+        ]